@@ -7,7 +7,7 @@ Released under the GNU GPL version 3 or later
 
 '''
 
-import sys, os, time, socket, signal
+import sys, os, time, socket, signal, struct
 import fnmatch, errno, threading
 import serial, select
 import traceback
@@ -24,6 +24,12 @@ try:
 except ImportError:
     import Queue
 
+try:
+    import selectors
+except ImportError:
+    # python2 has no selectors module, fall back to select.select()
+    selectors = None
+
 from builtins import input
 
 from MAVProxy.modules.lib import textconsole
@@ -32,6 +38,9 @@ from MAVProxy.modules.lib import mp_module
 from MAVProxy.modules.lib import dumpstacks
 from MAVProxy.modules.lib import mp_substitute
 from MAVProxy.modules.lib import multiproc
+from MAVProxy.modules.lib import mp_scheduler
+from MAVProxy.modules.lib import mp_router
+from MAVProxy.modules.lib import mp_tlogindex
 from MAVProxy.modules.mavproxy_link import preferred_ports
 
 # adding all this allows pyinstaller to build a working windows executable
@@ -68,6 +77,10 @@ if __name__ == '__main__':
 #The MAVLink version being used (None, "1.0", "2.0")
 mavversion = None
 
+# largest write made when batching forwarded messages, kept below a
+# typical MTU so each UDP packet is not fragmented
+forward_max_write = 1400
+
 class MPStatus(object):
     '''hold status information about the mavproxy'''
     def __init__(self):
@@ -175,6 +188,9 @@ class MPState(object):
               MPSetting('baudrate', int, opts.baudrate, 'baudrate for new links', range=(0,10000000), increment=1),
               MPSetting('rtscts', bool, opts.rtscts, 'enable flow control'),
               MPSetting('select_timeout', float, 0.01, 'select timeout'),
+              MPSetting('fwdbatch', bool, True, 'Batch forwarded messages into one write per output'),
+              MPSetting('router', bool, opts.router, 'Route packets from links without decoding them'),
+              MPSetting('linkworkers', bool, opts.link_workers, 'Read new links in worker processes'),
 
               MPSetting('altreadout', int, 10, 'Altitude Readout',
                         range=(0,100), increment=1, tab='Announcements'),
@@ -242,7 +258,7 @@ class MPState(object):
         self.modules = []
         self.public_modules = {}
         self.functions = MAVFunctions()
-        self.select_extra = {}
+        self.select_extra = SelectExtra(self.select_changed)
         self.continue_mode = False
         self.aliases = {}
         import platform
@@ -252,6 +268,95 @@ class MPState(object):
         self.is_sitl = False
         self.start_time_s = time.time()
         self.attitude_time_s = 0
+        self.select_map = MPSelectMap()
+        self.scheduler = mp_scheduler.MPScheduler(on_error=scheduler_error)
+        # map of message type to the modules subscribed to it
+        self.mavlink_dispatch = {}
+        # packed messages waiting to be forwarded, by connection
+        self.forward_queue = {}
+        # message IDs decoded in router mode, None until calculated
+        self.router_msgids = None
+        self.router_decode_all = False
+        self.router_decode_all_modules = []
+
+    def modules_changed(self):
+        '''called when modules are loaded or unloaded, or change their
+        message subscriptions'''
+        self.mavlink_dispatch = {}
+        self.router_msgids = None
+
+    def router_decode(self, msgid):
+        '''return True if a message ID needs to be decoded in router mode.
+        Only the types the link module and loaded modules subscribe to are
+        decoded, unless a module subscribes to all messages'''
+        if self.router_msgids is None:
+            from MAVProxy.modules.mavproxy_link import routerPackets
+            types = set(routerPackets)
+            decode_all = []
+            for (mod,pm) in self.modules:
+                if not mod.overrides('mavlink_packet'):
+                    continue
+                if mod.mavlink_types is None:
+                    decode_all.append(mod.name)
+                    continue
+                types.update(mod.mavlink_types)
+            if decode_all and decode_all != self.router_decode_all_modules:
+                print("Router: all messages decoded for modules %s" % ', '.join(decode_all))
+            self.router_decode_all_modules = decode_all
+            self.router_decode_all = len(decode_all) > 0
+            self.router_msgids = mp_router.msgids_for_types(types)
+        if self.router_decode_all or self.status.watch is not None:
+            return True
+        return msgid in self.router_msgids
+
+    def mavlink_handlers(self, mtype):
+        '''return the list of modules to pass a message type to'''
+        handlers = self.mavlink_dispatch.get(mtype, None)
+        if handlers is None:
+            handlers = []
+            for (mod,pm) in self.modules:
+                if not mod.overrides('mavlink_packet'):
+                    continue
+                if mod.mavlink_types is None or mtype in mod.mavlink_types:
+                    handlers.append(mod)
+            self.mavlink_dispatch[mtype] = handlers
+        return handlers
+
+    def queue_forward(self, conn, msgbuf):
+        '''queue a packed message to be forwarded to conn. Queued messages
+        are written with as few writes per connection as possible by
+        flush_forward()'''
+        if not self.settings.fwdbatch:
+            conn.write(msgbuf)
+            return
+        if conn in self.forward_queue:
+            self.forward_queue[conn].append(msgbuf)
+        else:
+            self.forward_queue[conn] = [msgbuf]
+
+    def flush_forward(self):
+        '''write all queued forwarded messages'''
+        if not self.forward_queue:
+            return
+        queue = self.forward_queue
+        self.forward_queue = {}
+        for conn in queue:
+            bufs = queue[conn]
+            # join into writes of at most forward_max_write bytes so we don't
+            # produce UDP packets larger than the receiver expects
+            start = 0
+            size = 0
+            for i in range(len(bufs)):
+                if size > 0 and size + len(bufs[i]) > forward_max_write:
+                    conn.write(b''.join(bufs[start:i]))
+                    start = i
+                    size = 0
+                size += len(bufs[i])
+            conn.write(b''.join(bufs[start:]))
+
+    def select_changed(self):
+        '''called when links, outputs or select_extra fds are added or removed'''
+        self.select_map.dirty = True
 
     @property
     def mav_param(self):
@@ -286,6 +391,124 @@ class MPState(object):
         return self.mav_master[self.settings.link-1]
 
 
+class SelectExtra(dict):
+    '''the fd -> (read function, args) dict that modules add their own
+    fds to. Adding or removing an fd marks the main loop's fd map for
+    rebuilding'''
+    def __init__(self, changed):
+        dict.__init__(self)
+        self.changed = changed
+
+    def __setitem__(self, fd, value):
+        dict.__setitem__(self, fd, value)
+        self.changed()
+
+    def __delitem__(self, fd):
+        dict.__delitem__(self, fd)
+        self.changed()
+
+    def pop(self, *args):
+        ret = dict.pop(self, *args)
+        self.changed()
+        return ret
+
+    def popitem(self):
+        ret = dict.popitem(self)
+        self.changed()
+        return ret
+
+    def setdefault(self, fd, value=None):
+        ret = dict.setdefault(self, fd, value)
+        self.changed()
+        return ret
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self.changed()
+
+    def clear(self):
+        dict.clear(self)
+        self.changed()
+
+
+class MPSelectMap(object):
+    '''keep a fd -> handler map for the main loop. The map is only
+    rebuilt when it is marked dirty, so dispatching a ready fd is a
+    single dict lookup'''
+    def __init__(self):
+        self.handlers = {}
+        self.have_links = False
+        self.dirty = True
+        if selectors is not None:
+            self.selector = selectors.DefaultSelector()
+        else:
+            self.selector = None
+
+    def rebuild(self):
+        '''rebuild the handler map from the current links and outputs'''
+        handlers = {}
+        for master in mpstate.mav_master:
+            if getattr(master, 'link_worker', None) is not None:
+                handlers[master.link_worker.fileno()] = (process_master_worker, master)
+            elif master.fd is not None and not master.portdead:
+                handlers[master.fd] = (process_master, master)
+        for m in mpstate.mav_outputs:
+            handlers[m.fd] = (process_mavlink, m)
+        for sysid in mpstate.sysid_outputs:
+            m = mpstate.sysid_outputs[sysid]
+            handlers[m.fd] = (process_mavlink, m)
+        self.have_links = len(handlers) > 0
+        for fd in mpstate.select_extra:
+            handlers[fd] = (process_select_extra, fd)
+
+        if self.selector is not None:
+            for fd in list(self.handlers.keys()):
+                if fd not in handlers or handlers[fd][1] is not self.handlers[fd][1]:
+                    try:
+                        self.selector.unregister(fd)
+                    except (KeyError, ValueError):
+                        pass
+            for fd in handlers:
+                if fd in self.handlers and handlers[fd][1] is self.handlers[fd][1]:
+                    continue
+                try:
+                    self.selector.register(fd, selectors.EVENT_READ)
+                except KeyError:
+                    # fd number was reused by a new connection
+                    self.selector.unregister(fd)
+                    self.selector.register(fd, selectors.EVENT_READ)
+                except (ValueError, OSError) as e:
+                    print("Unable to select on fd %s: %s" % (fd, e))
+                    handlers.pop(fd)
+        self.handlers = handlers
+        self.dirty = False
+
+    def select(self, timeout):
+        '''wait for ready fds, returning a list of (fd, handler, arg)'''
+        if self.dirty:
+            self.rebuild()
+        if not self.have_links:
+            return None
+        if self.selector is not None:
+            try:
+                ready = [key.fd for (key, mask) in self.selector.select(timeout)]
+            except (OSError, ValueError):
+                # a registered fd was closed under us
+                self.dirty = True
+                return []
+        else:
+            try:
+                (ready, win, xin) = select.select(list(self.handlers.keys()), [], [], timeout)
+            except select.error:
+                self.dirty = True
+                return []
+        ret = []
+        for fd in ready:
+            if fd in self.handlers:
+                (fn, arg) = self.handlers[fd]
+                ret.append((fd, fn, arg))
+        return ret
+
 def get_mav_param(param, default=None):
     '''return a EEPROM parameter value'''
     return mpstate.mav_param.get(param, default)
@@ -319,14 +542,23 @@ def cmd_status(args):
         for pattern in args:
             mpstate.status.show(sys.stdout, pattern=pattern, verbose=verbose)
 
+def check_link_workers():
+    '''stop or restart link workers after a link reset or a change of
+    setup mode, as periodic tasks don't run in setup mode'''
+    link = mpstate.module('link')
+    if link is not None:
+        link.check_link_workers()
+
 def cmd_setup(args):
     mpstate.status.setup_mode = True
     mpstate.rl.set_prompt("")
+    check_link_workers()
 
 
 def cmd_reset(args):
     print("Resetting master")
     mpstate.master().reset()
+    check_link_workers()
 
 def cmd_watch(args):
     '''watch a mavlink packet pattern'''
@@ -367,6 +599,7 @@ def load_module(modname, quiet=False, **kwargs):
             module = m.init(mpstate, **kwargs)
             if isinstance(module, mp_module.MPModule):
                 mpstate.modules.append((module, m))
+                mpstate.modules_changed()
                 if not quiet:
                     if kwargs:
                         print("Loaded module %s with kwargs = %s" % (modname, kwargs))
@@ -393,7 +626,9 @@ def unload_module(modname):
         if m.name == modname:
             if hasattr(m, 'unload'):
                 m.unload()
+            mpstate.scheduler.remove_owner(m)
             mpstate.modules.remove((m,pm))
+            mpstate.modules_changed()
             print("Unloaded module %s" % modname)
             return True
     print("Unable to find module %s" % modname)
@@ -552,6 +787,7 @@ def process_stdin(line):
             mpstate.status.setup_mode = False
             mpstate.status.flightmode = "MAV"
             mpstate.rl.set_prompt("MAV> ")
+            check_link_workers()
             return
         if line != '+++':
             line += '\r'
@@ -635,6 +871,10 @@ def process_master(m):
     global mavversion
     if m.first_byte and mavversion is None:
         m.auto_mavlink_version(s)
+    if getattr(m, 'router', mpstate.settings.router):
+        process_master_router(m, s)
+        mpstate.flush_forward()
+        return
     msgs = m.mav.parse_buffer(s)
     if msgs:
         for msg in msgs:
@@ -648,8 +888,122 @@ def process_master(m):
                 if opts.show_errors:
                     mpstate.console.writeln("MAV error: %s" % msg)
                 mpstate.status.mav_error += 1
+    mpstate.flush_forward()
+
 
 
+def process_master_worker(m):
+    '''process packets from a MAVLink master that were read and framed by
+    a link worker process'''
+    worker = m.link_worker
+    frames = worker.receive()
+    if not worker.alive() and len(frames) == 0:
+        mpstate.console.error("link worker for %s died" % m.address)
+        m.link_worker = None
+        worker.close()
+        mpstate.select_changed()
+        return
+    if len(frames) == 0 or (mpstate.settings.compdebug & 1) != 0:
+        return
+
+    if mpstate.logqueue_raw:
+        mpstate.logqueue_raw.put(bytearray(b''.join([f[0] for f in frames])))
+
+    global mavversion
+    if m.first_byte and mavversion is None and frames[0][1] != -1:
+        m.auto_mavlink_version(frames[0][0])
+
+    if getattr(m, 'router', mpstate.settings.router):
+        route_frames(m, frames)
+        mpstate.flush_forward()
+        return
+
+    link = mpstate.module('link')
+    for (msgbuf, msgid, sysid, compid, seq) in frames:
+        if msgid == -1:
+            mpstate.status.mav_error += 1
+            continue
+        try:
+            msg = m.mav.decode(bytearray(msgbuf))
+        except mavutil.mavlink.MAVError as e:
+            if opts.show_errors:
+                mpstate.console.writeln("MAV error: %s" % e)
+            mpstate.status.mav_error += 1
+            continue
+        if link is not None:
+            link.master_callback(msg, m)
+        if sysid in mpstate.sysid_outputs:
+            continue
+        if getattr(m, '_timestamp', None) is None:
+            m.post_message(msg)
+    mpstate.flush_forward()
+
+def process_master_router(m, s):
+    '''route packets from a MAVLink master by system and message ID without
+    decoding them, only decoding the message types that are needed locally'''
+    if getattr(m, 'framer', None) is None:
+        m.framer = mp_router.MAVFramer()
+    route_frames(m, m.framer.frames(s))
+
+def route_frames(m, frames):
+    '''route framed packets from a master'''
+    link = mpstate.module('link')
+    if link is not None:
+        no_fwd = link.no_fwd_msgids()
+    else:
+        no_fwd = set()
+    for (msgbuf, msgid, sysid, compid, seq) in frames:
+        if msgid == -1:
+            if opts.show_errors:
+                mpstate.console.writeln("MAV error: %u bytes of non-MAVLink data" % len(msgbuf))
+            mpstate.status.mav_error += 1
+            continue
+
+        if sysid in mpstate.sysid_outputs:
+            # the message is handled by a specialised handler for this system
+            mpstate.queue_forward(mpstate.sysid_outputs[sysid], msgbuf)
+            if msgid != mavutil.mavlink.MAVLINK_MSG_ID_GLOBAL_POSITION_INT:
+                continue
+        else:
+            mpstate.status.counters['MasterIn'][m.linknum] += 1
+
+            if msgid != mavutil.mavlink.MAVLINK_MSG_ID_LOG_DATA and mpstate.logqueue:
+                # put link number in bottom 2 bits, as in the link module
+                usec = int(time.time() * 1.0e6)
+                usec = (usec & ~3) | m.linknum
+                mpstate.logqueue.put(bytearray(struct.pack('>Q', usec) + msgbuf))
+
+            if msgid == mavutil.mavlink.MAVLINK_MSG_ID_GLOBAL_POSITION_INT:
+                for osysid in mpstate.sysid_outputs:
+                    mpstate.queue_forward(mpstate.sysid_outputs[osysid], msgbuf)
+                if mpstate.settings.fwdpos:
+                    for link2 in mpstate.mav_master:
+                        if link2 != m:
+                            mpstate.queue_forward(link2, msgbuf)
+
+            if ((mpstate.settings.mavfwd_rate or msgid != mavutil.mavlink.MAVLINK_MSG_ID_REQUEST_DATA_STREAM) and
+                msgid not in no_fwd):
+                for r in mpstate.mav_outputs:
+                    mpstate.queue_forward(r, msgbuf)
+            if mpstate.settings.mavfwdmasters:
+                for omaster in mpstate.mav_master:
+                    if omaster != m:
+                        mpstate.queue_forward(omaster, msgbuf)
+
+        if not mpstate.router_decode(msgid):
+            mp_router.track_loss(m, msgid, sysid, compid, seq)
+            continue
+        try:
+            msg = m.mav.decode(bytearray(msgbuf))
+        except mavutil.mavlink.MAVError as e:
+            if opts.show_errors:
+                mpstate.console.writeln("MAV error: %s" % e)
+            mpstate.status.mav_error += 1
+            continue
+        if link is not None:
+            link.master_callback(msg, m, routed=True)
+        elif getattr(m, '_timestamp', None) is None:
+            m.post_message(msg)
 
 def process_mavlink(slave):
     '''process packets from MAVLink slaves, forwarding to the master'''
@@ -674,16 +1028,31 @@ def process_mavlink(slave):
             masters = [mpstate.master()]
         for m in msgs:
             msgbuf = m.get_msgbuf()
-            msgtype = m.get_type().upper()
             for master in masters:
-                master.write(msgbuf)
+                mpstate.queue_forward(master, msgbuf)
             if mpstate.status.watch:
+                msgtype = m.get_type().upper()
                 for watch_type in mpstate.status.watch:
                     if fnmatch.fnmatch(msgtype, watch_type.upper()):
                         mpstate.console.writeln('> '+ str(m))
                         break
+        mpstate.flush_forward()
     mpstate.status.counters['Slave'] += 1
 
+def process_select_extra(fd):
+    '''call the read function a module registered in select_extra'''
+    if not fd in mpstate.select_extra:
+        mpstate.select_changed()
+        return
+    try:
+        # call the registered read function
+        (fn, args) = mpstate.select_extra[fd]
+        fn(args)
+    except Exception as msg:
+        if mpstate.settings.moddebug == 1:
+            print(msg)
+        # on an exception, remove it from the select list
+        mpstate.select_extra.pop(fd)
 
 def mkdir_p(dir):
     '''like mkdir -p'''
@@ -699,16 +1068,42 @@ def mkdir_p(dir):
 
 def log_writer():
     '''log writing thread'''
+    last_checkpoint = time.time()
     while True:
         mpstate.logfile_raw.write(bytearray(mpstate.logqueue_raw.get()))
         timeout = time.time() + 10
         while not mpstate.logqueue_raw.empty() and time.time() < timeout:
             mpstate.logfile_raw.write(mpstate.logqueue_raw.get())
-        while not mpstate.logqueue.empty() and time.time() < timeout:
-            mpstate.logfile.write(mpstate.logqueue.get())
-        if mpstate.settings.flushlogs or time.time() >= timeout:
-            mpstate.logfile.flush()
-            mpstate.logfile_raw.flush()
+        with mpstate.loglock:
+            while not mpstate.logqueue.empty() and time.time() < timeout:
+                record = mpstate.logqueue.get()
+                mpstate.logfile.write(record)
+                if mpstate.logindex is not None:
+                    mpstate.logindex.add(record)
+            if mpstate.settings.flushlogs or time.time() >= timeout:
+                mpstate.logfile.flush()
+                mpstate.logfile_raw.flush()
+            if (mpstate.logindex is not None and
+                time.time() - last_checkpoint >= mpstate.logindex.checkpoint_interval):
+                # the index must not point past the log on disk
+                mpstate.logfile.flush()
+                mpstate.logindex.checkpoint()
+                last_checkpoint = time.time()
+
+def close_telemetry_logs():
+    '''write out the rest of the telemetry log and close its index, so
+    the index covers the whole log'''
+    if mpstate.logindex is None:
+        return
+    with mpstate.loglock:
+        while not mpstate.logqueue.empty():
+            record = mpstate.logqueue.get()
+            mpstate.logfile.write(record)
+            mpstate.logindex.add(record)
+        mpstate.logfile.flush()
+        mpstate.logfile_raw.flush()
+        mpstate.logindex.close()
+        mpstate.logindex = None
 
 # If state_basedir is NOT set then paths for logs and aircraft
 # directories are relative to mavproxy's cwd
@@ -752,6 +1147,29 @@ def log_paths():
             os.path.join(logdir, logname + '.raw'))
 
 
+def open_log_index(logpath_telem, mode):
+    '''open the sidecar index for the telemetry log, so offline tools can
+    find messages without reading the whole log'''
+    idxpath = mp_tlogindex.index_filename(logpath_telem)
+    offset = 0
+    if mode == 'ab' and os.path.exists(logpath_telem):
+        offset = os.path.getsize(logpath_telem)
+        index = mp_tlogindex.load_index(logpath_telem)
+        if offset > 0 and (index is None or index.end_offset() != offset):
+            # index the existing part of the log we are appending to
+            try:
+                mp_tlogindex.build_index(logpath_telem)
+            except Exception as e:
+                print("ERROR: indexing %s: %s" % (logpath_telem, e))
+                return None
+    elif os.path.exists(idxpath):
+        os.unlink(idxpath)
+    try:
+        return mp_tlogindex.TlogIndexWriter(idxpath, offset=offset)
+    except Exception as e:
+        print("ERROR: opening log index: %s" % e)
+        return None
+
 def open_telemetry_logs(logpath_telem, logpath_telem_raw):
     '''open log files'''
     if opts.append_log or opts.continue_mode:
@@ -762,6 +1180,7 @@ def open_telemetry_logs(logpath_telem, logpath_telem_raw):
     try:
         mpstate.logfile = open(logpath_telem, mode=mode)
         mpstate.logfile_raw = open(logpath_telem_raw, mode=mode)
+        mpstate.logindex = open_log_index(logpath_telem, mode)
         print("Log Directory: %s" % mpstate.status.logdir)
         print("Telemetry log: %s" % logpath_telem)
 
@@ -824,6 +1243,19 @@ def send_heartbeat(master):
         MAV_AUTOPILOT_NONE = 4
         master.mav.heartbeat_send(MAV_GROUND, MAV_AUTOPILOT_NONE)
 
+def print_module_exception(msg):
+    '''report an exception raised by a module callback'''
+    if mpstate.settings.moddebug == 1:
+        print(msg)
+    elif mpstate.settings.moddebug > 1:
+        exc_type, exc_value, exc_traceback = sys.exc_info()
+        traceback.print_exception(exc_type, exc_value, exc_traceback,
+                                  limit=2, file=sys.stdout)
+
+def scheduler_error(task, msg):
+    '''called when a scheduled module task raises an exception'''
+    print_module_exception(msg)
+
 def periodic_tasks():
     '''run periodic checks'''
     if mpstate.status.setup_mode:
@@ -842,21 +1274,22 @@ def periodic_tasks():
 
     if heartbeat_check_period.trigger():
         check_link_status()
+        # pick up reconnected serial ports
+        mpstate.select_changed()
 
     set_stream_rates()
 
-    # call optional module idle tasks. These are called at several hundred Hz
+    # run module callbacks registered with add_periodic() that are due
+    mpstate.scheduler.run()
+
+    # call optional module idle tasks. These are called at several hundred Hz,
+    # so modules that only need to run occasionally should use add_periodic()
     for (m,pm) in mpstate.modules:
-        if hasattr(m, 'idle_task'):
+        if m.has_idle_task():
             try:
                 m.idle_task()
             except Exception as msg:
-                if mpstate.settings.moddebug == 1:
-                    print(msg)
-                elif mpstate.settings.moddebug > 1:
-                    exc_type, exc_value, exc_traceback = sys.exc_info()
-                    traceback.print_exception(exc_type, exc_value, exc_traceback,
-                                              limit=2, file=sys.stdout)
+                print_module_exception(msg)
 
         # also see if the module should be unloaded:
         if m.needs_unloading:
@@ -902,71 +1335,30 @@ def main_loop():
                 process_stdin(c)
 
         for master in mpstate.mav_master:
-            if master.fd is None:
+            if master.fd is None and getattr(master, 'link_worker', None) is None:
                 if master.port.inWaiting() > 0:
                     process_master(master)
 
         periodic_tasks()
 
-        rin = []
-        for master in mpstate.mav_master:
-            if master.fd is not None and not master.portdead:
-                rin.append(master.fd)
-        for m in mpstate.mav_outputs:
-            rin.append(m.fd)
-        for sysid in mpstate.sysid_outputs:
-            m = mpstate.sysid_outputs[sysid]
-            rin.append(m.fd)
-        if rin == []:
-            time.sleep(0.0001)
-            continue
+        # forward anything queued by messages received outside process_master()
+        mpstate.flush_forward()
 
-        for fd in mpstate.select_extra:
-            rin.append(fd)
-        try:
-            (rin, win, xin) = select.select(rin, [], [], mpstate.settings.select_timeout)
-        except select.error:
+        ready = mpstate.select_map.select(mpstate.settings.select_timeout)
+        if ready is None:
+            time.sleep(0.0001)
             continue
 
         if mpstate is None:
             return
 
-        for fd in rin:
+        for (fd, fn, arg) in ready:
             if mpstate is None:
                   return
-            for master in mpstate.mav_master:
-                  if fd == master.fd:
-                        process_master(master)
-                        if mpstate is None:
-                              return
-                        continue
-            for m in mpstate.mav_outputs:
-                if fd == m.fd:
-                    process_mavlink(m)
-                    if mpstate is None:
-                          return
-                    continue
-
-            for sysid in mpstate.sysid_outputs:
-                m = mpstate.sysid_outputs[sysid]
-                if fd == m.fd:
-                    process_mavlink(m)
-                    if mpstate is None:
-                          return
-                    continue
-
-            # this allow modules to register their own file descriptors
-            # for the main select loop
-            if fd in mpstate.select_extra:
-                try:
-                    # call the registered read function
-                    (fn, args) = mpstate.select_extra[fd]
-                    fn(args)
-                except Exception as msg:
-                    if mpstate.settings.moddebug == 1:
-                        print(msg)
-                    # on an exception, remove it from the select list
-                    mpstate.select_extra.pop(fd)
+            fn(arg)
+            if fn is process_master and arg.fd != fd:
+                # the link has reconnected with a new fd
+                mpstate.select_changed()
 
 
 
@@ -1086,6 +1478,8 @@ if __name__ == '__main__':
     parser.add_option("--auto-protocol", action='store_true', default=False, help="Auto detect MAVLink protocol version")
     parser.add_option("--mavversion", type='choice', choices=['1.0', '2.0'] , help="Force MAVLink Version (1.0, 2.0). Otherwise autodetect version")
     parser.add_option("--nowait", action='store_true', default=False, help="don't wait for HEARTBEAT on startup")
+    parser.add_option("--link-workers", action='store_true', default=False, help="read and frame packets from each serial or UDP master in its own worker process")
+    parser.add_option("--router", action='store_true', default=False, help="route packets between links and outputs without decoding them, except for message types used by loaded modules")
     parser.add_option("-c", "--continue", dest='continue_mode', action='store_true', default=False, help="continue logs")
     parser.add_option("--dialect",  default="ardupilotmega", help="MAVLink dialect")
     parser.add_option("--rtscts",  action='store_true', help="enable hardware RTS/CTS flow control")
@@ -1135,6 +1529,8 @@ if __name__ == '__main__':
     mpstate.continue_mode = opts.continue_mode
     # queues for logging
     mpstate.logqueue = Queue.Queue()
+    mpstate.logindex = None
+    mpstate.loglock = threading.Lock()
     mpstate.logqueue_raw = Queue.Queue()
 
 
@@ -1308,6 +1704,7 @@ if __name__ == '__main__':
 
             else:
                 mpstate.status.exit = True
+                close_telemetry_logs()
                 sys.exit(1)
 
     if opts.profile:
@@ -1320,4 +1717,6 @@ if __name__ == '__main__':
             print("Unloading module %s" % m.name)
             m.unload()
 
+    close_telemetry_logs()
+
     sys.exit(1)
@@ -12,6 +12,8 @@ class Graph_UI(object):
         self.count = graph_count
         graph_count += 1
         self.xlim_pipe = multiproc.Pipe()
+        self.child = None
+        self.partial = False
 
     def display_graph(self, graphdef, flightmode_colourmap=None):
         '''display a graph'''
@@ -20,9 +22,15 @@ class Graph_UI(object):
         else:
             self.mestate.child_pipe_send_console.send("Expression: %s\n" % ' '.join(graphdef.expression.split()))
         #mestate.mlog.reduce_by_flightmodes(mestate.flightmode_selections)
+        self.graphdef = graphdef
+        self.flightmode_colourmap = flightmode_colourmap
+        self.draw()
 
-        #setup the graph, then pass to a new process and display
-        self.mg = grapher.MavGraph(flightmode_colourmap)
+    def build(self):
+        '''setup a MavGraph from the log data we have'''
+        mlog = self.mestate.mlog
+        graphdef = self.graphdef
+        self.mg = grapher.MavGraph(self.flightmode_colourmap)
         if self.mestate.settings.title is not None:
             self.mg.set_title(self.mestate.settings.title)
         else:
@@ -33,19 +41,71 @@ class Graph_UI(object):
         self.mg.set_linestyle(self.mestate.settings.linestyle)
         self.mg.set_show_flightmode(self.mestate.settings.show_flightmode)
         self.mg.set_legend(self.mestate.settings.legend)
-        self.mg.add_mav(self.mestate.mlog)
+        self.mg.add_mav(mlog, getattr(self.mestate, 'columns', None))
         for f in graphdef.expression.split():
             self.mg.add_field(f)
-        self.mg.process(self.mestate.flightmode_selections, self.mestate.mlog._flightmodes)
+        if mlog is not None:
+            flightmodes = mlog._flightmodes
+        else:
+            flightmodes = []
+        self.mg.process(self.mestate.flightmode_selections, flightmodes)
         self.lenmavlist = len(self.mg.mav_list)
         #Important - mg.mav_list is the full logfile and can be very large in size
         #To avoid slowdowns in Windows (which copies the vars to the new process)
         #We need to empty this var when we're finished with it
         self.mg.mav_list = []
-        child = multiproc.Process(target=self.mg.show, args=[self.lenmavlist,], kwargs={"xlim_pipe" : self.xlim_pipe})
-        child.start()
+        self.mg.columns_list = []
+        if mlog is not None:
+            mlog.rewind()
+        return flightmodes
+
+    def loading(self):
+        '''return True if the log is still being read into columns'''
+        return getattr(self.mestate, 'loader', None) is not None
+
+    def is_drawn(self, i):
+        '''return True if field i has a line that refresh() can update'''
+        y = self.mg.y[i]
+        return len(y) > 0 and not isinstance(y[0], str)
+
+    def draw(self):
+        '''setup the graph from the log data we have, then pass to a new
+        process and display'''
+        # while a log is loading its columns are only partly read, and
+        # the graph is updated with refresh() as more of the log is read
+        self.partial = self.loading()
+        self.build()
+        self.drawn = [self.is_drawn(i) for i in range(len(self.mg.y))]
+        self.child = multiproc.Process(target=self.mg.show, args=[self.lenmavlist,], kwargs={"xlim_pipe" : self.xlim_pipe})
+        self.child.start()
         self.xlim_pipe[1].close()
-        self.mestate.mlog.rewind()
+
+    def refresh(self):
+        '''update the graph with the log data read since it was drawn.
+        The data is sent to the graph process, which keeps its view. A
+        new graph is only drawn once the log has loaded, and only if
+        fields that had no data at first now have some. Returns False if
+        the graph has been closed'''
+        if self.child is None or not self.child.is_alive():
+            return False
+        self.partial = self.loading()
+        flightmodes = self.build()
+        if not self.partial and [i for i in range(len(self.drawn))
+                                 if not self.drawn[i] and len(self.mg.y[i]) > 0]:
+            self.child.terminate()
+            self.xlim_pipe[0].close()
+            xlim = self.xlim
+            self.xlim = None
+            self.xlim_pipe = multiproc.Pipe()
+            self.draw()
+            if xlim is not None:
+                self.set_xlim(xlim)
+            return True
+        try:
+            self.xlim_pipe[0].send(('data', self.mg.x, self.mg.y, flightmodes))
+        except IOError:
+            return False
+        return True
 
     def check_xlim_change(self):
         '''check for new X bounds'''
@@ -13,6 +13,11 @@ from pymavlink.mavextra import *
 import pylab
 from pymavlink import mavutil
 import threading
+import copy
+import numpy
+from MAVProxy.modules.lib import mp_colexpr
+from MAVProxy.modules.lib import mp_intervals
+from MAVProxy.modules.lib import multiproc
 
 colors = [ 'red', 'green', 'blue', 'orange', 'olive', 'black', 'grey', 'yellow', 'brown', 'darkcyan',
            'cornflowerblue', 'darkmagenta', 'deeppink', 'darkred']
@@ -41,11 +46,62 @@ edge_colour = (0.1, 0.1, 0.1)
 
 graph_num = 1
 
+# lines with fewer points than this are drawn in full
+LOD_MIN_POINTS = 5000
+
+def minmax_decimate(x, y, i0, i1, nbins):
+    '''return x and y between indexes i0 and i1, reduced to about 2*nbins
+    points. The lowest and highest point of each bin are kept, along with
+    the first and last points, so a line drawn nbins pixels wide looks the
+    same as with all points'''
+    n = i1 - i0
+    if n <= 2*nbins:
+        return (x[i0:i1], y[i0:i1])
+    chunk = int(math.ceil(n / float(nbins)))
+    nfull = n // chunk
+    end = i0 + nfull*chunk
+    yb = y[i0:end].reshape(nfull, chunk)
+    imin = numpy.argmin(yb, axis=1)
+    imax = numpy.argmax(yb, axis=1)
+    base = i0 + numpy.arange(nfull) * chunk
+    idx = [numpy.array([i0]), numpy.empty(2*nfull, dtype=numpy.int64)]
+    # keep the two points of each bin in time order
+    idx[1][0::2] = base + numpy.minimum(imin, imax)
+    idx[1][1::2] = base + numpy.maximum(imin, imax)
+    if end < i1:
+        rest = y[end:i1]
+        idx.append(end + numpy.array(sorted([numpy.argmin(rest), numpy.argmax(rest)])))
+    idx.append(numpy.array([i1-1]))
+    idx = numpy.unique(numpy.concatenate(idx))
+    return (x[idx], y[idx])
+
+def process_log_file(graph, filename, open_args, cache, flightmode_selections, field_indexes=None):
+    '''parse one log for a graph, in a worker process. Only the fields
+    in field_indexes are done, or all fields if it is None. Returns the x
+    and y data for each field as arrays'''
+    mlog = mavutil.mavlink_connection(filename, **open_args)
+    if not graph.flightmode_list:
+        # start the time conversion at the same message for every group
+        # of fields, so their times round the same way
+        m = mlog.recv_match(type=list(graph.msg_types))
+        if m is not None:
+            graph.timestamp_to_days(m._timestamp)
+        mlog.rewind()
+    columns = None
+    if cache:
+        from MAVProxy.modules.lib import mp_logcache
+        columns = mp_logcache.load_columns(filename, mlog)
+    graph.process_mav(mlog, flightmode_selections, columns, field_indexes)
+    return ([numpy.asarray(x) for x in graph.x],
+            [numpy.asarray(y) for y in graph.y])
+
 class MavGraph(object):
     def __init__(self, flightmode_colourmap=None):
         self.lowest_x = None
         self.highest_x = None
         self.mav_list = []
+        self.columns_list = []
+        self.log_files = []
         self.fields = []
         self.condition = None
         self.xaxis = None
@@ -65,6 +121,7 @@ class MavGraph(object):
         else:
             self.flightmode_colourmap = {}
         self.flightmode_list = None
+        self.flightmode_index = None
         self.ax1 = None
         self.locator = None
         global graph_num
@@ -77,14 +134,31 @@ class MavGraph(object):
         self.tday_base = None
         self.tday_basetime = None
         self.title = None
+        # (line, x, y) for lines drawn decimated, with all their points
+        self.lod_lines = []
+        # field index -> line, for updating the data of a drawn graph
+        self.field_lines = {}
+        self.data_xlim = None
 
     def add_field(self, field):
         '''add another field to plot'''
         self.fields.append(field)
 
-    def add_mav(self, mav):
-        '''add another data source to plot'''
+    def add_mav(self, mav, columns=None):
+        '''add another data source to plot, with optional columns from
+        mp_logcache for the same log'''
         self.mav_list.append(mav)
+        self.columns_list.append(columns)
+
+    def add_log(self, filename, cache=False, **open_args):
+        '''add a log to plot by filename. The log is opened and parsed
+        when the graph is processed, which can be done in a worker
+        process. open_args are passed to mavutil.mavlink_connection()'''
+        self.log_files.append((filename, open_args, cache))
+
+    def num_logs(self):
+        '''return the number of logs being plotted'''
+        return len(self.mav_list) + len(self.log_files)
 
     def set_condition(self, condition):
         '''set graph condition'''
@@ -177,6 +251,7 @@ class MavGraph(object):
         xrange = axsubplot.get_xbound()
         xlim = axsubplot.get_xlim()
         self.setup_xrange(xrange[1] - xrange[0])
+        self.update_lod(xlim)
         if self.draw_events == 0:
             # ignore limit change before first draw event
             return
@@ -185,6 +260,43 @@ class MavGraph(object):
             #print('send', self.graph_num, xlim)
             self.xlim_pipe[1].send(xlim)
 
+    def lod_data(self, x, y):
+        '''return x and y as arrays if they should be drawn decimated,
+        otherwise None'''
+        if len(x) < LOD_MIN_POINTS:
+            return None
+        try:
+            x = numpy.asarray(x, dtype=numpy.float64)
+            y = numpy.asarray(y, dtype=numpy.float64)
+        except (TypeError, ValueError):
+            return None
+        if numpy.any(numpy.diff(x) < 0):
+            # points from several logs that overlap in time
+            return None
+        return (x, y)
+
+    def lod_range(self, x, xlim):
+        '''return the indexes of the points in x to draw for an X range,
+        including a point each side so lines reach the edges'''
+        i0 = max(numpy.searchsorted(x, xlim[0], side='left') - 1, 0)
+        i1 = min(numpy.searchsorted(x, xlim[1], side='right') + 1, len(x))
+        return (i0, i1)
+
+    def lod_bins(self):
+        '''number of bins to decimate to, one per pixel of plot width'''
+        return max(int(self.ax1.bbox.width), 100)
+
+    def update_lod(self, xlim):
+        '''decimate lines again for a new X range, so that zooming in
+        shows all points'''
+        if not self.lod_lines:
+            return
+        nbins = self.lod_bins()
+        for (line, x, y) in self.lod_lines:
+            (i0, i1) = self.lod_range(x, xlim)
+            (xd, yd) = minmax_decimate(x, y, i0, i1, nbins)
+            line.set_data(xd, yd)
+
     def draw_event(self, evt):
         '''called on draw events'''
         self.draw_events += 1
@@ -228,6 +340,8 @@ class MavGraph(object):
                 if ax2 is None:
                     ax2 = self.ax1.twinx()
                     ax2.format_coord = self.make_format(ax2, self.ax1)
+                    if not self.xaxis:
+                        ax2.callbacks.connect('xlim_changed', self.xlim_changed)
                 ax = ax2
                 if not self.xaxis:
                     ax2.xaxis.set_major_locator(self.locator)
@@ -249,8 +363,9 @@ class MavGraph(object):
                     linestyle = self.linestyle
                 else:
                     linestyle = 'None'
-                ax.plot(x[i], y[i], color=color, label=fields[i],
-                        linestyle=linestyle, marker=marker)
+                lines = ax.plot(x[i], y[i], color=color, label=fields[i],
+                                linestyle=linestyle, marker=marker)
+                self.field_lines[i] = lines[0]
             else:
                 if self.marker is not None:
                     marker = self.marker
@@ -287,25 +402,24 @@ class MavGraph(object):
                                 alpha=0.3,
                                 verticalalignment='baseline')
                 else:
-                    ax.plot_date(x[i], y[i], color=color, label=fields[i],
-                                 linestyle=linestyle, marker=marker, tz=None)
+                    lod = self.lod_data(x[i], y[i])
+                    if lod is None:
+                        lines = ax.plot_date(x[i], y[i], color=color, label=fields[i],
+                                             linestyle=linestyle, marker=marker, tz=None)
+                    else:
+                        # draw at screen resolution, see update_lod()
+                        (xa, ya) = lod
+                        (xd, yd) = minmax_decimate(xa, ya, 0, len(xa), self.lod_bins())
+                        lines = ax.plot_date(xd, yd, color=color, label=fields[i],
+                                             linestyle=linestyle, marker=marker, tz=None)
+                        self.lod_lines.append((lines[0], xa, ya))
+                    self.field_lines[i] = lines[0]
 
             empty = False
-            
+
+        self.data_xlim = self.ax1.get_xlim()
         if self.show_flightmode:
-            alpha = 0.3
-            xlim = self.ax1.get_xlim()
-            for i in range(len(self.flightmode_list)):
-                (mode_name,t0,t1) = self.flightmode_list[i]
-                c = self.flightmode_colour(mode_name)
-                tday0 = self.timestamp_to_days(t0)
-                tday1 = self.timestamp_to_days(t1)
-                if tday0 > xlim[1] or tday1 < xlim[0]:
-                    continue
-                tday0 = max(tday0, xlim[0])
-                tday1 = min(tday1, xlim[1])
-                self.ax1.axvspan(tday0, tday1, fc=c, ec=edge_colour, alpha=alpha)
-                self.modes_plotted[mode_name] = (c, alpha)
+            self.plot_flightmodes(self.data_xlim)
 
         if empty:
             print("No data to graph")
@@ -315,27 +429,92 @@ class MavGraph(object):
             pylab.title(title)
 
         if self.show_flightmode:
-            mode_patches = []
-            for mode in self.modes_plotted.keys():
-                (color, alpha) = self.modes_plotted[mode]
-                mode_patches.append(matplotlib.patches.Patch(color=color,
-                                                             label=mode, alpha=alpha*1.5))
-            labels = [patch.get_label() for patch in mode_patches]
-            if ax1_labels != []:
-                patches_legend = matplotlib.pyplot.legend(mode_patches, labels, loc=self.legend_flightmode)
-                self.fig.gca().add_artist(patches_legend)
-            else:
-                pylab.legend(mode_patches, labels)
+            self.flightmode_legend(ax1_labels != [])
 
         if ax1_labels != []:
             self.ax1.legend(ax1_labels,loc=self.legend)
         if ax2_labels != []:
             ax2.legend(ax2_labels,loc=self.legend2)
 
+    def plot_flightmodes(self, xlim):
+        '''shade the flight modes within an X range'''
+        alpha = 0.3
+        for i in range(len(self.flightmode_list)):
+            (mode_name,t0,t1) = self.flightmode_list[i]
+            c = self.flightmode_colour(mode_name)
+            tday0 = self.timestamp_to_days(t0)
+            tday1 = self.timestamp_to_days(t1)
+            if tday0 > xlim[1] or tday1 < xlim[0]:
+                continue
+            tday0 = max(tday0, xlim[0])
+            tday1 = min(tday1, xlim[1])
+            self.ax1.axvspan(tday0, tday1, fc=c, ec=edge_colour, alpha=alpha)
+            self.modes_plotted[mode_name] = (c, alpha)
+
+    def flightmode_patches(self):
+        '''return legend patches for the flight modes shaded'''
+        mode_patches = []
+        for mode in self.modes_plotted.keys():
+            (color, alpha) = self.modes_plotted[mode]
+            mode_patches.append(matplotlib.patches.Patch(color=color,
+                                                         label=mode, alpha=alpha*1.5))
+        return mode_patches
+
+    def flightmode_legend(self, have_labels):
+        '''add a legend for the flight modes shaded'''
+        mode_patches = self.flightmode_patches()
+        labels = [patch.get_label() for patch in mode_patches]
+        if have_labels:
+            patches_legend = matplotlib.pyplot.legend(mode_patches, labels, loc=self.legend_flightmode)
+            self.fig.gca().add_artist(patches_legend)
+        else:
+            pylab.legend(mode_patches, labels)
+
+    def update_data(self, x, y, flightmode_list):
+        '''replace the points of the lines drawn by plotit() with more of
+        a log as it loads. The view is kept if it has been zoomed or
+        panned, otherwise it grows to show all the data'''
+        if self.ax1 is None:
+            return
+        whole_view = self.ax1.get_xlim() == self.data_xlim
+        self.lod_lines = []
+        nbins = self.lod_bins()
+        for i in self.field_lines:
+            line = self.field_lines[i]
+            lod = None
+            if not self.xaxis:
+                lod = self.lod_data(x[i], y[i])
+            if lod is None:
+                line.set_data(x[i], y[i])
+            else:
+                (xa, ya) = lod
+                line.set_data(*minmax_decimate(xa, ya, 0, len(xa), nbins))
+                self.lod_lines.append((line, xa, ya))
+        if whole_view:
+            for ax in self.fig.axes:
+                ax.relim()
+                ax.autoscale_view()
+            self.data_xlim = self.ax1.get_xlim()
+            if self.fig.canvas.toolbar is not None:
+                # the home view is now all of the data
+                self.fig.canvas.toolbar.update()
+        if self.show_flightmode and not self.modes_plotted and flightmode_list:
+            # flight modes are only known once a log has loaded
+            self.flightmode_list = flightmode_list
+            self.plot_flightmodes(self.data_xlim)
+            # an extra legend, keeping the legends of the fields
+            mode_patches = self.flightmode_patches()
+            legend = matplotlib.legend.Legend(self.ax1, mode_patches,
+                                              [patch.get_label() for patch in mode_patches],
+                                              loc=self.legend_flightmode)
+            self.ax1.add_artist(legend)
+        self.update_lod(self.ax1.get_xlim())
+        self.fig.canvas.draw_idle()
+
     def add_data(self, t, msg, vars):
         '''add some data'''
         mtype = msg.get_type()
-        for i in range(0, len(self.fields)):
+        for i in self.field_indexes:
             if mtype not in self.field_types[i]:
                 continue
             f = self.fields[i]
@@ -373,59 +552,112 @@ class MavGraph(object):
         sec_to_days = 1.0 / (60*60*24)
         return self.tday_base + (timestamp - self.tday_basetime) * sec_to_days
 
-    def process_mav(self, mlog, flightmode_selections):
-        '''process one file'''
-        self.vars = {}
-        idx = 0
-        all_false = True
-        for s in flightmode_selections:
-            if s:
-                all_false = False
-
-        # pre-calc right/left axes
-        self.num_fields = len(self.fields)
-        for i in range(0, self.num_fields):
-            f = self.fields[i]
-            if f.endswith(":2"):
-                self.axes[i] = 2
-                f = f[:-2]
-            if f.endswith(":1"):
-                self.first_only[i] = True
-                f = f[:-2]
-            self.fields[i] = f
-
-        # see which fields are simple
-        self.simple_field = []
-        for i in range(0, self.num_fields):
-            f = self.fields[i]
-            m = re.match('^([A-Z][A-Z0-9_]*)[.]([A-Za-z_][A-Za-z0-9_]*)$', f)
-            if m is None:
-                self.simple_field.append(None)
+    def timestamps_to_days(self, timestamps):
+        '''convert an array of log timestamps to days'''
+        if len(timestamps) > 0 and self.tday_base is None:
+            self.timestamp_to_days(timestamps[0])
+        if self.tday_base is None:
+            return numpy.zeros(len(timestamps))
+        sec_to_days = 1.0 / (60*60*24)
+        return self.tday_base + (timestamps - self.tday_basetime) * sec_to_days
+
+    def process_columns(self, columns, flightmode_selections, field_indexes):
+        '''add data from log columns for the fields in field_indexes that
+        can be evaluated over whole columns. Returns the indexes of the
+        fields that still need to be done per message'''
+        remaining = list(field_indexes)
+        condition = None
+        if self.condition:
+            condition = mp_colexpr.compile_expression(self.condition)
+            if condition is None:
+                return remaining
+        mode_filter = self.flightmode_index is not None and True in flightmode_selections
+        xaxis = None
+        if self.xaxis:
+            xaxis = mp_colexpr.compile_expression(self.xaxis)
+            if xaxis is None:
+                return remaining
+        remaining = []
+        for i in field_indexes:
+            expression = mp_colexpr.compile_expression(self.fields[i])
+            if expression is None:
+                remaining.append(i)
+                continue
+            # fields are evaluated at each message of the types they use
+            (seq, t) = mp_colexpr.trigger_sequence(columns, self.field_types[i])
+            result = expression.evaluate(columns, seq)
+            if result is None:
+                remaining.append(i)
+                continue
+            (v, valid) = result
+            if xaxis is None:
+                xv = self.timestamps_to_days(t)
             else:
-                self.simple_field.append((m.group(1),m.group(2)))
+                result = xaxis.evaluate(columns, seq)
+                if result is None:
+                    remaining.append(i)
+                    continue
+                (xv, xvalid) = result
+                valid = valid & xvalid
+            if condition is not None:
+                # the condition at each message, using the latest
+                # values of the other message types it refers to
+                cmask = condition.mask(columns, seq)
+                if cmask is None:
+                    remaining.append(i)
+                    continue
+                valid = valid & cmask
+            if mode_filter:
+                valid = valid & self.flightmode_index.mask(t, flightmode_selections)
+            self.x[i] = numpy.concatenate((self.x[i], xv[valid]))
+            self.y[i] = numpy.concatenate((self.y[i], v[valid]))
+        return remaining
+
+    def process_mav(self, mlog, flightmode_selections, columns=None, field_indexes=None):
+        '''process one file, for the fields in field_indexes or all
+        fields if it is None'''
+        self.vars = {}
+        if field_indexes is None:
+            field_indexes = list(range(0, self.num_fields))
+        mode_filter = self.flightmode_index is not None and True in flightmode_selections
 
         if len(self.flightmode_list) > 0:
             # prime the timestamp conversion
             self.timestamp_to_days(self.flightmode_list[0][1])
 
+        if columns is not None:
+            self.field_indexes = self.process_columns(columns, flightmode_selections, field_indexes)
+        else:
+            self.field_indexes = list(field_indexes)
+        if not self.field_indexes:
+            return
+        if mlog is None:
+            # the log is still being loaded, and only columns are ready
+            for i in self.field_indexes:
+                print("Can't graph %s until the log has loaded" % self.fields[i])
+            return
+        msg_types = set()
+        for i in self.field_indexes:
+            # another log may have been added from columns
+            self.x[i] = list(self.x[i])
+            self.y[i] = list(self.y[i])
+            msg_types = msg_types.union(self.field_types[i])
+
         while True:
-            msg = mlog.recv_match(type=self.msg_types)
+            msg = mlog.recv_match(type=msg_types)
             if msg is None:
                 break
-            if msg.get_type() not in self.msg_types:
+            if msg.get_type() not in msg_types:
                 continue
             if self.condition:
                 if not mavutil.evaluate_condition(self.condition, mlog.messages):
                     continue
+            if mode_filter:
+                idx = self.flightmode_index.locate_one(msg._timestamp)
+                if idx >= len(flightmode_selections) or not flightmode_selections[idx]:
+                    continue
             tdays = self.timestamp_to_days(msg._timestamp)
-
-            if all_false or len(flightmode_selections) == 0:
-                self.add_data(tdays, msg, mlog.messages)
-            else:
-                if idx < len(self.flightmode_list) and msg._timestamp >= self.flightmode_list[idx][2]:
-                    idx += 1
-                elif (idx < len(flightmode_selections) and flightmode_selections[idx]):
-                    self.add_data(tdays, msg, mlog.messages)
+            self.add_data(tdays, msg, mlog.messages)
 
     def xlim_change_check(self, idx):
         '''handle xlim change requests from queue'''
@@ -434,6 +666,11 @@ class MavGraph(object):
         xlim = self.xlim_pipe[1].recv()
         if xlim is None:
             return
+        if isinstance(xlim[0], str) and xlim[0] == 'data':
+            # new data for the lines, see Graph_UI.refresh()
+            (x, y, flightmode_list) = xlim[1:]
+            self.update_data(x, y, flightmode_list)
+            return
         #print("recv: ", self.graph_num, xlim)
         if self.ax1 is not None and xlim != self.xlim:
             self.xlim = xlim
@@ -449,13 +686,15 @@ class MavGraph(object):
         self.xlim_change_check(0)
         threading.Timer(0.1, self.xlim_timer).start()
 
-    def process(self, flightmode_selections, _flightmodes, block=True):
-        '''process and display graph'''
+    def process(self, flightmode_selections, _flightmodes, block=True, jobs=1):
+        '''process and display graph. Logs added with add_log() are
+        parsed in up to jobs worker processes'''
         self.msg_types = set()
         self.multiplier = []
         self.field_types = []
         self.xlim = None
         self.flightmode_list = _flightmodes
+        self.flightmode_index = mp_intervals.flightmode_intervals(_flightmodes)
 
         # work out msg types we are interested in
         self.x = []
@@ -473,11 +712,95 @@ class MavGraph(object):
             self.axes.append(1)
             self.first_only.append(False)
 
+        # pre-calc right/left axes
+        self.num_fields = len(self.fields)
+        for i in range(0, self.num_fields):
+            f = self.fields[i]
+            if f.endswith(":2"):
+                self.axes[i] = 2
+                f = f[:-2]
+            if f.endswith(":1"):
+                self.first_only[i] = True
+                f = f[:-2]
+            self.fields[i] = f
+
+        # see which fields are simple
+        self.simple_field = []
+        for i in range(0, self.num_fields):
+            f = self.fields[i]
+            m = re.match('^([A-Z][A-Z0-9_]*)[.]([A-Za-z_][A-Za-z0-9_]*)$', f)
+            if m is None:
+                self.simple_field.append(None)
+            else:
+                self.simple_field.append((m.group(1),m.group(2)))
+
         timeshift = self.timeshift
 
         for fi in range(0, len(self.mav_list)):
             mlog = self.mav_list[fi]
-            self.process_mav(mlog, flightmode_selections)
+            columns = None
+            if fi < len(self.columns_list):
+                columns = self.columns_list[fi]
+            self.process_mav(mlog, flightmode_selections, columns)
+
+        if self.log_files:
+            self.process_log_files(flightmode_selections, jobs)
+
+    def field_groups(self, ngroups):
+        '''split the fields into up to ngroups groups of field indexes.
+        Fields that use the same message types are kept together, so
+        that each group reads different messages from a log'''
+        by_types = {}
+        for i in range(0, self.num_fields):
+            by_types.setdefault(frozenset(self.field_types[i]), []).append(i)
+        groups = [[] for g in range(min(ngroups, len(by_types)))]
+        for indexes in sorted(by_types.values(), key=len, reverse=True):
+            min(groups, key=len).extend(indexes)
+        return [sorted(g) for g in groups]
+
+    def process_log_files(self, flightmode_selections, jobs):
+        '''parse the logs added with add_log(), using jobs worker processes.
+        With fewer logs than jobs, the fields of each log are also split
+        between workers'''
+        # the workers get a copy of the graph setup without any data
+        template = copy.copy(self)
+        template.mav_list = []
+        template.columns_list = []
+        template.log_files = []
+        template.x = [[] for f in self.fields]
+        template.y = [[] for f in self.fields]
+        groups = [None]
+        if jobs > len(self.log_files):
+            groups = self.field_groups(jobs // len(self.log_files))
+        # one unit of work for each log and group of fields
+        work = [(template, filename, open_args, cache, flightmode_selections, g)
+                for (filename, open_args, cache) in self.log_files for g in groups]
+        if jobs > 1 and len(work) > 1:
+            pool = multiproc.Pool(min(jobs, len(work)))
+            pending = [pool.apply_async(process_log_file, w) for w in work]
+            pool.close()
+            done = [p.get() for p in pending]
+            pool.join()
+        else:
+            done = [process_log_file(copy.deepcopy(w[0]), *w[1:]) for w in work]
+        # join the fields of each log back together
+        results = []
+        for n in range(0, len(done), len(groups)):
+            (x, y) = done[n]
+            (x, y) = (list(x), list(y))
+            for k in range(1, len(groups)):
+                for i in groups[k]:
+                    x[i] = done[n+k][0][i]
+                    y[i] = done[n+k][1][i]
+            results.append((x, y))
+        for (x, y) in results:
+            for i in range(0, self.num_fields):
+                if len(self.x[i]) == 0:
+                    # y may be text
+                    (self.x[i], self.y[i]) = (x[i], y[i])
+                elif len(x[i]) > 0:
+                    self.x[i] = numpy.concatenate((self.x[i], x[i]))
+                    self.y[i] = numpy.concatenate((self.y[i], y[i]))
 
 
     def show(self, lenmavlist, block=True, xlim_pipe=None, output=None):
@@ -556,6 +879,8 @@ if __name__ == "__main__":
     parser.add_argument("--dialect", default="ardupilotmega", help="MAVLink dialect")
     parser.add_argument("--output", default=None, help="provide an output format")
     parser.add_argument("--timeshift", type=float, default=0, help="shift time on first graph in seconds")
+    parser.add_argument("--cache", action='store_true', help="cache log data as columns next to each log")
+    parser.add_argument("--jobs", type=int, default=1, help="number of worker processes parsing logs and fields in parallel")
     parser.add_argument("logs_fields", metavar="<LOG or FIELD>", nargs="+")
     args = parser.parse_args()
 
@@ -563,11 +888,21 @@ if __name__ == "__main__":
 
     filenames = []
     for f in args.logs_fields:
-        if os.path.exists(f):
+        if os.path.exists(f) and args.jobs > 1:
+            # parsed in a worker process
+            mg.add_log(f, cache=args.cache,
+                       notimestamps=args.notimestamps,
+                       zero_time_base=args.zero_time_base,
+                       dialect=args.dialect)
+        elif os.path.exists(f):
             mlog = mavutil.mavlink_connection(f, notimestamps=args.notimestamps,
                                               zero_time_base=args.zero_time_base,
                                               dialect=args.dialect)
-            mg.add_mav(mlog)
+            columns = None
+            if args.cache:
+                from MAVProxy.modules.lib import mp_logcache
+                columns = mp_logcache.load_columns(f, mlog)
+            mg.add_mav(mlog, columns)
         else:
             mg.add_field(f)
     mg.set_condition(args.condition)
@@ -578,5 +913,5 @@ if __name__ == "__main__":
     mg.set_multi(args.multi)
     mg.set_title(args.title)
     mg.set_show_flightmode(args.show_flightmode)
-    mg.process([],[],0)
-    mg.show(len(mg.mav_list), output=args.output)
+    mg.process([],[],0, jobs=args.jobs)
+    mg.show(mg.num_logs(), output=args.output)
@@ -8,9 +8,11 @@
   http://eli.thegreenplace.net/files/prog_code/wx_mpl_dynamic_graph.py.txt
 """
 
+import math
 import platform
 from MAVProxy.modules.lib import mp_util
 from MAVProxy.modules.lib import multiproc
+from MAVProxy.modules.lib.mp_ringbuf import StateRing
 
 class LiveGraph():
     '''
@@ -18,7 +20,8 @@ class LiveGraph():
     All of the GUI work is done in a child process to provide some insulation
     from the parent mavproxy instance and prevent instability in the GCS
 
-    New data is sent to the LiveGraph instance via a pipe
+    New data is sent to the LiveGraph instance via a shared memory ring,
+    so the child only sees the latest values if it falls behind
     '''
     def __init__(self,
                  fields,
@@ -33,7 +36,8 @@ class LiveGraph():
         self.timespan = timespan
         self.tickresolution = tickresolution
         self.values = [None]*len(self.fields)
-        self.parent_pipe,self.child_pipe = multiproc.Pipe()
+        # values are sent as doubles, with NaN for None
+        self.state_ring = StateRing({'values' : 'd'*len(self.fields)})
         self.close_graph = multiproc.Event()
         self.close_graph.clear()
         self.child = multiproc.Process(target=self.child_task)
@@ -60,13 +64,22 @@ class LiveGraph():
     def add_values(self, values):
         '''add some data to the graph'''
         if self.child.is_alive():
-            self.parent_pipe.send(values)
+            values = [float('nan') if v is None else float(v) for v in values]
+            self.state_ring.put('values', '', values)
+
+    def get_values(self):
+        '''get the latest values, in the child'''
+        latest = self.state_ring.get_latest().get(('values', ''), None)
+        if latest is not None:
+            self.values = [None if math.isnan(v) else v for v in latest[0]]
+        return self.values
 
     def close(self):
         '''close the graph'''
         self.close_graph.set()
         if self.is_alive():
             self.child.join(2)
+        self.state_ring.close()
 
     def is_alive(self):
         '''check if graph is still going'''
@@ -162,8 +162,7 @@ class GraphFrame(wx.Frame):
             self.redraw_timer.Stop()
             self.Destroy()
             return
-        while state.child_pipe.poll():
-            state.values = state.child_pipe.recv()
+        state.get_values()
         if self.paused:
             return
         for i in range(len(self.plot_data)):
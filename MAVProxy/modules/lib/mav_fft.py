@@ -2,6 +2,13 @@
 
 '''
 extract ISBH and ISBD messages from AP_Logging files and produce FFT plots
+
+The batch sampler logs bursts of IMU samples, each burst starting with an
+ISBH header followed by ISBD messages of 32 samples per axis. Power
+spectral densities are estimated with Welch's method: each burst is cut
+into overlapping windowed segments, and the periodograms of all segments
+are averaged. This is done as the log is read, so memory use does not
+grow with the length of the log.
 '''
 
 import numpy
@@ -12,116 +19,229 @@ import time
 
 from pymavlink import mavutil
 
-def mavfft_display(logfile, condition=None):
-    '''display fft for raw ACC data in logfile'''
-
-    '''object to store data about a single FFT plot'''
-    class PlotData(object):
-        def __init__(self, ffth):
-            self.seqno = -1
-            self.fftnum = ffth.N
-            self.sensor_type = ffth.type
-            self.instance = ffth.instance
-            self.sample_rate_hz = ffth.smp_rate
-            self.multiplier = ffth.mul
-            self.data = {}
-            self.data["X"] = []
-            self.data["Y"] = []
-            self.data["Z"] = []
-            self.holes = False
-            self.freq = None
-
-        def add_fftd(self, fftd):
-            if fftd.N != self.fftnum:
-                print("Skipping ISBD with wrong fftnum (%u vs %u)\n" % (fftd.fftnum, self.fftnum))
-                return
-            if self.holes:
-                print("Skipping ISBD(%u) for ISBH(%u) with holes in it" % (fftd.seqno, self.fftnum))
-                return
-            if fftd.seqno != self.seqno+1:
-                print("ISBH(%u) has holes in it" % fftd.N)
-                self.holes = True
-                return
-            self.seqno += 1
-            self.data["X"].extend(fftd.x)
-            self.data["Y"].extend(fftd.y)
-            self.data["Z"].extend(fftd.z)
-
-        def prefix(self):
-            if self.sensor_type == 0:
-                return "Accel"
-            elif self.sensor_type == 1:
-                return "Gyro"
-            else:
-                return "?Unknown Sensor Type?"
-
-        def tag(self):
-            return str(self)
-
-        def __str__(self):
-            return "%s[%u]" % (self.prefix(), self.instance)
+AXES = ["X", "Y", "Z"]
+
+
+class FFTStream(object):
+    '''Welch PSD and spectrogram for the batches of one sensor'''
+    def __init__(self, tag, sample_rate_hz, nperseg, max_columns=400):
+        self.tag = tag
+        self.sample_rate_hz = float(sample_rate_hz)
+        self.nperseg = nperseg
+        self.noverlap = nperseg // 2
+        n = numpy.arange(nperseg)
+        # periodic Hann window
+        self.window = 0.5 - 0.5*numpy.cos(2*numpy.pi*n/nperseg)
+        self.scale = 1.0 / (self.sample_rate_hz * numpy.sum(self.window**2))
+        self.freq = numpy.fft.rfftfreq(nperseg, 1.0/self.sample_rate_hz)
+        nfreq = len(self.freq)
+        self.buf = numpy.zeros((3, nperseg))
+        self.pos = 0
+        self.batch_time = 0
+        self.batch_samples = 0
+        self.multiplier = 1.0
+        self.psd_sum = numpy.zeros((3, nfreq))
+        self.segments = 0
+        # spectrogram columns, each the sum of the PSDs of up to
+        # segs_per_column segments
+        self.max_columns = max_columns
+        self.segs_per_column = 1
+        self.columns = numpy.zeros((max_columns, 3, nfreq))
+        self.column_count = numpy.zeros(max_columns, dtype=int)
+        self.column_time = numpy.zeros(max_columns)
+        self.ncolumns = 0
+
+    def start_batch(self, t, multiplier):
+        '''start a new batch of samples at time t. Segments never span
+        batches, as there are gaps in the samples between batches'''
+        self.pos = 0
+        self.batch_time = t
+        self.batch_samples = 0
+        self.multiplier = float(multiplier)
+
+    def add(self, x, y, z):
+        '''add samples to the current batch'''
+        n = len(x)
+        ofs = 0
+        while ofs < n:
+            count = min(n - ofs, self.nperseg - self.pos)
+            self.buf[0, self.pos:self.pos+count] = x[ofs:ofs+count]
+            self.buf[1, self.pos:self.pos+count] = y[ofs:ofs+count]
+            self.buf[2, self.pos:self.pos+count] = z[ofs:ofs+count]
+            self.pos += count
+            ofs += count
+            self.batch_samples += count
+            if self.pos == self.nperseg:
+                self.add_segment()
+                self.buf[:, :self.noverlap] = self.buf[:, self.nperseg-self.noverlap:]
+                self.pos = self.noverlap
+
+    def add_segment(self):
+        '''add the periodogram of a full segment'''
+        d = self.buf / self.multiplier
+        d = d - numpy.mean(d, axis=1)[:, None]
+        spec = numpy.fft.rfft(d * self.window, axis=1)
+        psd = (spec.real**2 + spec.imag**2) * self.scale
+        # one sided, so double all but DC and Nyquist
+        if self.nperseg % 2 == 0:
+            psd[:, 1:-1] *= 2
+        else:
+            psd[:, 1:] *= 2
+        self.psd_sum += psd
+        self.segments += 1
+
+        t = self.batch_time + (self.batch_samples - self.nperseg) / self.sample_rate_hz
+        if self.ncolumns == 0 or self.column_count[self.ncolumns-1] >= self.segs_per_column:
+            if self.ncolumns == self.max_columns:
+                self.merge_columns()
+            self.column_time[self.ncolumns] = t
+            self.columns[self.ncolumns] = 0
+            self.column_count[self.ncolumns] = 0
+            self.ncolumns += 1
+        self.columns[self.ncolumns-1] += psd
+        self.column_count[self.ncolumns-1] += 1
+
+    def merge_columns(self):
+        '''halve the time resolution of the spectrogram to bound memory'''
+        n = self.ncolumns // 2
+        self.columns[:n] = self.columns[0:2*n:2] + self.columns[1:2*n:2]
+        self.column_count[:n] = self.column_count[0:2*n:2] + self.column_count[1:2*n:2]
+        self.column_time[:n] = self.column_time[0:2*n:2]
+        if self.ncolumns % 2 == 1:
+            self.columns[n] = self.columns[self.ncolumns-1]
+            self.column_count[n] = self.column_count[self.ncolumns-1]
+            self.column_time[n] = self.column_time[self.ncolumns-1]
+            n += 1
+        self.ncolumns = n
+        self.segs_per_column *= 2
+
+    def psd(self):
+        '''return (freq, psd) with psd an array of the averaged PSD of
+        each axis, in units^2/Hz'''
+        return (self.freq, self.psd_sum / max(self.segments, 1))
+
+    def spectrogram(self):
+        '''return (times, freq, psd) with psd an array of shape (axis,
+        time, freq)'''
+        n = self.ncolumns
+        counts = numpy.maximum(self.column_count[:n], 1)
+        psd = self.columns[:n] / counts[:, None, None]
+        return (self.column_time[:n], self.freq, psd.transpose(1, 0, 2))
+
+    def __str__(self):
+        return self.tag
+
+
+class FFTEngine(object):
+    '''build Welch PSDs from ISBH and ISBD messages as they are read'''
+    def __init__(self, nperseg=1024, max_columns=400):
+        self.nperseg = nperseg
+        self.max_columns = max_columns
+        self.streams = {}
+        self.stream = None
+        self.fftnum = None
+        self.seqno = -1
+        self.holes = False
+        self.batches = 0
+
+    def sensor_tag(self, ffth):
+        if ffth.type == 0:
+            prefix = "Accel"
+        elif ffth.type == 1:
+            prefix = "Gyro"
+        else:
+            prefix = "?Unknown Sensor Type?"
+        return "%s[%u]" % (prefix, ffth.instance)
+
+    def add_isbh(self, ffth):
+        '''start a new batch'''
+        self.fftnum = ffth.N
+        self.seqno = -1
+        self.holes = False
+        self.stream = None
+        tag = self.sensor_tag(ffth)
+        stream = self.streams.get(tag, None)
+        if stream is None:
+            # segments can't be longer than a batch
+            smp_cnt = getattr(ffth, 'smp_cnt', self.nperseg)
+            nperseg = self.nperseg
+            while nperseg > smp_cnt and nperseg > 32:
+                nperseg //= 2
+            stream = FFTStream(tag, ffth.smp_rate, nperseg, self.max_columns)
+            self.streams[tag] = stream
+        elif stream.sample_rate_hz != ffth.smp_rate:
+            print("Skipping %s batch with changed sample rate %.1f" % (tag, ffth.smp_rate))
+            return
+        sample_us = getattr(ffth, 'SampleUS', None)
+        if sample_us is not None:
+            t = sample_us * 1.0e-6
+        else:
+            t = ffth._timestamp
+        stream.start_batch(t, ffth.mul)
+        self.stream = stream
+        self.batches += 1
+
+    def add_isbd(self, fftd):
+        '''add samples to the current batch'''
+        if self.stream is None:
+            return
+        if fftd.N != self.fftnum:
+            print("Skipping ISBD with wrong fftnum (%u vs %u)" % (fftd.N, self.fftnum))
+            return
+        if self.holes:
+            return
+        if fftd.seqno != self.seqno+1:
+            print("ISBH(%u) has holes in it" % fftd.N)
+            self.holes = True
+            return
+        self.seqno += 1
+        self.stream.add(fftd.x, fftd.y, fftd.z)
+
+    def add_message(self, m):
+        msg_type = m.get_type()
+        if msg_type == "ISBH":
+            self.add_isbh(m)
+        elif msg_type == "ISBD":
+            self.add_isbd(m)
+
 
+def mavfft_display(logfile, condition=None, nperseg=1024):
+    '''display Welch PSDs and spectrograms for raw IMU data in logfile'''
     print("Processing log for ISBH and ISBD messages")
 
-    things_to_plot = []
-    plotdata = None
+    engine = FFTEngine(nperseg=nperseg)
     start_time = time.time()
     mlog = mavutil.mavlink_connection(logfile)
     while True:
         m = mlog.recv_match(type=['ISBH','ISBD'],condition=condition)
         if m is None:
             break
-        msg_type = m.get_type()
-        if msg_type == "ISBH":
-            if plotdata is not None:
-                # close off previous data collection
-                things_to_plot.append(plotdata)
-            # initialise plot-data collection object
-            plotdata = PlotData(m)
-            continue
-
-        if msg_type == "ISBD":
-            if plotdata is None:
-                continue
-            plotdata.add_fftd(m)
-
-    if len(things_to_plot) == 0:
+        engine.add_message(m)
+
+    streams = [s for s in engine.streams.values() if s.segments > 0]
+    if len(streams) == 0:
         print("No FFT data. Did you set INS_LOG_BAT_MASK?")
         return
     time_delta = time.time() - start_time
-    print("Extracted %u fft data sets" % len(things_to_plot))
-
-    sum_fft = {}
-    freqmap = {}
-    count = 0
-
-    first_freq = None
-    for thing_to_plot in things_to_plot:
-        for axis in [ "X","Y","Z" ]:
-            d = numpy.array(thing_to_plot.data[axis])/float(thing_to_plot.multiplier)
-            if len(d) == 0:
-                print("No data?!?!?!")
-                continue
-            
-            avg = numpy.sum(d) / len(d)
-            d -= avg
-            d_fft = numpy.fft.rfft(d)
-            if thing_to_plot.tag() not in sum_fft:
-                sum_fft[thing_to_plot.tag()] = {
-                    "X": 0,
-                    "Y": 0,
-                    "Z": 0
-                }
-            sum_fft[thing_to_plot.tag()][axis] = numpy.add(sum_fft[thing_to_plot.tag()][axis], d_fft)
-            count += 1
-            freq = numpy.fft.rfftfreq(len(d), 1.0/thing_to_plot.sample_rate_hz)
-            freqmap[thing_to_plot.tag()] = freq
-
-    for sensor in sum_fft:
-        pylab.figure(str(sensor))
-        for axis in [ "X","Y","Z" ]:
-            pylab.plot(freqmap[sensor], numpy.abs(sum_fft[sensor][axis]/count), label=axis)
+    print("Extracted %u batches in %.1fs" % (engine.batches, time_delta))
+
+    t0 = min([s.column_time[0] for s in streams])
+    for stream in sorted(streams, key=str):
+        (freq, psd) = stream.psd()
+        pylab.figure(str(stream))
+        for i in range(len(AXES)):
+            pylab.semilogy(freq, psd[i], label=AXES[i])
         pylab.legend(loc='upper right')
         pylab.xlabel('Hz')
+        pylab.ylabel('PSD')
+        pylab.title("%s: %u segments of %u samples" % (stream, stream.segments, stream.nperseg))
+
+        (times, freq, spec) = stream.spectrogram()
+        pylab.figure(str(stream) + ' spectrogram')
+        for i in range(len(AXES)):
+            pylab.subplot(len(AXES), 1, i+1)
+            pylab.pcolormesh(times - t0, freq, 10*numpy.log10(spec[i].T + 1.0e-20), shading='auto')
+            pylab.ylabel('%s Hz' % AXES[i])
+        pylab.xlabel('flight time (s)')
 
     pylab.show()
@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+'''
+graph expressions evaluated over log columns
+
+Graph fields like "ATTITUDE.roll*57.3" or "sqrt(RAW_IMU.xacc**2+RAW_IMU.yacc**2)"
+are normally evaluated with eval() once per message. This compiles an
+expression once into a function over the numpy columns from mp_logcache,
+giving the same values as mavutil.evaluate_expression() would for each
+message:
+
+ - each MSG.field reference takes the value from the most recent MSG
+   at or before the message being evaluated
+ - the result is missing where a referenced message type has not been
+   seen yet, or a division by zero would happen, in the parts of the
+   expression python would evaluate for that message
+ - the EXPRESSION{CONDITION} form drops values where CONDITION is false
+
+Conditions, as used by mavutil.evaluate_condition(), compile the same
+way, and mask() gives where they hold.
+
+Only arithmetic, comparisons, numeric constants and the stateless maths
+helpers below can be compiled. compile_expression() returns None for
+anything else, such as the stateful mavextra functions like lowpass()
+and delta(), and the caller should evaluate those per message.
+'''
+
+import ast
+import math
+import sys
+
+import numpy
+
+from pymavlink import mavextra
+
+
+def _wrap_180(angle):
+    angle = numpy.where(angle > 180, angle - 360.0, angle)
+    return numpy.where(angle < -180, angle + 360.0, angle)
+
+
+def _wrap_360(angle):
+    angle = numpy.where(angle > 360, angle - 360.0, angle)
+    return numpy.where(angle < 0, angle + 360.0, angle)
+
+
+def _constrain(v, minv, maxv):
+    v = numpy.where(v < minv, minv, v)
+    return numpy.where(v > maxv, maxv, v)
+
+
+def _angle_diff(angle1, angle2):
+    return _wrap_180(angle1 - angle2)
+
+
+def _log(x, base=None):
+    if base is None:
+        return numpy.log(x)
+    return numpy.log(x) / numpy.log(base)
+
+
+def _min(*args):
+    ret = args[0]
+    for a in args[1:]:
+        # python's min() keeps the first of equal values
+        ret = numpy.where(a < ret, a, ret)
+    return ret
+
+
+def _max(*args):
+    ret = args[0]
+    for a in args[1:]:
+        ret = numpy.where(a > ret, a, ret)
+    return ret
+
+
+# functions that can be used in compiled expressions, with the number of
+# arguments they take
+functions = {
+    'sin'       : (numpy.sin, 1),
+    'cos'       : (numpy.cos, 1),
+    'tan'       : (numpy.tan, 1),
+    'asin'      : (numpy.arcsin, 1),
+    'acos'      : (numpy.arccos, 1),
+    'atan'      : (numpy.arctan, 1),
+    'atan2'     : (numpy.arctan2, 2),
+    'sinh'      : (numpy.sinh, 1),
+    'cosh'      : (numpy.cosh, 1),
+    'tanh'      : (numpy.tanh, 1),
+    'sqrt'      : (numpy.sqrt, 1),
+    'exp'       : (numpy.exp, 1),
+    'log'       : (_log, (1, 2)),
+    'log10'     : (numpy.log10, 1),
+    'log2'      : (numpy.log2, 1),
+    'fabs'      : (numpy.fabs, 1),
+    'abs'       : (numpy.abs, 1),
+    'floor'     : (numpy.floor, 1),
+    'ceil'      : (numpy.ceil, 1),
+    'trunc'     : (numpy.trunc, 1),
+    'int'       : (numpy.trunc, 1),
+    'float'     : (numpy.asarray, 1),
+    'degrees'   : (numpy.degrees, 1),
+    'radians'   : (numpy.radians, 1),
+    'hypot'     : (numpy.hypot, 2),
+    'copysign'  : (numpy.copysign, 2),
+    'fmod'      : (numpy.fmod, 2),
+    'pow'       : (numpy.power, 2),
+    'isnan'     : (numpy.isnan, 1),
+    'isinf'     : (numpy.isinf, 1),
+    'isfinite'  : (numpy.isfinite, 1),
+    'min'       : (_min, None),
+    'max'       : (_max, None),
+    'wrap_180'  : (_wrap_180, 1),
+    'wrap_360'  : (_wrap_360, 1),
+    'constrain' : (_constrain, 3),
+    'angle_diff': (_angle_diff, 2),
+    # these mavextra helpers are plain arithmetic
+    'kmh'       : (mavextra.kmh, 1),
+    'knots'     : (mavextra.knots, 1),
+    'feet'      : (mavextra.feet, 1),
+}
+
+binary_ops = {
+    ast.Add      : numpy.add,
+    ast.Sub      : numpy.subtract,
+    ast.Mult     : numpy.multiply,
+    ast.Div      : numpy.true_divide,
+    ast.FloorDiv : numpy.floor_divide,
+    ast.Mod      : numpy.mod,
+    ast.Pow      : numpy.power,
+}
+
+# bit operations are done on integers
+int_ops = {
+    ast.BitAnd   : numpy.bitwise_and,
+    ast.BitOr    : numpy.bitwise_or,
+    ast.BitXor   : numpy.bitwise_xor,
+    ast.LShift   : numpy.left_shift,
+    ast.RShift   : numpy.right_shift,
+}
+
+compare_ops = {
+    ast.Lt    : numpy.less,
+    ast.LtE   : numpy.less_equal,
+    ast.Gt    : numpy.greater,
+    ast.GtE   : numpy.greater_equal,
+    ast.Eq    : numpy.equal,
+    ast.NotEq : numpy.not_equal,
+}
+
+
+if sys.version_info >= (3, 8):
+    constant_types = (ast.Constant,)
+else:
+    constant_types = (ast.Num,)
+
+
+def constant_value(name):
+    '''return the value of a named numeric constant such as pi, or None'''
+    v = getattr(math, name, None)
+    if v is None:
+        v = getattr(mavextra, name, None)
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        return v
+    return None
+
+
+def truth(v):
+    '''return the python truth value of each element of v'''
+    return numpy.asarray(v) != 0
+
+
+def node_constant(node):
+    '''return the value of a constant node'''
+    if sys.version_info < (3, 8):
+        return node.n
+    return node.value
+
+
+class ColumnExpression(object):
+    '''an expression compiled for evaluation over log columns. Use
+    compile_expression() rather than creating these directly'''
+    def __init__(self, expression):
+        self.expression = expression
+        condition = None
+        if expression.endswith('}'):
+            startidx = expression.rfind('{')
+            if startidx == -1:
+                raise ValueError("bad condition")
+            condition = expression[startidx+1:-1]
+            expression = expression[:startidx]
+        # set of (type, field) referenced
+        self.fields = set()
+        self.tree = self._check(ast.parse(expression.strip(), mode='eval').body)
+        self.condition = None
+        if condition is not None:
+            self.condition = self._check(ast.parse(condition.strip(), mode='eval').body)
+        self.types = set([f[0] for f in self.fields])
+
+    def _check(self, node):
+        '''check that a node can be compiled, noting the fields used'''
+        if isinstance(node, ast.Attribute):
+            if not isinstance(node.value, ast.Name):
+                raise ValueError("unsupported attribute")
+            self.fields.add((node.value.id, node.attr))
+        elif isinstance(node, ast.Name):
+            if node.id not in ['True', 'False', 'None'] and constant_value(node.id) is None:
+                raise ValueError("unknown name %s" % node.id)
+            if node.id == 'None':
+                raise ValueError("None is not numeric")
+        elif isinstance(node, ast.BinOp):
+            if type(node.op) not in binary_ops and type(node.op) not in int_ops:
+                raise ValueError("unsupported operator")
+            self._check(node.left)
+            self._check(node.right)
+        elif isinstance(node, ast.UnaryOp):
+            if not isinstance(node.op, (ast.USub, ast.UAdd, ast.Not, ast.Invert)):
+                raise ValueError("unsupported operator")
+            self._check(node.operand)
+        elif isinstance(node, ast.Compare):
+            for op in node.ops:
+                if type(op) not in compare_ops:
+                    raise ValueError("unsupported comparison")
+            self._check(node.left)
+            for c in node.comparators:
+                self._check(c)
+        elif isinstance(node, ast.BoolOp):
+            for v in node.values:
+                self._check(v)
+        elif isinstance(node, ast.IfExp):
+            self._check(node.test)
+            self._check(node.body)
+            self._check(node.orelse)
+        elif isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in functions:
+                raise ValueError("unsupported function")
+            if node.keywords or getattr(node, 'starargs', None) or getattr(node, 'kwargs', None):
+                raise ValueError("unsupported arguments")
+            nargs = functions[node.func.id][1]
+            if nargs is None:
+                ok = len(node.args) >= 2
+            elif isinstance(nargs, tuple):
+                ok = len(node.args) in nargs
+            else:
+                ok = len(node.args) == nargs
+            if not ok:
+                raise ValueError("wrong number of arguments")
+            for a in node.args:
+                self._check(a)
+        elif isinstance(node, constant_types):
+            if not isinstance(node_constant(node), (int, float)):
+                raise ValueError("unsupported constant")
+        else:
+            raise ValueError("unsupported expression")
+        return node
+
+    def _eval(self, node, values, invalid, taken):
+        '''evaluate a node. values maps (type, field) to (array, missing)
+        where missing marks messages with no value yet, invalid is a
+        boolean array marking results that would not exist, and taken
+        marks the messages where python would evaluate this node, as and,
+        or and if only evaluate some of their operands'''
+        if isinstance(node, ast.Attribute):
+            (v, missing) = values[(node.value.id, node.attr)]
+            # python raises NameError for a message not seen yet
+            invalid |= taken & missing
+            return v
+        if isinstance(node, ast.Name):
+            if node.id == 'True':
+                return True
+            if node.id == 'False':
+                return False
+            return constant_value(node.id)
+        if isinstance(node, ast.BinOp):
+            left = self._eval(node.left, values, invalid, taken)
+            right = self._eval(node.right, values, invalid, taken)
+            op = type(node.op)
+            if op in int_ops:
+                return int_ops[op](numpy.asarray(left).astype(numpy.int64),
+                                   numpy.asarray(right).astype(numpy.int64))
+            if op in (ast.Div, ast.FloorDiv, ast.Mod):
+                # python raises ZeroDivisionError, so there is no value
+                invalid |= taken & (numpy.asarray(right) == 0)
+            return binary_ops[op](left, right)
+        if isinstance(node, ast.UnaryOp):
+            v = self._eval(node.operand, values, invalid, taken)
+            if isinstance(node.op, ast.USub):
+                return numpy.negative(v)
+            if isinstance(node.op, ast.Not):
+                return numpy.logical_not(v)
+            if isinstance(node.op, ast.Invert):
+                return numpy.invert(numpy.asarray(v).astype(numpy.int64))
+            return v
+        if isinstance(node, ast.Compare):
+            left = self._eval(node.left, values, invalid, taken)
+            ret = True
+            for (op, c) in zip(node.ops, node.comparators):
+                # a chained comparison stops at the first false one
+                right = self._eval(c, values, invalid, taken & truth(ret))
+                ret = numpy.logical_and(ret, compare_ops[type(op)](left, right))
+                left = right
+            return ret
+        if isinstance(node, ast.BoolOp):
+            # python's and/or return one of the operands, and only
+            # evaluate operands until the result is known
+            ret = self._eval(node.values[0], values, invalid, taken)
+            for n in node.values[1:]:
+                if isinstance(node.op, ast.And):
+                    v = self._eval(n, values, invalid, taken & truth(ret))
+                    ret = numpy.where(ret, v, ret)
+                else:
+                    v = self._eval(n, values, invalid, taken & ~truth(ret))
+                    ret = numpy.where(ret, ret, v)
+            return ret
+        if isinstance(node, ast.IfExp):
+            test = truth(self._eval(node.test, values, invalid, taken))
+            return numpy.where(test,
+                               self._eval(node.body, values, invalid, taken & test),
+                               self._eval(node.orelse, values, invalid, taken & ~test))
+        if isinstance(node, ast.Call):
+            func = functions[node.func.id][0]
+            return func(*[self._eval(a, values, invalid, taken) for a in node.args])
+        return node_constant(node)
+
+    def evaluate(self, columns, seq):
+        '''evaluate over the columns of a log for the messages with the
+        given sequence numbers. Returns (values, valid) arrays, or None if
+        a field is not available as a numeric column'''
+        n = len(seq)
+        values = {}
+        invalid = numpy.zeros(n, dtype=bool)
+        for (mtype, field) in self.fields:
+            col = columns.column(mtype, field)
+            if col is None:
+                if columns.sequence(mtype) is None:
+                    # no messages of this type, so there are never values
+                    return (numpy.zeros(n), numpy.zeros(n, dtype=bool))
+                return None
+            # the latest message of this type at or before each message
+            idx = numpy.searchsorted(columns.sequence(mtype), seq, side='right') - 1
+            values[(mtype, field)] = (col[numpy.maximum(idx, 0)], idx < 0)
+        taken = numpy.ones(n, dtype=bool)
+        with numpy.errstate(all='ignore'):
+            try:
+                v = self._eval(self.tree, values, invalid, taken)
+                if self.condition is not None:
+                    c = self._eval(self.condition, values, invalid, taken)
+                    invalid |= numpy.logical_not(numpy.broadcast_to(c, (n,)))
+            except (TypeError, ValueError):
+                return None
+            v = numpy.asarray(v)
+            if v.dtype == object:
+                return None
+            v = numpy.broadcast_to(v.astype(numpy.float64), (n,))
+        return (v, numpy.logical_not(invalid))
+
+
+    def mask(self, columns, seq):
+        '''evaluate as a condition over the columns of a log for the
+        messages with the given sequence numbers. Returns a boolean array
+        that is True where mavutil.evaluate_condition() would be true, or
+        None if a field is not available as a numeric column'''
+        result = self.evaluate(columns, seq)
+        if result is None:
+            return None
+        (v, valid) = result
+        # a missing value makes the condition false
+        return valid & (v != 0)
+
+
+def compile_expression(expression):
+    '''compile a graph expression, returning None if it can't be
+    evaluated over columns'''
+    try:
+        return ColumnExpression(expression)
+    except (SyntaxError, ValueError, TypeError):
+        return None
+
+
+def condition_masks(condition, columns, types):
+    '''return a dict of message type to a boolean array of which messages
+    of that type a condition holds at, for each of the given types in the
+    columns. Returns None if the condition can't be evaluated over
+    columns'''
+    expression = compile_expression(condition)
+    if expression is None:
+        return None
+    ret = {}
+    for mtype in types:
+        seq = columns.sequence(mtype)
+        if seq is None:
+            continue
+        mask = expression.mask(columns, seq)
+        if mask is None:
+            return None
+        ret[mtype] = mask
+    return ret
+
+
+def trigger_sequence(columns, types):
+    '''return the sequence numbers and timestamps, in log order, of the
+    messages of the given types, which are the messages a graph field is
+    evaluated at'''
+    seqs = []
+    times = []
+    for mtype in types:
+        s = columns.sequence(mtype)
+        if s is not None:
+            seqs.append(s)
+            times.append(columns.timestamps(mtype))
+    if not seqs:
+        return (numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0))
+    seq = numpy.concatenate(seqs)
+    t = numpy.concatenate(times)
+    order = numpy.argsort(seq, kind='mergesort')
+    return (seq[order], t[order])
@@ -18,6 +18,7 @@ from MAVProxy.modules.lib import mp_util
 from MAVProxy.modules.lib import mp_widgets
 from MAVProxy.modules.lib import win_layout
 from MAVProxy.modules.lib import multiproc
+from MAVProxy.modules.lib import mp_ringbuf
 from MAVProxy.modules.lib.mp_menu import *
 
 
@@ -70,6 +71,114 @@ class MPImageRecenter:
     def __init__(self, location):
         self.location = location
 
+class MPImageSharedFrame:
+    '''image data to display, held in a MPImageFramePool slot'''
+    def __init__(self, shm_name, slot, offset, shape, dtype):
+        self.shm_name = shm_name
+        self.slot = slot
+        self.offset = offset
+        self.shape = shape
+        self.dtype = dtype
+        self.width = shape[1]
+        self.height = shape[0]
+
+# slot states, kept in the first bytes of the pool
+SLOT_FREE = 0
+SLOT_READY = 1
+POOL_HEADER_SIZE = 64
+
+class MPImageFramePool:
+    '''
+    a pool of image slots in shared memory, so frames can be passed to
+    the child without pickling them. The parent copies each frame into a
+    free slot and sends only the slot details down the queue, and the
+    child frees the slot once it has taken the image. If the child falls
+    behind and no slot is free the frame is dropped
+    '''
+    def __init__(self, nslots=3):
+        self.nslots = nslots
+        self.shm = None
+        self.slot_size = 0
+        self.next_slot = 0
+
+    @staticmethod
+    def available():
+        '''return True if frames can be shared on this python'''
+        return mp_ringbuf.shared_memory is not None
+
+    def put(self, img):
+        '''copy an image into a free slot, returning a MPImageSharedFrame,
+        or None if all slots are waiting for the child'''
+        if self.shm is None or img.nbytes > self.slot_size:
+            # (re)allocate for the new frame size. Frames queued in the
+            # old pool are lost if the child has not attached to it yet
+            self.close()
+            self.slot_size = img.nbytes
+            self.shm = mp_ringbuf.shared_memory.SharedMemory(create=True,
+                                                             size=POOL_HEADER_SIZE+self.nslots*self.slot_size)
+            self.shm.buf[:self.nslots] = bytes(self.nslots)
+        for i in range(self.nslots):
+            slot = (self.next_slot + i) % self.nslots
+            if self.shm.buf[slot] == SLOT_FREE:
+                break
+        else:
+            return None
+        offset = POOL_HEADER_SIZE + slot * self.slot_size
+        dest = np.ndarray(img.shape, dtype=img.dtype, buffer=self.shm.buf, offset=offset)
+        np.copyto(dest, img)
+        del dest
+        self.shm.buf[slot] = SLOT_READY
+        self.next_slot = (slot + 1) % self.nslots
+        return MPImageSharedFrame(self.shm.name, slot, offset, img.shape, img.dtype.str)
+
+    def close(self):
+        '''release the shared memory'''
+        if self.shm is not None:
+            self.shm.close()
+            try:
+                self.shm.unlink()
+            except Exception:
+                pass
+            self.shm = None
+
+class MPImageFrameReader:
+    '''child side of a MPImageFramePool'''
+    def __init__(self):
+        self.shm = None
+
+    def attach(self, frame):
+        '''attach to the pool holding a frame, returning False if the
+        pool has already been replaced by the parent'''
+        if self.shm is not None and self.shm.name == frame.shm_name:
+            return True
+        self.close()
+        try:
+            self.shm = mp_ringbuf.attach_shared_memory(frame.shm_name)
+        except Exception:
+            return False
+        return True
+
+    def get(self, frame):
+        '''return a frame as a numpy array using the slot memory. The
+        array is only valid until the frame is released'''
+        if not self.attach(frame):
+            return None
+        return np.ndarray(frame.shape, dtype=np.dtype(frame.dtype),
+                          buffer=self.shm.buf, offset=frame.offset)
+
+    def release(self, frame):
+        '''give a slot back to the parent'''
+        if self.attach(frame):
+            self.shm.buf[frame.slot] = SLOT_FREE
+
+    def close(self):
+        if self.shm is not None:
+            try:
+                self.shm.close()
+            except Exception:
+                pass
+            self.shm = None
+
 class MPImage():
     '''
     a generic image viewer widget for use in MP tools
@@ -100,6 +209,10 @@ class MPImage():
 
         self.in_queue = multiproc.Queue()
         self.out_queue = multiproc.Queue()
+        if MPImageFramePool.available():
+            self.frame_pool = MPImageFramePool()
+        else:
+            self.frame_pool = None
 
         self.default_menu = MPMenuSubMenu('View',
                                           items=[MPMenuItem('Fit Window', 'Fit Window', 'fitWindow'),
@@ -133,7 +246,12 @@ class MPImage():
             img = np.asarray(img[:,:])
         if bgr:
             img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        self.in_queue.put(MPImageData(img))
+        if self.frame_pool is None:
+            self.in_queue.put(MPImageData(img))
+            return
+        frame = self.frame_pool.put(img)
+        if frame is not None:
+            self.in_queue.put(frame)
 
     def set_title(self, title):
         '''set the frame title'''
@@ -199,6 +317,8 @@ class MPImage():
         '''terminate child process'''
         self.child.terminate()
         self.child.join()
+        if self.frame_pool is not None:
+            self.frame_pool.close()
 
     def center(self, location):
         self.in_queue.put(MPImageRecenter(location))
@@ -235,6 +355,7 @@ class MPImagePanel(wx.Panel):
         self.frame = parent
         self.state = state
         self.img = None
+        self.frame_reader = MPImageFrameReader()
         self.redraw_timer = wx.Timer(self)
         self.Bind(wx.EVT_TIMER, self.on_redraw_timer, self.redraw_timer)
         self.Bind(wx.EVT_SET_FOCUS, self.on_focus)
@@ -349,17 +470,34 @@ class MPImagePanel(wx.Panel):
         '''the redraw timer ensures we show new map tiles as they
         are downloaded'''
         state = self.state
+        objs = []
         while state.in_queue.qsize():
             try:
-                obj = state.in_queue.get()
+                objs.append(state.in_queue.get())
             except Exception:
                 time.sleep(0.05)
-                return
-            if isinstance(obj, MPImageData):
+                break
+
+        # only the newest frame is shown, stale frames are dropped
+        frames = [obj for obj in objs if isinstance(obj, (MPImageData, MPImageSharedFrame))]
+        for obj in objs:
+            if obj in frames and obj is not frames[-1]:
+                if isinstance(obj, MPImageSharedFrame):
+                    self.frame_reader.release(obj)
+                continue
+            if isinstance(obj, (MPImageData, MPImageSharedFrame)):
                 with warnings.catch_warnings():
                     warnings.simplefilter('ignore')
                     img = wx.EmptyImage(obj.width, obj.height)
-                img.SetData(obj.data)
+                if isinstance(obj, MPImageSharedFrame):
+                    data = self.frame_reader.get(obj)
+                    if data is None:
+                        continue
+                    img.SetData(data)
+                    del data
+                    self.frame_reader.release(obj)
+                else:
+                    img.SetData(obj.data)
                 self.img = img
                 self.need_redraw = True
                 if state.auto_size:
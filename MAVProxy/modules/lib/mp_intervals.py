@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+'''
+time interval index
+
+An IntervalIndex holds sorted, non-overlapping time intervals, each with
+a label, such as the flight mode segments of a log. Interval starts are searched with
+numpy.searchsorted, so finding the interval of every timestamp in a
+column is one vectorized call instead of a comparison per message.
+
+Intervals are half open, including their start time but not their end
+time.
+'''
+
+import bisect
+
+import numpy
+
+
+class IntervalIndex(object):
+    '''sorted, non-overlapping time intervals with labels'''
+    def __init__(self, starts, ends, labels=None):
+        self.starts = numpy.asarray(starts, dtype=numpy.float64)
+        self.ends = numpy.asarray(ends, dtype=numpy.float64)
+        if labels is None:
+            labels = [None] * len(self.starts)
+        self.labels = list(labels)
+        # for lookups of one time at a time
+        self.start_list = list(self.starts)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def locate(self, t):
+        '''return an array of the interval number holding each time in
+        the array t, or -1 for times not in any interval'''
+        t = numpy.asarray(t, dtype=numpy.float64)
+        idx = numpy.searchsorted(self.starts, t, side='right') - 1
+        inside = idx >= 0
+        inside[inside] = t[inside] < self.ends[idx[inside]]
+        idx[~inside] = -1
+        return idx
+
+    def locate_one(self, t):
+        '''return the interval number holding time t, or -1'''
+        i = bisect.bisect_right(self.start_list, t) - 1
+        if i < 0 or t >= self.ends[i]:
+            return -1
+        return i
+
+    def mask(self, t, selected=None):
+        '''return a boolean array of which times in the array t are in
+        an interval. If selected is given it is a list of booleans, one
+        per interval, and only times in selected intervals are True'''
+        idx = self.locate(t)
+        if selected is None:
+            return idx >= 0
+        sel = numpy.zeros(len(self.starts)+1, dtype=bool)
+        sel[:len(selected)] = selected[:len(self.starts)]
+        # idx of -1 picks the extra False at the end
+        return sel[idx]
+
+
+def flightmode_intervals(flightmodes):
+    '''return an IntervalIndex of flight mode segments, from a list of
+    (mode, t0, t1) as given by flightmode_list() of a log. The first
+    segment is taken to start at the start of the log and the last to run
+    to its end, so that every time falls in a segment'''
+    if not flightmodes:
+        return None
+    starts = [t0 for (mode, t0, t1) in flightmodes]
+    ends = starts[1:] + [numpy.inf]
+    starts[0] = -numpy.inf
+    return IntervalIndex(starts, ends, [mode for (mode, t0, t1) in flightmodes])
@@ -0,0 +1,151 @@
+'''
+link worker processes
+
+A link worker reads a master link in a separate process, frames the
+MAVLink packets and checks their CRCs, then passes the packets to the
+main process through a shared memory ring buffer. This moves the per
+byte work for busy links off the main process, so several high rate
+links can each use their own core.
+
+The worker is created by forking the main process, so that it inherits
+the already open connection. The main process keeps the connection for
+sending, and starts a new worker when it resets or reconnects the link. Only serial and UDP links are supported, and fork is not
+available on Windows, or on MacOS where we use billiard.
+'''
+
+import errno
+import os
+import platform
+import select
+import struct
+import pickle
+
+from pymavlink import mavutil
+
+from MAVProxy.modules.lib import multiproc
+from MAVProxy.modules.lib import mp_router
+from MAVProxy.modules.lib.mp_ringbuf import SPSCRingBuffer
+
+# record types passed from the worker
+RECORD_PACKET = 0
+RECORD_ADDRESS = 1
+RECORD_ERRORS = 2
+
+packet_header = struct.Struct('<BIBBB')
+
+
+def supported(conn):
+    '''return True if a link worker can be used for a connection'''
+    if platform.system() in ['Windows', 'Darwin'] or os.environ.get('USE_BILLIARD', None) is not None:
+        return False
+    return isinstance(conn, (mavutil.mavserial, mavutil.mavudp))
+
+
+class LinkWorker(object):
+    '''read and frame packets from a link in a child process'''
+    def __init__(self, conn, ring_size=1<<20):
+        self.conn = conn
+        # the port this worker reads, which is replaced if the main
+        # process resets the link
+        self.port = conn.port
+        self.ring = SPSCRingBuffer(ring_size)
+        (self.notify_r, self.notify_w) = os.pipe()
+        self.stop_event = multiproc.Event()
+        self.proc = multiproc.Process(target=self.run, name='link_worker')
+        self.proc.daemon = True
+        self.proc.start()
+        # only the worker writes to the notify pipe
+        os.close(self.notify_w)
+        self.notify_w = -1
+
+    def fileno(self):
+        '''fd that becomes readable when the worker has packets for us'''
+        return self.notify_r
+
+    def put(self, record):
+        '''add a record to the ring, in the worker. If the main process
+        is not keeping up the record is dropped, which shows up as
+        packet loss on the link'''
+        self.ring.put(record)
+
+    def run(self):
+        '''worker process main loop'''
+        import fcntl
+        os.close(self.notify_r)
+        # never block on the notify pipe, one pending byte is enough to
+        # wake the main process
+        fcntl.fcntl(self.notify_w, fcntl.F_SETFL, fcntl.fcntl(self.notify_w, fcntl.F_GETFL) | os.O_NONBLOCK)
+        conn = self.conn
+        framer = mp_router.MAVFramer()
+        last_address = getattr(conn, 'last_address', None)
+        while not self.stop_event.is_set():
+            if conn.fd is not None:
+                try:
+                    (rin, win, xin) = select.select([conn.fd], [], [], 0.1)
+                except select.error:
+                    continue
+                if not rin:
+                    continue
+            try:
+                s = conn.recv(16*1024)
+            except Exception:
+                # the port has died. The main process reconnects it and
+                # starts a new worker
+                break
+            if not s:
+                self.stop_event.wait(0.01)
+                continue
+
+            address = getattr(conn, 'last_address', None)
+            if address != last_address:
+                # the main process needs this to send replies to a udpin link
+                last_address = address
+                self.put(struct.pack('<B', RECORD_ADDRESS) + pickle.dumps(address))
+
+            errors = 0
+            for (msgbuf, msgid, sysid, compid, seq) in framer.frames(s):
+                if msgid == -1 or not mp_router.crc_ok(msgbuf, msgid):
+                    errors += 1
+                    continue
+                self.put(packet_header.pack(RECORD_PACKET, msgid, sysid, compid, seq) + msgbuf)
+            if errors > 0:
+                self.put(struct.pack('<BI', RECORD_ERRORS, errors))
+            try:
+                os.write(self.notify_w, b'x')
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    # main process has gone away
+                    break
+
+    def receive(self):
+        '''return waiting packets as (msgbuf, msgid, sysid, compid, seq)
+        tuples, in the main process. Address updates are applied to the
+        connection and bad packets are returned with a msgid of -1'''
+        try:
+            os.read(self.notify_r, 4096)
+        except OSError:
+            pass
+        ret = []
+        for record in self.ring.get_all():
+            rtype = ord(record[0:1])
+            if rtype == RECORD_PACKET:
+                (rtype, msgid, sysid, compid, seq) = packet_header.unpack_from(record)
+                ret.append((record[packet_header.size:], msgid, sysid, compid, seq))
+            elif rtype == RECORD_ADDRESS:
+                self.conn.last_address = pickle.loads(record[1:])
+            elif rtype == RECORD_ERRORS:
+                errors = struct.unpack_from('<I', record, 1)[0]
+                ret.extend([(b'', -1, 0, 0, 0)] * errors)
+        return ret
+
+    def alive(self):
+        return self.proc.is_alive()
+
+    def close(self):
+        '''stop the worker'''
+        self.stop_event.set()
+        self.proc.join(1)
+        if self.proc.is_alive():
+            self.proc.terminate()
+        os.close(self.notify_r)
+        self.ring.close()
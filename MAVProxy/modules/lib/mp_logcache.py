@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+'''
+columnar cache of log data
+
+A log is converted once into a numpy array per field of each message
+type, plus arrays of the timestamp and position in the log of each
+message. Graphs can then work on
+whole columns instead of reading every message of the log again.
+
+The columns are saved next to the log as LOGNAME.columns.npz, and are
+rebuilt if the log's size or modification time changes. Only numeric
+fields are kept; text and array fields still have to be read from the
+log.
+
+Columns can also be built while a log is being read, with
+ColumnBuilder, so that the first part of a large log can be used before
+the rest has been read.
+'''
+
+import os
+import threading
+import time
+
+import numpy
+
+CACHE_VERSION = 2
+META_KEY = '__meta__'
+
+
+def cache_filename(filename):
+    '''return the column cache filename for a log'''
+    return filename + '.columns.npz'
+
+
+def log_signature(filename):
+    '''values that change when the log changes'''
+    st = os.stat(filename)
+    return numpy.array([CACHE_VERSION, st.st_size, st.st_mtime], dtype=numpy.float64)
+
+
+class LogColumns(object):
+    '''numeric columns of a log, by message type. Arrays from a cache
+    file are only read when first used'''
+    def __init__(self, columns=None, npz=None):
+        # type -> field -> array
+        self.columns = {}
+        self.npz = npz
+        self.fields = {}
+        if columns is not None:
+            self.columns = columns
+            for mtype in columns:
+                self.fields[mtype] = sorted(columns[mtype].keys())
+        if npz is not None:
+            for key in npz.files:
+                if key == META_KEY:
+                    continue
+                (mtype, field) = key.split('.', 1)
+                if not mtype in self.fields:
+                    self.fields[mtype] = []
+                self.fields[mtype].append(field)
+
+    def types(self):
+        '''return the message types we have columns for'''
+        return self.fields.keys()
+
+    def column(self, mtype, field):
+        '''return the array for a field of a message type, or None. The
+        timestamps are in field _timestamp and the message numbers in
+        field _seq'''
+        cols = self.columns.get(mtype, None)
+        if cols is not None and field in cols:
+            return cols[field]
+        if self.npz is None or not field in self.fields.get(mtype, []):
+            return None
+        a = self.npz['%s.%s' % (mtype, field)]
+        if cols is None:
+            cols = self.columns[mtype] = {}
+        cols[field] = a
+        return a
+
+    def timestamps(self, mtype):
+        '''return the timestamps of a message type, or None'''
+        return self.column(mtype, '_timestamp')
+
+    def sequence(self, mtype):
+        '''return the message numbers in the log of a message type, or
+        None. These give the order of messages of different types'''
+        return self.column(mtype, '_seq')
+
+    def save(self, filename, signature):
+        '''save all columns to a cache file'''
+        arrays = {META_KEY : signature}
+        for mtype in self.fields:
+            for field in self.fields[mtype]:
+                arrays['%s.%s' % (mtype, field)] = self.column(mtype, field)
+        # write to a temporary file, so a reader never sees half a cache
+        tmpname = filename + '.tmp'
+        f = open(tmpname, 'wb')
+        numpy.savez(f, **arrays)
+        f.close()
+        if os.path.exists(filename):
+            # os.rename won't replace a file on Windows
+            os.unlink(filename)
+        os.rename(tmpname, filename)
+
+
+class ColumnBuilder(object):
+    '''build columns from messages as they are read. Messages are added
+    with add() by one thread, which should call flush() now and then.
+    Another thread can call columns() at any time to get the columns of
+    the messages flushed so far'''
+    def __init__(self, keep_types=None, chunk_size=10000):
+        self.chunk_size = chunk_size
+        self.keep_types = keep_types or set()
+        # whole messages of keep_types, in log order
+        self.kept = []
+        self.count = 0
+        self.flushed_count = 0
+        self.lock = threading.Lock()
+        # type -> (fields, list of timestamps, list of message numbers, list per field)
+        self.pending = {}
+        # type -> name -> list of arrays, or None if not numeric
+        self.chunks = {}
+
+    def add(self, m):
+        '''add the next message of the log'''
+        mtype = m.get_type()
+        if mtype == 'BAD_DATA':
+            return
+        d = self.pending.get(mtype, None)
+        if d is None:
+            fields = m.get_fieldnames()
+            d = self.pending[mtype] = (fields, [], [], [[] for f in fields])
+        (fields, tlist, seqlist, values) = d
+        tlist.append(m._timestamp)
+        seqlist.append(self.count)
+        for i in range(len(fields)):
+            values[i].append(getattr(m, fields[i], None))
+        if mtype in self.keep_types:
+            self.kept.append(m)
+        self.count += 1
+        if len(tlist) >= self.chunk_size:
+            self.flush(mtype)
+
+    def flush(self, mtype=None):
+        '''convert the messages added so far into arrays, for one type or
+        for all types'''
+        if mtype is None:
+            types = list(self.pending.keys())
+        else:
+            types = [mtype]
+        with self.lock:
+            for mtype in types:
+                (fields, tlist, seqlist, values) = self.pending.pop(mtype)
+                chunks = self.chunks.get(mtype, None)
+                if chunks is None:
+                    chunks = self.chunks[mtype] = {'_timestamp' : [], '_seq' : []}
+                chunks['_timestamp'].append(numpy.array(tlist, dtype=numpy.float64))
+                chunks['_seq'].append(numpy.array(seqlist, dtype=numpy.int64))
+                for i in range(len(fields)):
+                    if chunks.get(fields[i], []) is None:
+                        continue
+                    try:
+                        a = numpy.array(values[i], dtype=numpy.float64)
+                    except (TypeError, ValueError):
+                        a = None
+                    if a is None or a.ndim != 1:
+                        # text, arrays and missing values stay in the log
+                        chunks[fields[i]] = None
+                        continue
+                    chunks.setdefault(fields[i], []).append(a)
+            self.flushed_count = self.count
+
+    def columns(self):
+        '''return a LogColumns of the messages flushed so far'''
+        columns = {}
+        with self.lock:
+            for mtype in self.chunks:
+                chunks = self.chunks[mtype]
+                cols = {}
+                for name in chunks:
+                    if chunks[name] is None:
+                        continue
+                    if len(chunks[name]) > 1:
+                        # join the chunks, so the next call is cheaper
+                        chunks[name] = [numpy.concatenate(chunks[name])]
+                    cols[name] = chunks[name][0]
+                columns[mtype] = cols
+        return LogColumns(columns)
+
+    def finish(self):
+        '''flush all messages and return the columns'''
+        self.flush()
+        return self.columns()
+
+
+def build_columns(mlog, progress_callback=None):
+    '''read all messages of a log into columns. The log is rewound before
+    and after, keeping the messages it had'''
+    messages = dict(mlog.messages)
+    mlog.rewind()
+    builder = ColumnBuilder()
+    last_progress = 0
+    while True:
+        m = mlog.recv_msg()
+        if m is None:
+            break
+        builder.add(m)
+        if progress_callback is not None and builder.count % 10000 == 0:
+            pct = getattr(mlog, 'percent', None)
+            if pct is not None and int(pct) != last_progress:
+                last_progress = int(pct)
+                progress_callback(last_progress)
+    mlog.rewind()
+    # some log types start a new messages dict on rewind
+    mlog.messages.update(messages)
+    return builder.finish()
+
+
+def cached_columns(filename):
+    '''return the columns for a log from its cache file, or None if
+    there is no up to date cache'''
+    cachename = cache_filename(filename)
+    if not os.path.exists(cachename):
+        return None
+    try:
+        npz = numpy.load(cachename)
+        if numpy.array_equal(npz[META_KEY], log_signature(filename)):
+            return LogColumns(npz=npz)
+        npz.close()
+    except Exception as ex:
+        print("Failed to load %s: %s" % (cachename, ex))
+    return None
+
+
+def save_columns(filename, columns, signature=None):
+    '''save columns to the cache file for a log. signature should be
+    taken before the log was read, in case it changes meanwhile'''
+    if signature is None:
+        signature = log_signature(filename)
+    cachename = cache_filename(filename)
+    try:
+        columns.save(cachename, signature)
+    except Exception as ex:
+        # the log may be on read-only media
+        print("Failed to save %s: %s" % (cachename, ex))
+
+
+def load_columns(filename, mlog, save=True, progress_callback=None):
+    '''return the columns for a log, using the cache file if it is up
+    to date, otherwise building them from mlog'''
+    columns = cached_columns(filename)
+    if columns is not None:
+        return columns
+    signature = log_signature(filename)
+    columns = build_columns(mlog, progress_callback=progress_callback)
+    if save:
+        save_columns(filename, columns, signature)
+    return columns
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    from pymavlink import mavutil
+    parser = ArgumentParser(description="build the column cache for logs")
+    parser.add_argument("logs", nargs='+')
+    args = parser.parse_args()
+    for filename in args.logs:
+        t0 = time.time()
+        mlog = mavutil.mavlink_connection(filename, notimestamps=False, zero_time_base=False)
+        columns = load_columns(filename, mlog)
+        ncols = sum([len(columns.fields[mtype]) for mtype in columns.fields])
+        print("%s: %u types %u columns in %.1fs" % (filename, len(columns.fields), ncols, time.time()-t0))
@@ -5,6 +5,10 @@ class MPModule(object):
     The base class for all modules
     '''
 
+    # the MAVLink message types passed to mavlink_packet(), or None
+    # for all messages. Use set_mavlink_types() to change
+    mavlink_types = None
+
     def __init__(self, mpstate, name, description=None, public=False, multi_instance=False, multi_vehicle=False):
         '''
         Constructor
@@ -147,6 +151,36 @@ class MPModule(object):
     def add_completion_function(self, name, callback):
         self.mpstate.completion_functions[name] = callback
 
+    def add_periodic(self, callback, frequency, first_run=None):
+        '''have the main loop call callback at frequency Hz. first_run is
+        an optional time.time() deadline for the first call. Returns a
+        task whose set_next_run() can be used to move the next deadline'''
+        return self.mpstate.scheduler.add(self, callback, frequency, first_run=first_run)
+
+    def remove_periodic(self, task):
+        '''remove a callback added with add_periodic'''
+        self.mpstate.scheduler.remove(task)
+
+    def overrides(self, method_name):
+        '''return True if this module overrides the named MPModule hook'''
+        for cls in type(self).__mro__:
+            if method_name in cls.__dict__:
+                return cls is not MPModule
+        return False
+
+    def has_idle_task(self):
+        '''return True if this module overrides idle_task'''
+        return self.overrides('idle_task')
+
+    def set_mavlink_types(self, types):
+        '''set the MAVLink message types passed to mavlink_packet(). None
+        passes all messages, for modules such as messagerate that need
+        to see everything'''
+        if types is not None:
+            types = frozenset(types)
+        self.mavlink_types = types
+        self.mpstate.modules_changed()
+
     def dist_string(self, val_meters):
         '''return a distance as a string'''
         if self.settings.dist_unit == 'nm':
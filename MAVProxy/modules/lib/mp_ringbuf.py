@@ -0,0 +1,232 @@
+'''
+lock-free single producer, single consumer ring buffer in shared memory
+
+This is used to pass variable length byte records from one process to
+another without pickling or a pipe write per record. One process may
+put() and one other process may get(); no locking is needed as the
+producer only ever moves the head and the consumer only ever moves the
+tail.
+
+The memory comes from multiprocessing.shared_memory where available, so
+a ring can be passed to a child process started with either fork or
+spawn. On older pythons an anonymous shared mmap is used, which is only
+shared with children created by fork.
+
+StateRing builds on this for high rate GUI state updates, where the
+child only needs the newest value of each item.
+'''
+
+import collections
+import mmap
+import struct
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+# the head and tail counters are kept in separate cache lines
+HEAD_OFFSET = 0
+TAIL_OFFSET = 64
+HEADER_SIZE = 128
+LEN_SIZE = 4
+
+
+def attach_shared_memory(name):
+    '''attach to a shared memory segment created by another process,
+    without taking ownership of it'''
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # python before 3.13 always tracks the segment, and would
+        # unlink it when this process exits
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+        return shm
+
+
+class SPSCRingBuffer(object):
+    '''a ring buffer of byte records, with size bytes of data space'''
+    def __init__(self, size=1<<20):
+        if size & (size-1) != 0:
+            raise ValueError("ring buffer size must be a power of two")
+        self.size = size
+        self.mask = size - 1
+        self.shm = None
+        self.mm = None
+        self.owner = True
+        if shared_memory is not None:
+            self.shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE+size)
+            self.buf = self.shm.buf
+        else:
+            self.mm = mmap.mmap(-1, HEADER_SIZE+size)
+            self.buf = memoryview(self.mm)
+        struct.pack_into('<Q', self.buf, HEAD_OFFSET, 0)
+        struct.pack_into('<Q', self.buf, TAIL_OFFSET, 0)
+
+    def __getstate__(self):
+        '''allow the ring to be passed to a spawned child process'''
+        if self.shm is None:
+            raise TypeError("ring buffer can only be shared by fork on this python")
+        return {'name' : self.shm.name, 'size' : self.size}
+
+    def __setstate__(self, state):
+        self.size = state['size']
+        self.mask = self.size - 1
+        self.mm = None
+        self.owner = False
+        self.shm = attach_shared_memory(state['name'])
+        self.buf = self.shm.buf
+
+    def close(self):
+        '''release the shared memory. The creating process unlinks it'''
+        self.buf = None
+        if self.shm is not None:
+            self.shm.close()
+            if self.owner:
+                try:
+                    self.shm.unlink()
+                except Exception:
+                    pass
+            self.shm = None
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+    def _head(self):
+        return struct.unpack_from('<Q', self.buf, HEAD_OFFSET)[0]
+
+    def _tail(self):
+        return struct.unpack_from('<Q', self.buf, TAIL_OFFSET)[0]
+
+    def _write(self, pos, data):
+        '''copy data into the ring at counter position pos, wrapping as needed'''
+        ofs = pos & self.mask
+        n = len(data)
+        first = min(n, self.size - ofs)
+        self.buf[HEADER_SIZE+ofs:HEADER_SIZE+ofs+first] = data[:first]
+        if first < n:
+            self.buf[HEADER_SIZE:HEADER_SIZE+n-first] = data[first:]
+
+    def _read(self, pos, n):
+        '''copy n bytes out of the ring at counter position pos'''
+        ofs = pos & self.mask
+        first = min(n, self.size - ofs)
+        ret = bytes(self.buf[HEADER_SIZE+ofs:HEADER_SIZE+ofs+first])
+        if first < n:
+            ret += bytes(self.buf[HEADER_SIZE:HEADER_SIZE+n-first])
+        return ret
+
+    def used(self):
+        '''number of bytes waiting to be read, including record headers'''
+        return self._head() - self._tail()
+
+    def free(self):
+        '''number of bytes available for writing, including record headers'''
+        return self.size - self.used()
+
+    def empty(self):
+        return self._head() == self._tail()
+
+    def put(self, data):
+        '''add a record. Returns False if there is no room, in which case
+        the record is dropped. Must only be called by the producer'''
+        head = self._head()
+        need = LEN_SIZE + len(data)
+        if need > self.size - (head - self._tail()):
+            return False
+        self._write(head, struct.pack('<I', len(data)))
+        self._write(head+LEN_SIZE, data)
+        # publish the record only once it is completely written
+        struct.pack_into('<Q', self.buf, HEAD_OFFSET, head+need)
+        return True
+
+    def get(self):
+        '''return the next record, or None if the ring is empty. Must only
+        be called by the consumer'''
+        tail = self._tail()
+        if tail == self._head():
+            return None
+        n = struct.unpack('<I', self._read(tail, LEN_SIZE))[0]
+        ret = self._read(tail+LEN_SIZE, n)
+        struct.pack_into('<Q', self.buf, TAIL_OFFSET, tail+LEN_SIZE+n)
+        return ret
+
+    def get_all(self):
+        '''return all waiting records as a list'''
+        ret = []
+        while True:
+            r = self.get()
+            if r is None:
+                return ret
+            ret.append(r)
+
+
+class StateRing(object):
+    '''keyed state updates passed from one process to another through a
+    SPSCRingBuffer, using a fixed struct layout per update type.
+
+    The reader only gets the newest value for each (type, key), so a GUI
+    child that falls behind skips stale updates rather than working
+    through a backlog of pickled objects. Each record may also carry a
+    variable length tail, for things like labels'''
+    def __init__(self, layouts, size=1<<18):
+        self.layouts = layouts
+        self.ring = SPSCRingBuffer(size)
+        # updates that did not fit in the ring, retried on the next put
+        self.pending = collections.OrderedDict()
+        self._setup()
+
+    def _setup(self):
+        self.names = sorted(self.layouts.keys())
+        self.ids = dict([(name, i) for (i, name) in enumerate(self.names)])
+        self.structs = [struct.Struct('<' + self.layouts[name]) for name in self.names]
+
+    def __getstate__(self):
+        return {'layouts' : self.layouts, 'ring' : self.ring}
+
+    def __setstate__(self, state):
+        self.layouts = state['layouts']
+        self.ring = state['ring']
+        self.pending = collections.OrderedDict()
+        self._setup()
+
+    def flush(self):
+        '''retry updates that did not fit in the ring'''
+        while self.pending:
+            (k, record) = next(iter(self.pending.items()))
+            if not self.ring.put(record):
+                return False
+            self.pending.pop(k)
+        return True
+
+    def put(self, name, key, values, tail=b''):
+        '''send values for a key. key is a string, values a tuple
+        matching the layout for name and tail is optional extra bytes'''
+        i = self.ids[name]
+        bkey = key.encode('utf-8')
+        record = struct.pack('<BH', i, len(bkey)) + bkey + self.structs[i].pack(*values) + tail
+        if not self.flush() or not self.ring.put(record):
+            # keep only the newest update for this key until there is room
+            self.pending.pop((name, key), None)
+            self.pending[(name, key)] = record
+
+    def get_latest(self):
+        '''return the newest update for each key sent since the last call,
+        as an ordered dict of (name, key) -> (values, tail), in the order
+        the keys were first updated'''
+        ret = collections.OrderedDict()
+        for record in self.ring.get_all():
+            (i, klen) = struct.unpack_from('<BH', record)
+            key = record[3:3+klen].decode('utf-8')
+            s = self.structs[i]
+            ofs = 3 + klen
+            ret[(self.names[i], key)] = (s.unpack_from(record, ofs), record[ofs+s.size:])
+        return ret
+
+    def close(self):
+        self.ring.close()
@@ -0,0 +1,115 @@
+'''
+MAVLink packet framing for router mode
+
+This splits a byte stream into MAVLink packets using only the packet
+header, so packets can be routed by system ID and message ID without
+building pymavlink message objects. The CRC is not checked here; packets
+that are decoded are checked by pymavlink, and forwarded packets are
+checked by the receiver.
+'''
+
+from pymavlink import mavutil
+
+PROTOCOL_MARKER_V1 = 0xFE
+PROTOCOL_MARKER_V2 = 0xFD
+MAVLINK_IFLAG_SIGNED = 0x01
+MAVLINK_SIGNATURE_BLOCK_LEN = 13
+
+
+class MAVFramer(object):
+    '''split a byte stream into MAVLink packets without decoding them'''
+    def __init__(self):
+        self.buf = bytearray()
+
+    def frames(self, data):
+        '''add data to the stream, returning a list of complete packets
+        as (msgbuf, msgid, sysid, compid, seq) tuples. Bytes that are not
+        part of a MAVLink packet are returned with a msgid of -1'''
+        buf = self.buf
+        buf.extend(data)
+        ret = []
+        i = 0
+        n = len(buf)
+        while i < n:
+            c = buf[i]
+            if c == PROTOCOL_MARKER_V2:
+                if n - i < 10:
+                    break
+                total = buf[i+1] + 12
+                if buf[i+2] & MAVLINK_IFLAG_SIGNED:
+                    total += MAVLINK_SIGNATURE_BLOCK_LEN
+                if n - i < total:
+                    break
+                msgid = buf[i+7] | (buf[i+8]<<8) | (buf[i+9]<<16)
+                ret.append((bytes(buf[i:i+total]), msgid, buf[i+5], buf[i+6], buf[i+4]))
+                i += total
+            elif c == PROTOCOL_MARKER_V1:
+                if n - i < 6:
+                    break
+                total = buf[i+1] + 8
+                if n - i < total:
+                    break
+                ret.append((bytes(buf[i:i+total]), buf[i+5], buf[i+3], buf[i+4], buf[i+2]))
+                i += total
+            else:
+                # skip to the next start of packet marker
+                j1 = buf.find(bytearray([PROTOCOL_MARKER_V1]), i)
+                j2 = buf.find(bytearray([PROTOCOL_MARKER_V2]), i)
+                if j1 == -1 and j2 == -1:
+                    j = n
+                elif j1 == -1 or (j2 != -1 and j2 < j1):
+                    j = j2
+                else:
+                    j = j1
+                ret.append((bytes(buf[i:j]), -1, 0, 0, 0))
+                i = j
+        del buf[:i]
+        return ret
+
+
+def msgids_for_types(types):
+    '''return the set of message IDs for a set of message type names'''
+    ret = set()
+    for msgid in mavutil.mavlink.mavlink_map:
+        cls = mavutil.mavlink.mavlink_map[msgid]
+        name = getattr(cls, 'msgname', None)
+        if name is None:
+            # pymavlink 2.4.30 and earlier
+            name = cls.name
+        if name in types:
+            ret.add(msgid)
+    return ret
+
+
+def track_loss(master, msgid, sysid, compid, seq):
+    '''update the packet loss statistics of a link for a packet that is
+    not decoded, matching what mavfile.post_message() does for decoded
+    messages'''
+    src_tuple = (sysid, compid)
+    if src_tuple == (ord('3'), ord('D')):
+        # radio status packets are not counted
+        return
+    last_seq = master.last_seq.get(src_tuple, -1)
+    expected = (last_seq+1) % 256
+    if expected != seq and last_seq != -1:
+        master.mav_loss += (seq - expected) % 256
+    master.last_seq[src_tuple] = seq
+    master.mav_count += 1
+
+
+def crc_ok(msgbuf, msgid):
+    '''check the CRC of a framed packet. Packets for message IDs not in
+    the current dialect can't be checked and are accepted'''
+    cls = mavutil.mavlink.mavlink_map.get(msgid, None)
+    if cls is None:
+        return True
+    if msgbuf[0] == PROTOCOL_MARKER_V2:
+        headerlen = 10
+    else:
+        headerlen = 6
+    end = headerlen + msgbuf[1]
+    if len(msgbuf) < end + 2:
+        return False
+    crc = mavutil.mavlink.x25crc(msgbuf[1:end])
+    crc.accumulate(bytearray([cls.crc_extra]))
+    return crc.crc == (msgbuf[end] | (msgbuf[end+1]<<8))
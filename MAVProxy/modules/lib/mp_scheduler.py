@@ -0,0 +1,111 @@
+'''
+scheduler for periodic module callbacks
+
+Modules register callbacks with a frequency (or an absolute deadline)
+and the main loop only wakes the callbacks that are due, instead of
+calling every idle_task on every pass of the loop.
+'''
+
+import heapq
+import time
+
+
+class MPScheduledTask(object):
+    '''a periodic callback registered with the scheduler'''
+    def __init__(self, owner, callback, frequency, next_run):
+        self.owner = owner
+        self.callback = callback
+        self.frequency = frequency
+        self.next_run = next_run
+        self.removed = False
+
+    def set_next_run(self, deadline):
+        '''override the time of the next call. May be called from within
+        the callback to implement a one-off deadline'''
+        self.next_run = deadline
+
+    def __repr__(self):
+        return "MPScheduledTask(%s, %s, %.2fHz)" % (self.owner, self.callback, self.frequency)
+
+
+class MPScheduler(object):
+    '''run periodic callbacks when they are due
+
+    tasks are kept in a heap ordered by their next run time, so
+    finding due tasks costs O(log n) per due task rather than a scan
+    of all modules. At most budget seconds are spent in callbacks per
+    run() call so that one slow task can't hold up packet processing;
+    any remaining due tasks are run on the next call
+    '''
+    def __init__(self, budget=0.02, on_error=None):
+        self.heap = []
+        self.budget = budget
+        self.on_error = on_error
+        self.seq = 0
+
+    def _push(self, task):
+        self.seq += 1
+        heapq.heappush(self.heap, (task.next_run, self.seq, task))
+
+    def add(self, owner, callback, frequency, first_run=None):
+        '''add a callback to be called at frequency Hz. The first call is
+        at first_run (a time.time() value) if given, otherwise one period
+        from now'''
+        if frequency <= 0:
+            raise ValueError("scheduler frequency must be positive")
+        if first_run is None:
+            first_run = time.time() + 1.0/frequency
+        task = MPScheduledTask(owner, callback, frequency, first_run)
+        self._push(task)
+        return task
+
+    def remove(self, task):
+        '''remove a task. It is dropped lazily when it reaches the top of
+        the heap'''
+        task.removed = True
+
+    def remove_owner(self, owner):
+        '''remove all tasks belonging to owner, used on module unload'''
+        for (next_run, seq, task) in self.heap:
+            if task.owner is owner:
+                task.removed = True
+
+    def tasks(self, owner=None):
+        '''return the list of active tasks, optionally for one owner'''
+        return [task for (next_run, seq, task) in sorted(self.heap)
+                if not task.removed and (owner is None or task.owner is owner)]
+
+    def next_deadline(self):
+        '''return the time the next task is due, or None'''
+        while self.heap and self.heap[0][2].removed:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return None
+        return self.heap[0][0]
+
+    def run(self, now=None):
+        '''run all due tasks, within the time budget'''
+        if now is None:
+            now = time.time()
+        start = time.time()
+        while self.heap and self.heap[0][0] <= now:
+            (next_run, seq, task) = heapq.heappop(self.heap)
+            if task.removed:
+                continue
+            # schedule from the planned time to avoid drift, but never
+            # try to catch up on missed calls
+            period = 1.0/task.frequency
+            task.next_run = next_run + period
+            if task.next_run <= now:
+                task.next_run = now + period
+            try:
+                task.callback()
+            except Exception as ex:
+                if self.on_error is not None:
+                    self.on_error(task, ex)
+                else:
+                    print("scheduler task %s failed: %s" % (task, ex))
+            if not task.removed:
+                self._push(task)
+            if time.time() - start > self.budget:
+                break
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+'''
+polyline simplification
+
+A flight path can have hundreds of thousands of points, far more than
+can be seen at most map zoom levels. douglas_peucker() finds the points
+needed to draw a path to within a tolerance, which for a map is the
+ground size of a pixel, so the simplified path looks the same as the
+full one.
+'''
+
+import math
+
+import numpy
+
+from MAVProxy.modules.lib import mp_util
+
+
+def local_xy(lat, lon):
+    '''return arrays of x and y in meters for arrays of lat and lon, on a
+    flat earth around the first point. This is accurate enough for
+    comparing distances along a flight path'''
+    lat = numpy.asarray(lat, dtype=numpy.float64)
+    lon = numpy.asarray(lon, dtype=numpy.float64)
+    if len(lat) == 0:
+        return (lat, lon)
+    scale = mp_util.radius_of_earth * math.pi / 180.0
+    x = (lon - lon[0]) * scale * math.cos(math.radians(lat[0]))
+    y = (lat - lat[0]) * scale
+    return (x, y)
+
+
+def douglas_peucker(x, y, tolerance, keep=None):
+    '''return a boolean array of the points of the polyline x, y to keep
+    so that no point removed is more than tolerance from the simplified
+    line. keep is an optional boolean array of points that must be kept,
+    such as where the colour of a path changes'''
+    n = len(x)
+    ret = numpy.zeros(n, dtype=bool)
+    if n == 0:
+        return ret
+    if keep is not None:
+        ret |= keep
+    ret[0] = True
+    ret[-1] = True
+    fixed = numpy.flatnonzero(ret)
+    stack = [(fixed[i], fixed[i+1]) for i in range(len(fixed)-1) if fixed[i+1] - fixed[i] > 1]
+    while stack:
+        (i0, i1) = stack.pop()
+        xs = x[i0+1:i1] - x[i0]
+        ys = y[i0+1:i1] - y[i0]
+        dx = x[i1] - x[i0]
+        dy = y[i1] - y[i0]
+        seglen = math.hypot(dx, dy)
+        if seglen == 0:
+            # the path came back to where it was
+            d = numpy.hypot(xs, ys)
+        else:
+            d = numpy.abs(dy*xs - dx*ys) / seglen
+        k = numpy.argmax(d)
+        if d[k] <= tolerance:
+            continue
+        j = i0 + 1 + k
+        ret[j] = True
+        if j - i0 > 1:
+            stack.append((i0, j))
+        if i1 - j > 1:
+            stack.append((j, i1))
+    return ret
@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+'''
+sidecar index for telemetry logs
+
+A tlog is a sequence of 8 byte big endian timestamps, each followed by a
+MAVLink packet, so finding one message type or a time range normally
+means parsing the whole file. The index is written alongside the log
+(flight.tlog.idx) while logging, and records the file offset of every
+message grouped by message ID, in blocks covering a time range.
+
+The index file starts with a magic string, followed by one checkpoint
+block for each stretch of log. A block has a header of
+ 'CHKP', start offset, end offset, start time, end time, number of IDs
+followed for each message ID by the ID, a count and that many uint32
+offsets relative to the block start. A block cut short by a crash is
+ignored, and any log data after the last complete block is scanned
+normally by readers.
+'''
+
+import array
+import bisect
+import heapq
+import os
+import struct
+import sys
+
+from MAVProxy.modules.lib import mp_router
+
+INDEX_MAGIC = b'MPTLIDX1'
+block_header = struct.Struct('<4sQQddI')
+id_header = struct.Struct('<II')
+
+# records must start with a timestamp and at least a v1 header
+MIN_RECORD_LEN = 8 + 6
+
+
+def index_filename(filename):
+    '''return the index filename for a tlog'''
+    return filename + '.idx'
+
+
+def record_msgid(record):
+    '''return the message ID and length of the tlog record at the start
+    of a buffer, or (None, None) if it is not a complete MAVLink packet'''
+    if len(record) < MIN_RECORD_LEN:
+        return (None, None)
+    marker = record[8]
+    if marker == mp_router.PROTOCOL_MARKER_V1:
+        return (record[13], 8 + record[9] + 8)
+    if marker == mp_router.PROTOCOL_MARKER_V2:
+        if len(record) < 18:
+            return (None, None)
+        total = record[9] + 12
+        if record[10] & mp_router.MAVLINK_IFLAG_SIGNED:
+            total += mp_router.MAVLINK_SIGNATURE_BLOCK_LEN
+        return (record[15] | (record[16]<<8) | (record[17]<<16), 8 + total)
+    return (None, None)
+
+
+class TlogIndexWriter(object):
+    '''build an index while a tlog is written. add() must be called with
+    each record as it is written to the log, and offset is the size of
+    the log before the first record'''
+    def __init__(self, filename, offset=0, checkpoint_interval=10.0):
+        self.checkpoint_interval = checkpoint_interval
+        exists = os.path.exists(filename) and os.path.getsize(filename) > 0
+        self.f = open(filename, 'ab')
+        if not exists:
+            self.f.write(INDEX_MAGIC)
+        self.offset = offset
+        self._new_block()
+
+    def _new_block(self):
+        self.block_start = self.offset
+        self.block_tstart = None
+        self.block_tend = None
+        self.offsets = {}
+
+    def add(self, record):
+        '''add a record, which is a timestamp followed by one packet'''
+        (msgid, length) = record_msgid(bytearray(record[:18]))
+        if msgid is not None:
+            # the bottom bits of the timestamp hold the link number
+            t = (struct.unpack('>Q', bytes(record[:8]))[0] & ~3) * 1.0e-6
+            if self.block_tstart is None:
+                self.block_tstart = t
+            elif t - self.block_tstart >= self.checkpoint_interval:
+                self.checkpoint()
+                self.block_tstart = t
+            self.block_tend = max(t, self.block_tend or t)
+            ofs = self.offsets.get(msgid, None)
+            if ofs is None:
+                ofs = self.offsets[msgid] = array.array('I')
+            ofs.append(self.offset - self.block_start)
+        self.offset += len(record)
+
+    def checkpoint(self):
+        '''write out the block for the records added so far'''
+        if self.offsets:
+            data = [block_header.pack(b'CHKP', self.block_start, self.offset,
+                                      self.block_tstart, self.block_tend, len(self.offsets))]
+            for msgid in sorted(self.offsets.keys()):
+                ofs = self.offsets[msgid]
+                if sys.byteorder != 'little':
+                    ofs.byteswap()
+                data.append(id_header.pack(msgid, len(ofs)))
+                if hasattr(ofs, 'tobytes'):
+                    data.append(ofs.tobytes())
+                else:
+                    # python2
+                    data.append(ofs.tostring())
+            self.f.write(b''.join(data))
+            self.f.flush()
+        self._new_block()
+
+    def close(self):
+        self.checkpoint()
+        self.f.close()
+
+
+class TlogIndexBlock(object):
+    '''one checkpoint block of an index'''
+    def __init__(self, start, end, tstart, tend, offsets):
+        self.start = start
+        self.end = end
+        self.tstart = tstart
+        self.tend = tend
+        # msgid -> array of offsets relative to start
+        self.offsets = offsets
+
+
+class TlogIndex(object):
+    '''read the index for a tlog'''
+    def __init__(self, filename):
+        self.blocks = []
+        f = open(filename, 'rb')
+        data = f.read()
+        f.close()
+        if data[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            raise ValueError("%s is not a tlog index" % filename)
+        pos = len(INDEX_MAGIC)
+        while pos + block_header.size <= len(data):
+            (magic, start, end, tstart, tend, nids) = block_header.unpack_from(data, pos)
+            if magic != b'CHKP':
+                break
+            p = pos + block_header.size
+            offsets = {}
+            for i in range(nids):
+                if p + id_header.size > len(data):
+                    break
+                (msgid, count) = id_header.unpack_from(data, p)
+                p += id_header.size
+                ofs = array.array('I')
+                if hasattr(ofs, 'frombytes'):
+                    ofs.frombytes(data[p:p+4*count])
+                else:
+                    # python2
+                    ofs.fromstring(data[p:p+4*count])
+                if len(ofs) != count:
+                    break
+                if sys.byteorder != 'little':
+                    ofs.byteswap()
+                offsets[msgid] = ofs
+                p += 4*count
+            if len(offsets) != nids:
+                # block cut short by a crash
+                break
+            self.blocks.append(TlogIndexBlock(start, end, tstart, tend, offsets))
+            pos = p
+        self.tstarts = [b.tstart for b in self.blocks]
+
+    def end_offset(self):
+        '''offset in the log of the first record not covered by the index'''
+        if not self.blocks:
+            return 0
+        return self.blocks[-1].end
+
+    def counts(self):
+        '''return a dict of msgid -> number of messages'''
+        ret = {}
+        for b in self.blocks:
+            for msgid in b.offsets:
+                ret[msgid] = ret.get(msgid, 0) + len(b.offsets[msgid])
+        return ret
+
+    def time_range(self):
+        '''return (first, last) timestamps covered by the index'''
+        if not self.blocks:
+            return (None, None)
+        return (self.blocks[0].tstart, max([b.tend for b in self.blocks]))
+
+    def blocks_in_range(self, tstart=None, tend=None):
+        '''return the blocks that may hold messages between tstart and tend'''
+        i = 0
+        if tstart is not None:
+            # blocks are in log order, but timestamps from several links
+            # can overlap a little, so check each block's end time
+            i = max(bisect.bisect_right(self.tstarts, tstart) - 1, 0)
+            while i < len(self.blocks) and self.blocks[i].tend < tstart:
+                i += 1
+        ret = []
+        for b in self.blocks[i:]:
+            if tend is not None and b.tstart > tend:
+                break
+            ret.append(b)
+        return ret
+
+    def offset_for_time(self, t):
+        '''return a log offset to start reading at to get messages from time t'''
+        blocks = self.blocks_in_range(tstart=t)
+        if not blocks:
+            return self.end_offset()
+        return blocks[0].start
+
+    def offsets(self, msgids=None, tstart=None, tend=None):
+        '''return the log offsets of the messages with the given IDs, in
+        log order. Blocks are selected by time, so messages just outside
+        the time range may be included'''
+        ret = []
+        for b in self.blocks_in_range(tstart, tend):
+            if msgids is None:
+                ids = b.offsets.keys()
+            else:
+                ids = [msgid for msgid in msgids if msgid in b.offsets]
+            lists = [[b.start + o for o in b.offsets[msgid]] for msgid in ids]
+            ret.extend(heapq.merge(*lists))
+        return ret
+
+
+def build_index(filename, checkpoint_interval=10.0):
+    '''build the index for an existing tlog'''
+    idxname = index_filename(filename)
+    if os.path.exists(idxname):
+        os.unlink(idxname)
+    writer = TlogIndexWriter(idxname, checkpoint_interval=checkpoint_interval)
+    f = open(filename, 'rb')
+    buf = bytearray()
+    while True:
+        data = f.read(1<<20)
+        if data:
+            buf.extend(data)
+        pos = 0
+        while True:
+            (msgid, length) = record_msgid(buf[pos:pos+18])
+            if msgid is None:
+                if len(buf) - pos < 18 and data:
+                    # need more data
+                    break
+                if len(buf) - pos <= MIN_RECORD_LEN:
+                    break
+                # not a record we understand. Skip to the next packet
+                # marker, keeping the bytes in the offsets
+                n = 1
+                while pos + 8 + n < len(buf) and buf[pos+8+n] not in (mp_router.PROTOCOL_MARKER_V1,
+                                                                       mp_router.PROTOCOL_MARKER_V2):
+                    n += 1
+                writer.offset += n
+                pos += n
+                continue
+            if pos + length > len(buf):
+                break
+            writer.add(buf[pos:pos+length])
+            pos += length
+        del buf[:pos]
+        if not data:
+            break
+    f.close()
+    writer.close()
+    return TlogIndex(idxname)
+
+
+def load_index(filename, build=False):
+    '''return the index for a tlog, or None if there isn't one. If build
+    is True then a missing index is created'''
+    idxname = index_filename(filename)
+    if os.path.exists(idxname):
+        try:
+            return TlogIndex(idxname)
+        except Exception as ex:
+            print("Failed to load %s: %s" % (idxname, ex))
+    if build:
+        return build_index(filename)
+    return None
+
+
+def indexed_messages(mlog, index, types=None, tstart=None, tend=None):
+    '''generate the messages of the given types from a mavlogfile using
+    an index, between optional start and end times. HEARTBEAT messages
+    are always read so that mlog.flightmode stays correct. Messages
+    after the end of the index are found by reading the log normally'''
+    if types is not None:
+        types = set(types)
+        msgids = mp_router.msgids_for_types(types | set(['HEARTBEAT']))
+    else:
+        msgids = None
+    filesize = os.path.getsize(mlog.filename)
+    for ofs in index.offsets(msgids, tstart, tend):
+        if ofs >= filesize:
+            # the index can be ahead of a log that was not flushed
+            return
+        mlog.f.seek(ofs)
+        m = mlog.recv_msg()
+        if m is None:
+            continue
+        if tstart is not None and m._timestamp < tstart:
+            continue
+        if tend is not None and m._timestamp > tend:
+            continue
+        if types is None or m.get_type() in types:
+            yield m
+    if index.end_offset() >= filesize:
+        return
+    mlog.f.seek(index.end_offset())
+    while True:
+        m = mlog.recv_match(type=types)
+        if m is None:
+            return
+        if tstart is not None and m._timestamp < tstart:
+            continue
+        if tend is not None and m._timestamp > tend:
+            return
+        yield m
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    from pymavlink import mavutil
+    parser = ArgumentParser(description="build or show the index for telemetry logs")
+    parser.add_argument("--rebuild", action='store_true', help="rebuild existing indexes")
+    parser.add_argument("logs", nargs='+')
+    args = parser.parse_args()
+    for filename in args.logs:
+        if args.rebuild:
+            index = build_index(filename)
+        else:
+            index = load_index(filename, build=True)
+        (t1, t2) = index.time_range()
+        print("%s: %u blocks" % (filename, len(index.blocks)))
+        if t1 is not None:
+            print("  %.1f seconds" % (t2 - t1))
+        counts = index.counts()
+        for msgid in sorted(counts.keys()):
+            cls = mavutil.mavlink.mavlink_map.get(msgid, None)
+            if cls is None:
+                name = str(msgid)
+            elif hasattr(cls, 'msgname'):
+                name = cls.msgname
+            else:
+                # pymavlink 2.4.30 and earlier
+                name = cls.name
+            print("  %-30s %u" % (name, counts[msgid]))
@@ -87,6 +87,24 @@ def gps_offset(lat, lon, east, north):
     return gps_newpos(lat, lon, bearing, distance)
 
 
+def gps_offset_array(lat, lon, east, north):
+    '''vectorised gps_offset, for numpy arrays of positions and/or
+    offsets. Returns a (lat, lon) tuple of arrays'''
+    import numpy
+    east = numpy.asarray(east, dtype=float)
+    north = numpy.asarray(north, dtype=float)
+    lat1 = numpy.radians(lat)
+    lon1 = numpy.radians(lon)
+    brng = numpy.arctan2(east, north)
+    dr = numpy.sqrt(east**2 + north**2)/radius_of_earth
+
+    lat2 = numpy.arcsin(numpy.sin(lat1)*numpy.cos(dr) +
+                        numpy.cos(lat1)*numpy.sin(dr)*numpy.cos(brng))
+    lon2 = lon1 + numpy.arctan2(numpy.sin(brng)*numpy.sin(dr)*numpy.cos(lat1),
+                                numpy.cos(dr)-numpy.sin(lat1)*numpy.sin(lat2))
+    return (numpy.degrees(lat2), wrap_valid_longitude(numpy.degrees(lon2)))
+
+
 def mkdir_p(dir):
     '''like mkdir -p'''
     if not dir:
@@ -146,6 +164,20 @@ def bounds_overlap(bound1, bound2):
     return True
 
 
+def polygon_outside(point, points):
+    '''return True if a point is outside a polygon, given as a list of
+    (x,y) points'''
+    (x, y) = point
+    inside = False
+    n = len(points)
+    for i in range(n):
+        (x1, y1) = points[i]
+        (x2, y2) = points[(i+1) % n]
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / float(y2 - y1):
+            inside = not inside
+    return not inside
+
+
 class object_container:
     '''return a picklable object from an existing object,
     containing all of the normal attributes of the original'''
@@ -10,6 +10,7 @@ from MAVProxy.modules.lib.wxconsole_util import Value, Text
 from MAVProxy.modules.lib import textconsole
 from MAVProxy.modules.lib import win_layout
 from MAVProxy.modules.lib import multiproc
+from MAVProxy.modules.lib.mp_ringbuf import StateRing
 
 class MessageConsole(textconsole.SimpleConsole):
     '''
@@ -22,6 +23,10 @@ class MessageConsole(textconsole.SimpleConsole):
         self.menu_callback = None
         self.parent_pipe_recv,self.child_pipe_send = multiproc.Pipe(duplex=False)
         self.child_pipe_recv,self.parent_pipe_send = multiproc.Pipe(duplex=False)
+        # status values are sent through a shared memory ring, so the
+        # child only sees the latest text for each status field. The
+        # record holds the row and colours, with the text as the tail
+        self.status_ring = StateRing({'Value' : 'B32s32s'})
         self.close_event = multiproc.Event()
         self.close_event.clear()
         self.child = multiproc.Process(target=self.child_task)
@@ -74,7 +79,18 @@ class MessageConsole(textconsole.SimpleConsole):
     def set_status(self, name, text='', row=0, fg='black', bg='white'):
         '''set a status value'''
         if self.is_alive():
-            self.parent_pipe_send.send(Value(name, text, row, fg, bg))
+            self.status_ring.put('Value', name,
+                                 (row, fg.encode('utf-8'), bg.encode('utf-8')),
+                                 tail=str(text).encode('utf-8'))
+
+    def get_status(self):
+        '''get the latest status values, in the child'''
+        ret = []
+        for ((vtype, name), ((row, fg, bg), text)) in self.status_ring.get_latest().items():
+            ret.append(Value(name, text.decode('utf-8'), row,
+                             fg.rstrip(b'\0').decode('utf-8'),
+                             bg.rstrip(b'\0').decode('utf-8')))
+        return ret
 
     def set_menu(self, menu, callback):
         if self.is_alive():
@@ -86,6 +102,7 @@ class MessageConsole(textconsole.SimpleConsole):
         self.close_event.set()
         if self.is_alive():
             self.child.join(2)
+        self.status_ring.close()
 
     def is_alive(self):
         '''check if child is still going'''
@@ -84,14 +84,17 @@ class ConsoleFrame(wx.Frame):
             self.timer.Stop()
             self.Destroy()
             return
+        objs = []
         while state.child_pipe_recv.poll():
             try:
-                obj = state.child_pipe_recv.recv()
+                objs.append(state.child_pipe_recv.recv())
             except EOFError:
                 self.timer.Stop()
                 self.Destroy()
                 return
-            
+        objs.extend(state.get_status())
+
+        for obj in objs:
             if isinstance(obj, Value):
                 # request to set a status field
                 if not obj.name in self.values:
@@ -4,6 +4,8 @@
   MAVProxy horizon indicator.
 """
 from MAVProxy.modules.lib import multiproc
+from MAVProxy.modules.lib.mp_ringbuf import StateRing
+from MAVProxy.modules.lib import wxhorizon_util
 import time
 
 class HorizonIndicator():
@@ -14,6 +16,9 @@ class HorizonIndicator():
         self.title  = title
         # Create Pipe to send attitude information from module to UI
         self.child_pipe_recv,self.parent_pipe_send = multiproc.Pipe()
+        # high rate attitude, HUD, altitude and battery updates go through
+        # a shared memory ring so the UI only sees the latest of each
+        self.state_ring = StateRing(wxhorizon_util.state_layouts)
         self.close_event = multiproc.Event()
         self.close_event.clear()
         self.child = multiproc.Process(target=self.child_task)
@@ -34,11 +39,21 @@ class HorizonIndicator():
         app.MainLoop()
         self.close_event.set()   # indicate that the GUI has closed
 
+    def send_state(self, obj):
+        '''send a high rate update to the UI'''
+        self.state_ring.put(type(obj).__name__, '', wxhorizon_util.state_values(obj))
+
+    def get_state(self):
+        '''get the latest high rate updates, in the UI'''
+        return [wxhorizon_util.from_state_values(name, values)
+                for ((name, key), (values, tail)) in self.state_ring.get_latest().items()]
+
     def close(self):
         '''Close the window.'''
         self.close_event.set()
         if self.is_alive():
             self.child.join(2)
+        self.state_ring.close()
 
     def is_alive(self):
         '''check if child is still going'''
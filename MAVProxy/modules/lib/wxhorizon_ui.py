@@ -581,8 +581,10 @@ class HorizonFrame(wx.Frame):
             self.on_idle(0)
         
         # Get attitude information
-        while state.child_pipe_recv.poll():           
-            objList = state.child_pipe_recv.recv()
+        objLists = [state.get_state()]
+        while state.child_pipe_recv.poll():
+            objLists.append(state.child_pipe_recv.recv())
+        for objList in objLists:
             for obj in objList:
                 self.calcFontScaling()
                 if isinstance(obj,Attitude):
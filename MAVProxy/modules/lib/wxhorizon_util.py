@@ -1,12 +1,14 @@
-class Attitude():
+class Attitude(object):
     '''The current Attitude Data'''
+    state_fields = ('pitch', 'roll', 'yaw')
     def __init__(self, attitudeMsg):
         self.pitch = attitudeMsg.pitch
         self.roll = attitudeMsg.roll
         self.yaw = attitudeMsg.yaw
 
-class VFR_HUD():
+class VFR_HUD(object):
     '''HUD Information.'''
+    state_fields = ('airspeed', 'groundspeed', 'heading', 'throttle', 'climbRate')
     def __init__(self,hudMsg):
         self.airspeed = hudMsg.airspeed
         self.groundspeed = hudMsg.groundspeed
@@ -14,19 +16,49 @@ class VFR_HUD():
         self.throttle = hudMsg.throttle
         self.climbRate = hudMsg.climb
         
-class Global_Position_INT():
+class Global_Position_INT(object):
     '''Altitude relative to ground (GPS).'''
+    state_fields = ('relAlt', 'curTime')
     def __init__(self,gpsINT,curTime):
         self.relAlt = gpsINT.relative_alt/1000.0
         self.curTime = curTime
         
-class BatteryInfo():
+class BatteryInfo(object):
     '''Voltage, current and remaning battery.'''
+    state_fields = ('voltage', 'current', 'batRemain')
     def __init__(self,batMsg):
         self.voltage = batMsg.voltage_battery/1000.0 # Volts
         self.current = batMsg.current_battery/100.0 # Amps
         self.batRemain = batMsg.battery_remaining # %
         
+# the high rate updates are sent to the GUI through a StateRing with
+# these record layouts, so the GUI only sees the latest of each
+state_layouts = {
+    'Attitude' : 'ddd',
+    'VFR_HUD' : 'ddhHd',
+    'Global_Position_INT' : 'dd',
+    'BatteryInfo' : 'ddb',
+}
+
+state_classes = {
+    'Attitude' : Attitude,
+    'VFR_HUD' : VFR_HUD,
+    'Global_Position_INT' : Global_Position_INT,
+    'BatteryInfo' : BatteryInfo,
+}
+
+def state_values(obj):
+    '''values of a high rate update, in state_layouts order'''
+    return tuple([getattr(obj, f) for f in obj.state_fields])
+
+def from_state_values(name, values):
+    '''recreate a high rate update from its values'''
+    cls = state_classes[name]
+    obj = cls.__new__(cls)
+    for (f, v) in zip(cls.state_fields, values):
+        setattr(obj, f, v)
+    return obj
+
 class FlightState():
     '''Mode and arm state.'''
     def __init__(self,mode,armState):
@@ -11,6 +11,7 @@ if mp_util.has_wxpython:
 class FenceModule(mp_module.MPModule):
     def __init__(self, mpstate):
         super(FenceModule, self).__init__(mpstate, "fence", "geo-fence management", public = True)
+        self.set_mavlink_types(['FENCE_STATUS', 'SYS_STATUS'])
         self.fenceloader_by_sysid = {}
         self.last_fence_breach = 0
         self.last_fence_status = 0
@@ -23,6 +24,7 @@ class FenceModule(mp_module.MPModule):
                           "<load|save> (FILENAME)"])
 
         self.have_list = False
+        self.add_periodic(self.periodic_task, 1)
 
         if self.continue_mode and self.logdir is not None:
             fencetxt = os.path.join(self.logdir, 'fence.txt')
@@ -54,8 +56,8 @@ class FenceModule(mp_module.MPModule):
             self.fenceloader_by_sysid[self.target_system] = mavwp.MAVFenceLoader()
         return self.fenceloader_by_sysid[self.target_system]
 
-    def idle_task(self):
-        '''called on idle'''
+    def periodic_task(self):
+        '''called once a second by the scheduler'''
         if self.module('console') is not None and not self.menu_added_console:
             self.menu_added_console = True
             self.module('console').add_menu(self.menu)
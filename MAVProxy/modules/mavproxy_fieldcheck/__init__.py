@@ -438,6 +438,7 @@ class FieldCheckModule(mp_module.MPModule):
         ]
 
         self.field = None
+        self.add_periodic(self.periodic_task, 1)
 
     def select_field(self, field):
         self.field = field
@@ -458,8 +459,8 @@ class FieldCheckModule(mp_module.MPModule):
                 self.select_field(field)
 
 
-    def idle_task(self):
-        '''run periodic tasks'''
+    def periodic_task(self):
+        '''run periodic tasks, called once a second by the scheduler'''
         if self.field is not None:
             self.field.idle_task()
 
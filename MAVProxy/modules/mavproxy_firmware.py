@@ -26,6 +26,7 @@ class FirmwareModule(mp_module.MPModule):
         self.downloaders_lock = threading.Lock()
         self.downloaders = {}
         self.manifests_parse()
+        self.add_periodic(self.check_downloaders, 2)
 
     def usage(self):
         '''show help on a command line options'''
@@ -306,11 +307,11 @@ fw download releasetype=OFFICIAL frame=quad platform=PX4-v2
     def download_url(self, url, path):
         mp_util.download_files([(url,path)])
 
-    def idle_task(self):
-        '''called rapidly by mavproxy'''
+    def check_downloaders(self):
+        '''called periodically to reap finished download threads'''
         if self.downloaders_lock.acquire(False):
             removed_one = False
-            for url in self.downloaders.keys():
+            for url in list(self.downloaders.keys()):
                 if not self.downloaders[url].is_alive():
                     print("fw: Download thread for (%s) done" % url)
                     del self.downloaders[url]
@@ -74,17 +74,17 @@ class HorizonModule(mp_module.MPModule):
                 # Send Flight State information down pipe
                 self.msgList.append(FlightState(self.mode,self.armed))
         elif msgType == 'ATTITUDE':
-            # Send attitude information down pipe
-            self.msgList.append(Attitude(msg))
+            # Send attitude information through the state ring
+            self.mpstate.horizonIndicator.send_state(Attitude(msg))
         elif msgType == 'VFR_HUD':
-            # Send HUD information down pipe
-            self.msgList.append(VFR_HUD(msg))
+            # Send HUD information through the state ring
+            self.mpstate.horizonIndicator.send_state(VFR_HUD(msg))
         elif msgType == 'GLOBAL_POSITION_INT':
-            # Send altitude information down pipe
-            self.msgList.append(Global_Position_INT(msg,time.time()))
+            # Send altitude information through the state ring
+            self.mpstate.horizonIndicator.send_state(Global_Position_INT(msg,time.time()))
         elif msgType == 'SYS_STATUS':
             # Mode and Arm State
-            self.msgList.append(BatteryInfo(msg))
+            self.mpstate.horizonIndicator.send_state(BatteryInfo(msg))
         elif msgType in ['WAYPOINT_CURRENT', 'MISSION_CURRENT']:
             # Waypoints
             self.currentWP = msg.seq
@@ -105,7 +105,7 @@ class HorizonModule(mp_module.MPModule):
         if self.mpstate.horizonIndicator.close_event.wait(0.001):
             self.needs_unloading = True   # tell MAVProxy to unload this module
     
-        if (time.time() - self.lastSend) > self.sendDelay:
+        if self.msgList and (time.time() - self.lastSend) > self.sendDelay:
             self.mpstate.horizonIndicator.parent_pipe_send.send(self.msgList)
             self.msgList = []
             self.lastSend = time.time()
@@ -11,6 +11,8 @@ import time, struct, math, sys, fnmatch, traceback, json
 
 from MAVProxy.modules.lib import mp_module
 from MAVProxy.modules.lib import mp_util
+from MAVProxy.modules.lib import mp_linkworker
+from MAVProxy.modules.lib import mp_router
 
 if mp_util.has_wxpython:
     from MAVProxy.modules.lib.mp_menu import *
@@ -20,6 +22,9 @@ delayedPackets = frozenset([ 'MISSION_CURRENT', 'SYS_STATUS', 'VFR_HUD',
                   'GPS_RAW_INT', 'SCALED_PRESSURE', 'GLOBAL_POSITION_INT',
                   'NAV_CONTROLLER_OUTPUT' ])
 activityPackets = frozenset([ 'HEARTBEAT', 'GPS_RAW_INT', 'GPS_RAW', 'GLOBAL_POSITION_INT', 'SYS_STATUS' ])
+# packets the link module itself needs decoded in router mode
+routerPackets = activityPackets.union(delayedPackets).union([ 'STATUSTEXT', 'ATTITUDE', 'SIMSTATE',
+                                                              'COMPASSMOT_STATUS', 'COMMAND_ACK', 'MISSION_ACK' ])
 
 preferred_ports = [
     '*FTDI*',
@@ -45,10 +50,14 @@ class LinkModule(mp_module.MPModule):
         self.add_command('vehicle', self.cmd_vehicle, "vehicle control")
         self.no_fwd_types = set()
         self.no_fwd_types.add("BAD_DATA")
+        # message IDs of no_fwd_types, for router mode
+        self.no_fwd_key = None
+        self.no_fwd_ids = set()
         self.add_completion_function('(SERIALPORT)', self.complete_serial_ports)
         self.add_completion_function('(LINKS)', self.complete_links)
         self.add_completion_function('(LINK)', self.complete_links)
         self.last_altitude_announce = 0.0
+        self.add_periodic(self.check_link_workers, 10)
 
         self.menu_added_console = False
         if mp_util.has_wxpython:
@@ -219,12 +228,69 @@ class LinkModule(mp_module.MPModule):
         self.apply_link_attributes(conn, optional_attributes)
         self.mpstate.mav_master.append(conn)
         self.status.counters['MasterIn'].append(0)
+        conn.worker = getattr(conn, 'worker', self.settings.linkworkers)
+        if conn.worker:
+            self.start_link_worker(conn)
+        self.mpstate.select_changed()
         try:
             mp_util.child_fd_list_add(conn.port.fileno())
         except Exception:
             pass
         return True
 
+    def start_link_worker(self, conn):
+        '''start reading a link in a worker process'''
+        if getattr(conn, 'link_worker', None) is not None:
+            return
+        if self.status.setup_mode:
+            # check_link_workers() starts it after setup mode
+            return
+        if not mp_linkworker.supported(conn):
+            print("Link workers not supported for %s" % conn.address)
+            conn.worker = False
+            return
+        try:
+            conn.link_worker = mp_linkworker.LinkWorker(conn)
+        except Exception as e:
+            print("Failed to start link worker for %s: %s" % (conn.address, e))
+            conn.worker = False
+            return
+        conn.worker_port = conn.port
+        print("Started link worker for %s" % conn.address)
+        self.mpstate.select_changed()
+
+    def stop_link_worker(self, conn):
+        '''stop the worker process for a link'''
+        worker = getattr(conn, 'link_worker', None)
+        if worker is None:
+            return
+        conn.link_worker = None
+        worker.close()
+        self.mpstate.select_changed()
+
+    def check_link_workers(self):
+        '''keep the link workers in step with their links. A worker reads
+        its own copy of the connection, so it is restarted when the main
+        process resets or reconnects the link. In setup mode the main
+        process reads the links itself to show the shell output'''
+        for conn in self.mpstate.mav_master:
+            worker = getattr(conn, 'link_worker', None)
+            if self.status.setup_mode or not getattr(conn, 'worker', False):
+                if worker is not None:
+                    self.stop_link_worker(conn)
+                    conn.worker_port = None
+                continue
+            if worker is not None and worker.port is conn.port:
+                continue
+            if worker is None and getattr(conn, 'worker_port', None) is conn.port:
+                # the worker stopped, so the main process reads the link
+                # until it is reconnected
+                continue
+            if conn.portdead:
+                continue
+            self.stop_link_worker(conn)
+            self.start_link_worker(conn)
+
     def cmd_link_add(self, args):
         '''add new link'''
         descriptor = args[0]
@@ -239,6 +305,11 @@ class LinkModule(mp_module.MPModule):
         conn = self.mpstate.mav_master[i]
         atts = self.parse_link_attributes(attributes)
         self.apply_link_attributes(conn, atts)
+        if 'worker' in atts:
+            if atts['worker']:
+                self.start_link_worker(conn)
+            else:
+                self.stop_link_worker(conn)
 
     def cmd_link_attributes(self, args):
         '''change optional link attributes'''
@@ -274,6 +345,7 @@ class LinkModule(mp_module.MPModule):
             return
         conn = self.mpstate.mav_master[i]
         print("Removing link %s" % conn.address)
+        self.stop_link_worker(conn)
         try:
             try:
                 mp_util.child_fd_list_remove(conn.port.fileno())
@@ -285,6 +357,7 @@ class LinkModule(mp_module.MPModule):
             pass
         self.mpstate.mav_master.pop(i)
         self.status.counters['MasterIn'].pop(i)
+        self.mpstate.select_changed()
         # renumber the links
         for j in range(len(self.mpstate.mav_master)):
             conn = self.mpstate.mav_master[j]
@@ -540,15 +613,28 @@ class LinkModule(mp_module.MPModule):
 
 
 
-    def master_callback(self, m, master):
-        '''process mavlink message m on master, sending any messages to recipients'''
+    def no_fwd_msgids(self):
+        '''return the message IDs of no_fwd_types, for routing packets
+        that are not decoded'''
+        if self.no_fwd_key != self.no_fwd_types:
+            self.no_fwd_key = set(self.no_fwd_types)
+            self.no_fwd_ids = mp_router.msgids_for_types(self.no_fwd_types)
+        return self.no_fwd_ids
+
+    def master_callback(self, m, master, routed=False):
+        '''process mavlink message m on master, sending any messages to recipients.
+        If routed is True the packet has already been counted, logged and
+        forwarded by the router'''
 
         # see if it is handled by a specialised sysid connection
         sysid = m.get_srcSystem()
         mtype = m.get_type()
+        # the packed message as received, shared by all forwarding below
+        msgbuf = m.get_msgbuf()
 
         if sysid in self.mpstate.sysid_outputs:
-            self.mpstate.sysid_outputs[sysid].write(m.get_msgbuf())
+            if not routed:
+                self.mpstate.queue_forward(self.mpstate.sysid_outputs[sysid], msgbuf)
             if mtype == "GLOBAL_POSITION_INT":
                 for modname in 'map', 'asterix', 'NMEA', 'NMEA2':
                     mod = self.module(modname)
@@ -558,25 +644,26 @@ class LinkModule(mp_module.MPModule):
 
         if getattr(m, '_timestamp', None) is None:
             master.post_message(m)
-        self.status.counters['MasterIn'][master.linknum] += 1
+        if not routed:
+            self.status.counters['MasterIn'][master.linknum] += 1
 
-        if mtype == 'GLOBAL_POSITION_INT':
+        if mtype == 'GLOBAL_POSITION_INT' and not routed:
             # send GLOBAL_POSITION_INT to 2nd GCS for 2nd vehicle display
             for sysid in self.mpstate.sysid_outputs:
-                self.mpstate.sysid_outputs[sysid].write(m.get_msgbuf())
+                self.mpstate.queue_forward(self.mpstate.sysid_outputs[sysid], msgbuf)
 
             if self.mpstate.settings.fwdpos:
                 for link in self.mpstate.mav_master:
                     if link != master:
-                        link.write(m.get_msgbuf())
+                        self.mpstate.queue_forward(link, msgbuf)
 
         # and log them
-        if mtype not in dataPackets and self.mpstate.logqueue:
+        if mtype not in dataPackets and self.mpstate.logqueue and not routed:
             # put link number in bottom 2 bits, so we can analyse packet
             # delay in saved logs
             usec = self.get_usec()
             usec = (usec & ~3) | master.linknum
-            self.mpstate.logqueue.put(bytearray(struct.pack('>Q', usec) + m.get_msgbuf()))
+            self.mpstate.logqueue.put(bytearray(struct.pack('>Q', usec) + msgbuf))
 
         # keep the last message of each type around
         self.status.msgs[mtype] = m
@@ -607,26 +694,25 @@ class LinkModule(mp_module.MPModule):
         self.master_msg_handling(m, master)
 
         # don't pass along bad data
-        if mtype != 'BAD_DATA':
+        if mtype != 'BAD_DATA' and not routed:
             # pass messages along to listeners, except for REQUEST_DATA_STREAM, which
             # would lead a conflict in stream rate setting between mavproxy and the other
             # GCS
             if self.mpstate.settings.mavfwd_rate or mtype != 'REQUEST_DATA_STREAM':
                 if mtype not in self.no_fwd_types:
                     for r in self.mpstate.mav_outputs:
-                        r.write(m.get_msgbuf())
+                        self.mpstate.queue_forward(r, msgbuf)
             if self.mpstate.settings.mavfwdmasters:
                 for omaster in self.mpstate.mav_master:
                     if omaster != master:
-                        omaster.write(m.get_msgbuf())
+                        self.mpstate.queue_forward(omaster, msgbuf)
 
+        if mtype != 'BAD_DATA':
             sysid = m.get_srcSystem()
             target_sysid = self.target_system
 
-            # pass to modules
-            for (mod,pm) in self.mpstate.modules:
-                if not hasattr(mod, 'mavlink_packet'):
-                    continue
+            # pass to modules subscribed to this message type
+            for mod in self.mpstate.mavlink_handlers(mtype):
                 if not mod.multi_vehicle and sysid != target_sysid:
                     # only pass packets not from our target to modules that
                     # have marked themselves as being multi-vehicle capable
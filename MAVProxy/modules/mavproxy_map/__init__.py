@@ -7,6 +7,7 @@ June 2012
 
 import sys, os, math
 import functools
+import threading
 import time
 from MAVProxy.modules.mavproxy_map import mp_elevation
 from MAVProxy.modules.lib import mp_util
@@ -18,6 +19,9 @@ from pymavlink import mavutil
 class MapModule(mp_module.MPModule):
     def __init__(self, mpstate):
         super(MapModule, self).__init__(mpstate, "map", "map display", public = True, multi_instance=True, multi_vehicle=True)
+        self.set_mavlink_types(['HEARTBEAT', 'SIMSTATE', 'AHRS2', 'AHRS3', 'GPS_RAW_INT', 'GPS2_RAW',
+                                'GLOBAL_POSITION_INT', 'LOCAL_POSITION_NED', 'HOME_POSITION',
+                                'NAV_CONTROLLER_OUTPUT', 'POSITION_TARGET_GLOBAL_INT'])
         cmdname = "map"
         if self.instance > 1:
             cmdname += "%u" % self.instance
@@ -63,7 +67,17 @@ class MapModule(mp_module.MPModule):
         title = "Map"
         if self.instance > 1:
             title += str(self.instance)
-        self.map = mp_slipmap.MPSlipMap(service=service, elevation=True, title=title)
+        # memory and disk tile cache sizes, in megabytes
+        cache_bytes = None
+        disk_cache_bytes = None
+        if 'MAP_CACHE_MB' in os.environ:
+            cache_bytes = int(float(os.environ['MAP_CACHE_MB'])*1024*1024)
+        if 'MAP_DISK_CACHE_MB' in os.environ:
+            disk_cache_bytes = int(float(os.environ['MAP_DISK_CACHE_MB'])*1024*1024)
+        self.map = mp_slipmap.MPSlipMap(service=service, elevation=True, title=title,
+                                        cache_bytes=cache_bytes, disk_cache_bytes=disk_cache_bytes)
+        self.disk_cache_bytes = disk_cache_bytes
+        self.seeder = None
         if self.instance == 1:
             self.mpstate.map = self.map
             mpstate.map_functions = { 'draw_lines' : self.draw_lines }
@@ -73,7 +87,8 @@ class MapModule(mp_module.MPModule):
                                                                 'set (MAPSETTING)',
                                                                 'zoom',
                                                                 'center',
-                                                                'follow'])
+                                                                'follow',
+                                                                'seed <bbox|polygon|status|stop>'])
         self.add_completion_function('(MAPSETTING)', self.map_settings.completion)
 
         self.default_popup = MPMenuSubMenu('Popup', items=[])
@@ -169,6 +184,8 @@ class MapModule(mp_module.MPModule):
             self.cmd_center(args)
         elif args[0] == "follow":
             self.cmd_follow(args)
+        elif args[0] == "seed":
+            self.cmd_seed(args[1:])
         else:
             print("usage: map <icon|set>")
 
@@ -480,6 +497,8 @@ class MapModule(mp_module.MPModule):
     def unload(self):
         '''unload module'''
         super(MapModule, self).unload()
+        if self.seeder is not None:
+            self.seeder.stop()
         self.map.close()
         if self.instance == 1:
             self.mpstate.map = None
@@ -604,6 +623,67 @@ class MapModule(mp_module.MPModule):
         lon = float(args[2])
         self.map.set_center(lat, lon)
 
+    def cmd_seed(self, args):
+        '''download map tiles for an area for offline use'''
+        from MAVProxy.modules.mavproxy_map import mp_tile
+        usage = "usage: map seed <bbox LAT1 LON1 LAT2 LON2|polygon FILE> MINZOOM MAXZOOM, map seed <status|stop>"
+        if len(args) == 1 and args[0] == "status":
+            if self.seeder is None:
+                print("No map seed running")
+            else:
+                print(self.seeder.progress())
+            return
+        if len(args) == 1 and args[0] == "stop":
+            if self.seeder is not None:
+                self.seeder.stop()
+            return
+        polygon = None
+        if len(args) == 7 and args[0] == "bbox":
+            try:
+                (lat1, lon1, lat2, lon2) = [float(v) for v in args[1:5]]
+            except ValueError:
+                print(usage)
+                return
+        elif len(args) == 4 and args[0] == "polygon":
+            try:
+                polygon = mp_util.polygon_load(args[1])
+            except Exception as ex:
+                print("Failed to load %s: %s" % (args[1], ex))
+                return
+            (lat1, lon1, dlat, dlon) = mp_util.polygon_bounds(polygon)
+            (lat2, lon2) = (lat1+dlat, lon1+dlon)
+        else:
+            print(usage)
+            return
+        try:
+            zooms = range(int(args[-2]), int(args[-1])+1)
+        except ValueError:
+            print(usage)
+            return
+        if len(zooms) == 0:
+            print("MINZOOM must not be more than MAXZOOM")
+            print(usage)
+            return
+        if self.seeder is not None and not self.seeder.stopped and self.seeder.done() < self.seeder.total:
+            print("A map seed is already running")
+            return
+        # the map GUI has its own tile downloader, this one shares only
+        # the disk cache with it
+        cache_args = {}
+        if self.disk_cache_bytes is not None:
+            cache_args['disk_cache_bytes'] = self.disk_cache_bytes
+        mt = mp_tile.MPTile(service=self.map.service, max_zoom=max(zooms), **cache_args)
+        tiles = mt.area_tiles(lat1, lon1, lat2, lon2, zooms, polygon=polygon)
+        print("Seeding %u map tiles" % len(tiles))
+        self.seeder = mp_tile.TileSeeder(mt, tiles)
+        t = threading.Thread(target=self.seeder.run, kwargs={'report' : self.seed_report, 'report_interval' : 10})
+        t.daemon = True
+        t.start()
+
+    def seed_report(self, text):
+        '''report map seed progress'''
+        print(text)
+
     def cmd_follow(self, args):
         '''control following of vehicle'''
         if len(args) < 2:
@@ -23,7 +23,6 @@ class ElevationModel():
         if self.database == 'srtm':
             self.downloader = srtm.SRTMDownloader(offline=offline, debug=debug)
             self.downloader.loadFileList()
-            self.tileDict = dict()
 
         '''Use the Geoscience Australia database instead - watch for the correct database path'''
         if self.database == 'geoscience':
@@ -36,26 +35,49 @@ class ElevationModel():
         if latitude is None or longitude is None:
             return None
         if self.database == 'srtm':
-            TileID = (numpy.floor(latitude), numpy.floor(longitude))
-            if TileID in self.tileDict:
-                alt = self.tileDict[TileID].getAltitudeFromLatLon(latitude, longitude)
-            else:
-                tile = self.downloader.getTile(numpy.floor(latitude), numpy.floor(longitude))
-                if tile == 0:
-                    if timeout > 0:
-                        t0 = time.time()
-                        while time.time() < t0+timeout and tile == 0:
-                            tile = self.downloader.getTile(numpy.floor(latitude), numpy.floor(longitude))
-                            if tile == 0:
-                                time.sleep(0.1)
-                if tile == 0:
-                    return None
-                self.tileDict[TileID] = tile
-                alt = tile.getAltitudeFromLatLon(latitude, longitude)
+            # the downloader keeps recently used tiles
+            tile = self.downloader.getTile(numpy.floor(latitude), numpy.floor(longitude))
+            if tile == 0:
+                if timeout > 0:
+                    t0 = time.time()
+                    while time.time() < t0+timeout and tile == 0:
+                        tile = self.downloader.getTile(numpy.floor(latitude), numpy.floor(longitude))
+                        if tile == 0:
+                            time.sleep(0.1)
+            if tile == 0:
+                return None
+            alt = tile.getAltitudeFromLatLon(latitude, longitude)
         if self.database == 'geoscience':
              alt = self.mappy.getAltitudeAtPoint(latitude, longitude)
         return alt
 
+    def GetElevations(self, latitudes, longitudes, timeout=0):
+        '''Returns an array of altitudes (m ASL) for arrays of lat/long
+        points, which may span several tiles. Points in tiles that are
+        not available are NaN'''
+        latitudes = numpy.asarray(latitudes, dtype=float)
+        longitudes = numpy.asarray(longitudes, dtype=float)
+        if self.database != 'srtm':
+            return numpy.array([numpy.nan if a is None else a for a in
+                                [self.GetElevation(lat, lon, timeout) for (lat, lon) in
+                                 zip(latitudes.flat, longitudes.flat)]]).reshape(latitudes.shape)
+        ret = numpy.full(latitudes.shape, numpy.nan)
+        tile_lats = numpy.floor(latitudes)
+        tile_lons = numpy.floor(longitudes)
+        tile_ids = set(zip(tile_lats.flat, tile_lons.flat))
+        for (tlat, tlon) in tile_ids:
+            tile = self.downloader.getTile(tlat, tlon)
+            if tile == 0 and timeout > 0:
+                t0 = time.time()
+                while time.time() < t0+timeout and tile == 0:
+                    time.sleep(0.1)
+                    tile = self.downloader.getTile(tlat, tlon)
+            if tile == 0:
+                continue
+            mask = (tile_lats == tlat) & (tile_lons == tlon)
+            ret[mask] = tile.getAltitudesFromLatLon(latitudes[mask], longitudes[mask])
+        return ret
+
 
 if __name__ == "__main__":
 
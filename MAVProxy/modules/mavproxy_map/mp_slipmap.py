@@ -39,7 +39,9 @@ class MPSlipMap():
                  brightness=0,
                  elevation=False,
                  download=True,
-                 show_flightmode_legend=True):
+                 show_flightmode_legend=True,
+                 cache_bytes=None,
+                 disk_cache_bytes=None):
 
         self.lat = lat
         self.lon = lon
@@ -55,6 +57,8 @@ class MPSlipMap():
         self.oldtext = None
         self.brightness = brightness
         self.legend = show_flightmode_legend
+        self.cache_bytes = cache_bytes
+        self.disk_cache_bytes = disk_cache_bytes
 
         self.drag_step = 10
 
@@ -78,11 +82,16 @@ class MPSlipMap():
 
         state = self
 
+        cache_args = {}
+        if self.disk_cache_bytes is not None:
+            cache_args['disk_cache_bytes'] = self.disk_cache_bytes
         self.mt = mp_tile.MPTile(download=self.download,
                                  service=self.service,
                                  tile_delay=self.tile_delay,
                                  debug=self.debug,
-                                 max_zoom=self.max_zoom)
+                                 max_zoom=self.max_zoom,
+                                 cache_bytes=self.cache_bytes,
+                                 **cache_args)
         state.layers = {}
         state.info = {}
         state.need_redraw = True
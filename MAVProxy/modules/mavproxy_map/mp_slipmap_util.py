@@ -16,6 +16,7 @@ import warnings
 
 from MAVProxy.modules.mavproxy_map import mp_elevation
 from MAVProxy.modules.mavproxy_map import mp_tile
+from MAVProxy.modules.lib import mp_simplify
 from MAVProxy.modules.lib import mp_util
 
 def image_shape(img):
@@ -247,6 +248,105 @@ class SlipPolygon(SlipObject):
         return self._selected_vertex
 
 
+class SlipPolyline(SlipPolygon):
+    '''a long path to display on the map, such as the flight path of a
+    log. Only the points needed at the current zoom level are drawn, and
+    the simplified paths are kept for each zoom level'''
+    def __init__(self, key, points, layer, colour, linewidth, popup_menu=None):
+        SlipPolygon.__init__(self, key, points, layer, colour, linewidth, popup_menu=popup_menu)
+        self._lat = None
+        # zoom level -> indexes of points to draw
+        self._levels = {}
+        self._pix_index = []
+
+    def __getstate__(self):
+        # the arrays are rebuilt after passing to the map process
+        state = self.__dict__.copy()
+        state['_lat'] = None
+        state['_levels'] = {}
+        return state
+
+    def _setup(self):
+        '''build arrays of the points'''
+        self._lat = np.array([p[0] for p in self.points], dtype=np.float64)
+        self._lon = np.array([p[1] for p in self.points], dtype=np.float64)
+        (self._x, self._y) = mp_simplify.local_xy(self._lat, self._lon)
+        self._colours = [p[2] if len(p) > 2 else self.colour for p in self.points]
+        # points where the colour changes are always drawn
+        self._breaks = np.zeros(len(self.points), dtype=bool)
+        for i in range(1, len(self.points)):
+            self._breaks[i] = self._colours[i] != self._colours[i-1]
+
+    def level_points(self, pixmapper):
+        '''return the indexes of the points to draw at the zoom level of
+        pixmapper'''
+        # size of a pixel in meters
+        (lat, lon) = (self._lat[0], self._lon[0])
+        (lat2, lon2) = mp_util.gps_newpos(lat, lon, 90, 1000)
+        pix = abs(pixmapper((lat2, lon2))[0] - pixmapper((lat, lon))[0])
+        pixel_size = 1000.0 / max(pix, 0.001)
+        # zoom levels are powers of two, so there are few of them
+        level = int(math.floor(math.log(pixel_size, 2)))
+        idx = self._levels.get(level, None)
+        if idx is None:
+            # half a pixel or less, so the simplified path looks the same
+            keep = mp_simplify.douglas_peucker(self._x, self._y, 2.0**(level-1), keep=self._breaks)
+            idx = self._levels[level] = np.flatnonzero(keep)
+        return idx
+
+    def draw(self, img, pixmapper, bounds):
+        '''draw the path on the image'''
+        if self.hidden or len(self.points) < 2:
+            return
+        if self._lat is None:
+            self._setup()
+        idx = self.level_points(pixmapper)
+        # position of each drawn point in idx, to find gaps
+        pos = np.arange(len(idx))
+        if bounds is not None:
+            # only draw lines whose bounding box overlaps the view, so
+            # a long straight line across the view is still drawn
+            lat = self._lat[idx]
+            lon = self._lon[idx]
+            inview = ((np.maximum(lat[:-1], lat[1:]) >= bounds[0]) &
+                      (np.minimum(lat[:-1], lat[1:]) <= bounds[0]+bounds[2]) &
+                      (np.maximum(lon[:-1], lon[1:]) >= bounds[1]) &
+                      (np.minimum(lon[:-1], lon[1:]) <= bounds[1]+bounds[3]))
+            near = np.zeros(len(idx), dtype=bool)
+            near[:-1] |= inview
+            near[1:] |= inview
+            idx = idx[near]
+            pos = pos[near]
+        self._pix_index = idx
+        self._pix_points = [pixmapper(self.points[i]) for i in idx]
+
+        def draw_run(start, end):
+            if end > start:
+                pts = np.array(self._pix_points[start:end+1], dtype=np.int32).reshape(-1, 1, 2)
+                cv2.polylines(img, [pts], False, self._colours[idx[start]], self.linewidth)
+
+        start = 0
+        for k in range(1, len(idx)):
+            if pos[k] != pos[k-1] + 1:
+                # points in between are out of view
+                draw_run(start, k-1)
+                start = k
+            elif self._colours[idx[k]] != self._colours[idx[start]]:
+                # the next line is a new colour
+                draw_run(start, k)
+                start = k
+        draw_run(start, len(idx)-1)
+
+    def clicked(self, px, py):
+        '''see if the path has been clicked on, selecting the nearest
+        drawn point'''
+        ret = SlipPolygon.clicked(self, px, py)
+        if ret is not None:
+            # vertexes are numbered by their place in the full path
+            self._selected_vertex = int(self._pix_index[self._selected_vertex])
+        return ret
+
+
 class SlipGrid(SlipObject):
     '''a map grid'''
     def __init__(self, key, layer, colour, linewidth):
@@ -9,9 +9,14 @@ May 2012
 released under GNU GPL v3 or later
 '''
 
+from __future__ import print_function
+
 import collections
 import errno
 import hashlib
+import heapq
+import itertools
+import socket
 import sys
 import math
 import threading
@@ -21,14 +26,25 @@ import time
 import cv2
 import numpy as np
 
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
 if sys.version_info.major < 3:
     from urllib2 import Request as url_request
     from urllib2 import urlopen as url_open
     from urllib2 import URLError as url_error
+    from urllib2 import getproxies as url_getproxies
+    from urlparse import urlparse as url_parse
+    import httplib as http_client
 else:
     from urllib.request import Request as url_request
     from urllib.request import urlopen as url_open
     from urllib.error import URLError as url_error
+    from urllib.request import getproxies as url_getproxies
+    from urllib.parse import urlparse as url_parse
+    import http.client as http_client
 
 from MAVProxy.modules.lib import mp_util
 
@@ -98,6 +114,9 @@ class TileInfo:
         self.zoom = zoom
         self.service = service
         (self.offsetx, self.offsety) = offset
+        # set for tiles requested for the current view, which are
+        # dropped from the download queue once they are off screen
+        self.cancellable = False
         self.refresh_time()
 
     def key(self):
@@ -161,12 +180,150 @@ class TileInfoScaled(TileInfo):
         (self.dstx, self.dsty) = dst
 
 
+class TileMemoryCache:
+    '''an in memory LRU cache of tile images, bounded by bytes'''
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        try:
+            self.cache = collections.OrderedDict()
+        except AttributeError:
+            # OrderedDicts in python 2.6 come from the ordereddict module
+            # which is a 3rd party package, not in python2.6 distribution
+            import ordereddict
+            self.cache = ordereddict.OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.cache
+
+    def __len__(self):
+        return len(self.cache)
+
+    def get(self, key):
+        '''return a cached image, or None. A hit makes the tile the most
+        recently used'''
+        with self.lock:
+            img = self.cache.pop(key, None)
+            if img is not None:
+                self.cache[key] = img
+            return img
+
+    def put(self, key, img):
+        '''add an image, evicting the least recently used tiles to
+        stay within the byte budget'''
+        with self.lock:
+            old = self.cache.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old.nbytes
+            self.cache[key] = img
+            self.total_bytes += img.nbytes
+            while self.total_bytes > self.max_bytes and len(self.cache) > 1:
+                (k, v) = self.cache.popitem(last=False)
+                self.total_bytes -= v.nbytes
+
+
+class TileDiskIndex:
+    '''
+    an index of the tiles in the on-disk cache, kept in a sqlite database
+    in the cache directory. It records the size, download time and last
+    access time of each tile file, so the age of a tile can be checked
+    without a stat() and the least recently used tiles can be removed
+    when the cache grows beyond max_bytes.
+
+    Tiles already on disk when the index is created are added as they
+    are first loaded. Several processes may share a cache directory, so
+    the size of the cache is always taken from the index.
+    '''
+    def __init__(self, cache_path, max_bytes):
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        dbpath = os.path.join(cache_path, 'tileindex.sqlite')
+        try:
+            self.db = self.open(dbpath)
+        except sqlite3.DatabaseError:
+            # the index is only a cache, start again if it is damaged
+            os.unlink(dbpath)
+            self.db = self.open(dbpath)
+        # bytes this process has added since it last checked the size
+        # of the cache
+        self.unchecked_bytes = 0
+        self.last_check = 0
+
+    def open(self, dbpath):
+        db = sqlite3.connect(dbpath, timeout=10, check_same_thread=False, isolation_level=None)
+        db.execute('PRAGMA synchronous=OFF')
+        db.execute('CREATE TABLE IF NOT EXISTS tiles (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, atime REAL)')
+        db.execute('CREATE INDEX IF NOT EXISTS tiles_atime ON tiles (atime)')
+        return db
+
+    def lookup(self, path):
+        '''return the download time of a tile that is on disk, marking it
+        as used'''
+        now = time.time()
+        with self.lock:
+            row = self.db.execute('SELECT mtime FROM tiles WHERE path=?', (path,)).fetchone()
+            if row is not None:
+                self.db.execute('UPDATE tiles SET atime=? WHERE path=?', (now, path))
+                return row[0]
+        # a tile from before the index existed
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        self.add(path, st.st_size, st.st_mtime)
+        return st.st_mtime
+
+    def total_bytes(self):
+        '''return the size of all the tiles in the cache'''
+        return self.db.execute('SELECT COALESCE(SUM(size),0) FROM tiles').fetchone()[0]
+
+    def add(self, path, size, mtime=None):
+        '''record a tile written to the disk cache'''
+        now = time.time()
+        if mtime is None:
+            mtime = now
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO tiles VALUES (?,?,?,?)', (path, size, mtime, now))
+            # summing the index is a scan of it, so only check the size
+            # every 1% of the budget or once a second
+            self.unchecked_bytes += size
+            if self.unchecked_bytes < self.max_bytes * 0.01 and now - self.last_check < 1:
+                return
+            self.unchecked_bytes = 0
+            self.last_check = now
+            total = self.total_bytes()
+        if total > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        '''remove least recently used tiles until the cache is 10% below
+        its byte budget'''
+        target = self.max_bytes * 0.9
+        with self.lock:
+            total = self.total_bytes()
+            rows = self.db.execute('SELECT path, size FROM tiles ORDER BY atime').fetchall()
+            removed = []
+            for (path, size) in rows:
+                if total <= target:
+                    break
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+                total -= size
+                removed.append((path,))
+            self.db.executemany('DELETE FROM tiles WHERE path=?', removed)
+
 
 class MPTile:
     '''map tile object'''
     def __init__(self, cache_path=None, download=True, cache_size=500,
              service="MicrosoftSat", tile_delay=0.3, debug=False,
-             max_zoom=19, refresh_age=30*24*60*60):
+             max_zoom=19, refresh_age=30*24*60*60,
+             cache_bytes=None, disk_cache_bytes=2*1024*1024*1024,
+             download_threads=4):
 
         if cache_path is None:
             try:
@@ -183,6 +340,9 @@ class MPTile:
         self.min_zoom = 1
         self.download = download
         self.cache_size = cache_size
+        if cache_bytes is None:
+            # cache_size is the number of full tiles to keep in memory
+            cache_bytes = cache_size * TILES_WIDTH * TILES_HEIGHT * 3
         self.tile_delay = tile_delay
         self.service = service
         self.debug = debug
@@ -191,18 +351,35 @@ class MPTile:
         if service not in TILE_SERVICES:
             raise TileException('unknown tile service %s' % service)
 
-        # _download_pending is a dictionary of TileInfo objects
+        # _download_pending is a dictionary of TileInfo objects, including
+        # the tiles being downloaded, which are also in _download_active.
+        # _download_heap orders the waiting tiles by priority, and may
+        # hold stale entries for tiles that have since been re-requested
         self._download_pending = {}
-        self._download_thread = None
+        self._download_active = set()
+        self._download_heap = []
+        self._download_seq = itertools.count()
+        self._download_cond = threading.Condition()
+        self._download_threads = []
+        self.download_threads = download_threads
+        self._view_center = None
         self._loading = mp_icon('loading.jpg')
         self._unavailable = mp_icon('unavailable.jpg')
-        try:
-            self._tile_cache = collections.OrderedDict()
-        except AttributeError:
-            # OrderedDicts in python 2.6 come from the ordereddict module
-            # which is a 3rd party package, not in python2.6 distribution
-            import ordereddict
-            self._tile_cache = ordereddict.OrderedDict()
+        self._tile_cache = TileMemoryCache(cache_bytes)
+        # scaled RGB tiles ready to copy into the area image, keyed by
+        # tile and scaled size
+        self._scaled_cache = TileMemoryCache(cache_bytes // 2)
+        # the last area image, and what it shows, so that panning only
+        # needs to draw the newly exposed part
+        self._canvas = None
+        self._canvas_view = None
+        self._canvas_incomplete = set()
+        self._disk_index = None
+        if sqlite3 is not None:
+            try:
+                self._disk_index = TileDiskIndex(cache_path, disk_cache_bytes)
+            except Exception as ex:
+                print("tile cache index unavailable: %s" % ex)
 
     def set_service(self, service):
         '''set tile service'''
@@ -247,79 +424,249 @@ class MPTile:
         '''return number of tiles pending download'''
         return len(self._download_pending)
 
-    def downloader(self):
-        '''the download thread'''
-        while self.tiles_pending() > 0:
-            time.sleep(self.tile_delay)
+    def is_pending(self, key):
+        '''return True if a tile is waiting for or being downloaded'''
+        return key in self._download_pending
 
-            keys = sorted(self._download_pending.keys())
+    def tile_cached(self, tile):
+        '''return True if a tile is in the disk cache and not due for a
+        refresh'''
+        path = self.tile_to_path(tile)
+        if self._disk_index is not None:
+            mtime = self._disk_index.lookup(path)
+        else:
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                mtime = None
+        return mtime is not None and mtime + self.refresh_age >= time.time()
+
+    def area_tiles(self, lat1, lon1, lat2, lon2, zooms, polygon=None):
+        '''return the TileInfo objects covering a box with corners
+        (lat1,lon1) and (lat2,lon2) for each zoom in zooms. If polygon is
+        given, as a list of (lat,lon) points, only tiles that overlap
+        the polygon are returned'''
+        # the mercator projection stops short of the poles
+        north = min(max(lat1, lat2), 85.0)
+        south = max(min(lat1, lat2), -85.0)
+        west = min(lon1, lon2)
+        east = max(lon1, lon2)
+        ret = []
+        for zoom in zooms:
+            tile_min = self.coord_to_tile(north, west, zoom)
+            tile_max = self.coord_to_tile(south, east, zoom)
+            for y in range(tile_min.y, tile_max.y+1):
+                for x in range(tile_min.x, tile_max.x+1):
+                    tile = TileInfo((x,y), zoom, self.service)
+                    if polygon is not None and not self.tile_in_polygon(tile, polygon):
+                        continue
+                    ret.append(tile)
+        return ret
 
-            # work out which one to download next, choosing by request_time
-            tile_info = self._download_pending[keys[0]]
-            for key in keys:
-                if self._download_pending[key].request_time > tile_info.request_time:
-                    tile_info = self._download_pending[key]
+    def tile_in_polygon(self, tile, polygon):
+        '''return True if a tile overlaps a polygon of (lat,lon) points.
+        The tile overlaps if its centre or a corner is in the polygon, or
+        a polygon point is in the tile'''
+        points = [tile.coord((0,0)), tile.coord((TILES_WIDTH,0)),
+                  tile.coord((TILES_WIDTH,TILES_HEIGHT)), tile.coord((0,TILES_HEIGHT)),
+                  tile.coord((TILES_WIDTH/2,TILES_HEIGHT/2))]
+        for p in points:
+            if not mp_util.polygon_outside(p, polygon):
+                return True
+        (north, west) = points[0]
+        (south, east) = points[2]
+        for (lat, lon) in polygon:
+            if south <= lat <= north and west <= lon <= east:
+                return True
+        return False
+
+    def download_priority(self, tile):
+        '''priority of a tile download, lower is sooner. The most recently
+        requested tiles come first, then those nearest the view centre'''
+        distance = 0
+        if self._view_center is not None:
+            distance = tile.distance(self._view_center[0], self._view_center[1])
+        return (-int(tile.request_time*2), distance)
+
+    def queue_download(self, tile):
+        '''add a tile to the download queue, or move it up the queue if it
+        is already waiting'''
+        key = tile.key()
+        with self._download_cond:
+            if key in self._download_pending:
+                tile = self._download_pending[key]
+                tile.refresh_time()
+                if key in self._download_active:
+                    return
+            else:
+                self._download_pending[key] = tile
+            heapq.heappush(self._download_heap, (self.download_priority(tile), next(self._download_seq),
+                                                 tile.request_time, key))
+            if len(self._download_heap) > 4*len(self._download_pending) + 64:
+                self._compact_download_heap()
+            self._download_cond.notify()
+        self.start_download_thread()
 
-            url = tile_info.url(self.service)
-            path = self.tile_to_path(tile_info)
-            key = tile_info.key()
+    def _compact_download_heap(self):
+        '''remove stale heap entries. Called with _download_cond held'''
+        heap = []
+        for (prio, seq, request_time, key) in self._download_heap:
+            tile = self._download_pending.get(key, None)
+            if tile is not None and tile.request_time == request_time and key not in self._download_active:
+                heap.append((prio, seq, request_time, key))
+        heapq.heapify(heap)
+        self._download_heap = heap
+
+    def cancel_downloads(self, keep, keys=None):
+        '''drop waiting downloads for view tiles whose key is not in keep.
+        If keys is given, those tiles are dropped instead'''
+        with self._download_cond:
+            for (key, tile) in list(self._download_pending.items()):
+                if key in self._download_active:
+                    continue
+                if keys is not None:
+                    if key in keys:
+                        self._download_pending.pop(key)
+                elif tile.cancellable and key not in keep:
+                    self._download_pending.pop(key)
+
+    def _next_download(self):
+        '''wait for the highest priority tile to download'''
+        with self._download_cond:
+            while True:
+                while self._download_heap:
+                    (prio, seq, request_time, key) = heapq.heappop(self._download_heap)
+                    tile = self._download_pending.get(key, None)
+                    if tile is None or tile.request_time != request_time or key in self._download_active:
+                        # cancelled, done or re-requested since
+                        continue
+                    self._download_active.add(key)
+                    return tile
+                self._download_cond.wait()
+
+    def _download_done(self, key):
+        with self._download_cond:
+            self._download_pending.pop(key, None)
+            self._download_active.discard(key)
+
+    def fetch_url(self, url, connections, redirects=3):
+        '''fetch a URL, returning (content_type, data). Connections are
+        kept open in the connections dictionary, keyed by host, so tiles
+        from the same server reuse one keep-alive connection'''
+        headers = {'User-Agent' : 'MAVProxy'}
+        if url.find('google') != -1:
+            headers['Referer'] = 'https://maps.google.com/'
+        if url_getproxies():
+            # let urllib deal with proxies
+            req = url_request(url, headers=headers)
+            resp = url_open(req)
+            return (resp.info().get('content-type', ''), resp.read())
+
+        u = url_parse(url)
+        path = u.path
+        if u.query:
+            path += '?' + u.query
+        ckey = (u.scheme, u.netloc)
+        for attempt in range(2):
+            conn = connections.get(ckey, None)
+            reused = conn is not None
+            if conn is None:
+                if u.scheme == 'https':
+                    conn = http_client.HTTPSConnection(u.netloc, timeout=20)
+                else:
+                    conn = http_client.HTTPConnection(u.netloc, timeout=20)
+                connections[ckey] = conn
+            try:
+                conn.request('GET', path, headers=headers)
+                resp = conn.getresponse()
+                data = resp.read()
+                break
+            except (http_client.HTTPException, socket.error) as e:
+                conn.close()
+                connections.pop(ckey, None)
+                if not reused:
+                    raise url_error(str(e))
+                # the server may have closed an idle connection, retry
+                # once on a new one
+        if resp.status in [301, 302, 303, 307, 308] and redirects > 0:
+            location = resp.getheader('location')
+            if location is not None:
+                if location.startswith('/'):
+                    location = '%s://%s%s' % (u.scheme, u.netloc, location)
+                return self.fetch_url(location, connections, redirects-1)
+        if resp.status != 200:
+            raise url_error('HTTP error %u' % resp.status)
+        return (resp.getheader('content-type', ''), data)
 
+    def downloader(self):
+        '''a download worker thread'''
+        connections = {}
+        while True:
+            tile_info = self._next_download()
             try:
+                self.download_tile(tile_info, connections)
+            except Exception as e:
                 if self.debug:
-                    print("Downloading %s [%u left]" % (url, len(keys)))
-                req = url_request(url)
-                if url.find('google') != -1:
-                    req.add_header('Referer', 'https://maps.google.com/')
-                resp = url_open(req)
-                headers = resp.info()
-            except url_error as e:
-                #print('Error loading %s' % url)
-                if not key in self._tile_cache:
-                    self._tile_cache[key] = self._unavailable
-                self._download_pending.pop(key)
-                if self.debug:
-                    print("Failed %s: %s" % (url, str(e)))
-                continue
-            if 'content-type' not in headers or headers['content-type'].find('image') == -1:
-                if not key in self._tile_cache:
-                    self._tile_cache[key] = self._unavailable
-                self._download_pending.pop(key)
-                if self.debug:
-                    print("non-image response %s" % url)
-                continue
-            else:
-                img = resp.read()
+                    print("Failed download: %s" % str(e))
+            finally:
+                self._download_done(tile_info.key())
+            time.sleep(self.tile_delay)
 
-            # see if its a blank/unavailable tile
-            md5 = hashlib.md5(img).hexdigest()
-            if md5 in BLANK_TILES:
-                if self.debug:
-                    print("blank tile %s" % url)
-                    if not key in self._tile_cache:
-                        self._tile_cache[key] = self._unavailable
-                self._download_pending.pop(key)
-                continue
+    def download_tile(self, tile_info, connections):
+        '''download one tile into the disk cache'''
+        url = tile_info.url(self.service)
+        path = self.tile_to_path(tile_info)
+        key = tile_info.key()
 
-            mp_util.mkdir_p(os.path.dirname(path))
-            h = open(path+'.tmp','wb')
-            h.write(img)
-            h.close()
-            try:
-                os.unlink(path)
-            except Exception:
-                pass
-            os.rename(path+'.tmp', path)
-            self._download_pending.pop(key)
-        self._download_thread = None
+        try:
+            if self.debug:
+                print("Downloading %s [%u left]" % (url, self.tiles_pending()))
+            (content_type, img) = self.fetch_url(url, connections)
+        except url_error as e:
+            #print('Error loading %s' % url)
+            if not key in self._tile_cache:
+                self._tile_cache.put(key, self._unavailable)
+            if self.debug:
+                print("Failed %s: %s" % (url, str(e)))
+            return
+        if content_type is None or content_type.find('image') == -1:
+            if not key in self._tile_cache:
+                self._tile_cache.put(key, self._unavailable)
+            if self.debug:
+                print("non-image response %s" % url)
+            return
+
+        # see if its a blank/unavailable tile
+        md5 = hashlib.md5(img).hexdigest()
+        if md5 in BLANK_TILES:
+            if self.debug:
+                print("blank tile %s" % url)
+                if not key in self._tile_cache:
+                    self._tile_cache.put(key, self._unavailable)
+            return
+
+        mp_util.mkdir_p(os.path.dirname(path))
+        tmp_path = '%s.%u.tmp' % (path, threading.current_thread().ident)
+        h = open(tmp_path,'wb')
+        h.write(img)
+        h.close()
+        try:
+            os.unlink(path)
+        except Exception:
+            pass
+        os.rename(tmp_path, path)
+        if self._disk_index is not None:
+            self._disk_index.add(path, len(img))
 
     def start_download_thread(self):
-        '''start the downloader'''
-        if self._download_thread:
+        '''start the download workers'''
+        if self._download_threads:
             return
-        t = threading.Thread(target=self.downloader)
-        t.daemon = True
-        self._download_thread = t
-        t.start()
+        for i in range(max(1, self.download_threads)):
+            t = threading.Thread(target=self.downloader, name='tile_download%u' % i)
+            t.daemon = True
+            self._download_threads.append(t)
+            t.start()
 
     def load_tile_lowres(self, tile):
         '''load a lower resolution tile from cache to fill in a
@@ -344,8 +691,8 @@ class MPTile:
 
             # see if its in the tile cache
             key = tile_info.key()
-            if key in self._tile_cache:
-                img = self._tile_cache[key]
+            img = self._tile_cache.get(key)
+            if img is not None:
                 if np.array_equal(img, np.array(self._unavailable)):
                     continue
             else:
@@ -353,10 +700,10 @@ class MPTile:
                 img = cv2.imread(path)
                 if img is None:
                     continue
+                if self._disk_index is not None:
+                    self._disk_index.lookup(path)
                 # add it to the tile cache
-                self._tile_cache[key] = img
-                while len(self._tile_cache) > self.cache_size:
-                    self._tile_cache.popitem(0)
+                self._tile_cache.put(key, img)
 
             # copy out the quadrant we want
             availx = min(TILES_WIDTH - tile_info.offsetx, width2)
@@ -376,8 +723,8 @@ class MPTile:
 
         # see if its in the tile cache
         key = tile.key()
-        if key in self._tile_cache:
-            img = self._tile_cache[key]
+        img = self._tile_cache.get(key)
+        if img is not None:
             if np.array_equal(img, self._unavailable):
                 img = self.load_tile_lowres(tile)
                 if img is None:
@@ -389,17 +736,15 @@ class MPTile:
         ret = cv2.imread(path)
         if ret is not None:
             # if it is an old tile, then try to refresh
-            if os.path.getmtime(path) + self.refresh_age < time.time():
-                try:
-                        self._download_pending[key].refresh_time()
-                except Exception:
-                        self._download_pending[key] = tile
-                self.start_download_thread()
-                    
+            if self._disk_index is not None:
+                mtime = self._disk_index.lookup(path)
+            else:
+                mtime = os.path.getmtime(path)
+            if mtime is not None and mtime + self.refresh_age < time.time():
+                self.queue_download(tile)
+
             # add it to the tile cache
-            self._tile_cache[key] = ret
-            while len(self._tile_cache) > self.cache_size:
-                self._tile_cache.popitem(0)
+            self._tile_cache.put(key, ret)
             return ret
 
         if not self.download:
@@ -408,11 +753,7 @@ class MPTile:
                 img = self._unavailable
             return img
 
-        try:
-            self._download_pending[key].refresh_time()
-        except Exception:
-            self._download_pending[key] = tile
-        self.start_download_thread()
+        self.queue_download(tile)
 
         img = self.load_tile_lowres(tile)
         if img is None:
@@ -428,6 +769,24 @@ class MPTile:
         scaled_tile = cv2.resize(full_tile, (height, width))
         return scaled_tile
 
+    def scaled_tile_rgb(self, tile):
+        '''return a scaled tile as RGB, and whether it is the final image
+        for the tile rather than a placeholder. Final tiles are cached, so
+        resizing and colour conversion happen once per tile'''
+        width = int(TILES_WIDTH / tile.scale)
+        height = int(TILES_HEIGHT / tile.scale)
+        key = (tile.key(), width, height)
+        img = self._scaled_cache.get(key)
+        if img is not None:
+            return (img, True)
+        full_tile = self.load_tile(tile)
+        complete = (full_tile is not self._unavailable and
+                    full_tile is self._tile_cache.get(tile.key()))
+        img = cv2.cvtColor(cv2.resize(full_tile, (height, width)), cv2.COLOR_BGR2RGB)
+        if complete:
+            self._scaled_cache.put(key, img)
+        return (img, complete)
+
 
     def coord_from_area(self, x, y, lat, lon, width, ground_width):
         '''return (lat,lon) for a pixel in an area image'''
@@ -523,28 +882,163 @@ class MPTile:
         lat/lon is the top left corner. The zoom is automatically
         chosen to avoid having to grow the tiles'''
 
-        img = np.zeros((height,width,3), np.uint8)
-
         tlist = self.area_to_tile_list(lat, lon, width, height, ground_width, zoom)
 
         # order the display by distance from the middle, so the download happens
         # close to the middle of the image first
+        (midlat, midlon) = self.coord_from_area(width/2, height/2, lat, lon, width, ground_width)
+        self._view_center = (midlat, midlon)
         if ordered:
-            (midlat, midlon) = self.coord_from_area(width/2, height/2, lat, lon, width, ground_width)
             tlist.sort(key=lambda d: d.distance(midlat, midlon), reverse=True)
 
+        # tiles for a previous view that are no longer on screen don't
+        # need downloading
+        self.cancel_downloads(set([t.key() for t in tlist]))
+
+        if not tlist:
+            return np.zeros((height,width,3), np.uint8)
+
+        # the position of the image in scaled pixels from the tile origin
+        first = min(tlist, key=lambda t: (t.y, t.x))
+        scaled_tile_width = int(TILES_WIDTH / first.scale)
+        scaled_tile_height = int(TILES_HEIGHT / first.scale)
+        gx = first.x * scaled_tile_width + first.srcx
+        gy = first.y * scaled_tile_height + first.srcy
+
+        # if the last image was at the same zoom and tile scale then
+        # shift it to the new position, and only draw the tiles that
+        # were not complete or are not fully in the shifted part
+        view = (self.service, first.zoom, scaled_tile_width, scaled_tile_height, width, height)
+        img = self._canvas
+        kept = (0, 0, 0, 0)
+        if img is not None and self._canvas_view is not None and self._canvas_view[0] == view:
+            (oldx, oldy) = self._canvas_view[1]
+            (dx, dy) = (gx - oldx, gy - oldy)
+            if abs(dx) < width and abs(dy) < height:
+                kept = (max(-dx,0), max(-dy,0), width+min(-dx,0), height+min(-dy,0))
+                if dx != 0 or dy != 0:
+                    img[kept[1]:kept[3], kept[0]:kept[2]] = img[max(dy,0):height+min(dy,0), max(dx,0):width+min(dx,0)]
+                    img[:kept[1]] = 0
+                    img[kept[3]:] = 0
+                    img[:, :kept[0]] = 0
+                    img[:, kept[2]:] = 0
+        if kept == (0, 0, 0, 0):
+            if img is None or img.shape != (height,width,3):
+                img = np.zeros((height,width,3), np.uint8)
+            else:
+                img[:] = 0
+            incomplete = set()
+        else:
+            incomplete = self._canvas_incomplete
+
+        new_incomplete = set()
         for t in tlist:
-            scaled_tile = self.scaled_tile(t)
+            t.cancellable = True
+            w = min(width - t.dstx, scaled_tile_width - t.srcx)
+            h = min(height - t.dsty, scaled_tile_height - t.srcy)
+            if w <= 0 or h <= 0:
+                continue
+            if (t.dstx >= kept[0] and t.dsty >= kept[1] and
+                t.dstx+w <= kept[2] and t.dsty+h <= kept[3] and
+                t.key() not in incomplete):
+                continue
+            (scaled_tile, complete) = self.scaled_tile_rgb(t)
+            if not complete:
+                new_incomplete.add(t.key())
+            img[t.dsty:t.dsty+h, t.dstx:t.dstx+w] = scaled_tile[t.srcy:t.srcy+h, t.srcx:t.srcx+w]
+
+        self._canvas = img
+        self._canvas_view = (view, (gx, gy))
+        self._canvas_incomplete = new_incomplete
+
+        # the caller may draw on the image
+        return img.copy()
+
+class TileSeeder:
+    '''
+    download all the tiles for an area into the disk cache, so the map
+    can be used without a network connection.
+
+    Tiles already in the cache and newer than the refresh age are
+    skipped, so an interrupted run is resumed by running it again.
+    Tiles are fed to the download workers a batch at a time, so very
+    large areas don't fill the download queue.
+    '''
+    def __init__(self, mt, tiles, max_queued=None):
+        self.mt = mt
+        self.tiles = tiles
+        self.total = len(tiles)
+        if max_queued is None:
+            max_queued = 8 * max(1, mt.download_threads)
+        self.max_queued = max_queued
+        self.cached = 0
+        self.downloaded = 0
+        self.failed = 0
+        self.start_time = None
+        self.stopped = False
+
+    def stop(self):
+        '''stop the run, after the tiles being downloaded'''
+        self.stopped = True
+
+    def done(self):
+        '''number of tiles dealt with'''
+        return self.cached + self.downloaded + self.failed
+
+    def eta(self):
+        '''estimated seconds to completion, or None'''
+        if self.start_time is None or self.downloaded + self.failed == 0:
+            return None
+        rate = (self.downloaded + self.failed) / (time.time() - self.start_time)
+        return (self.total - self.done()) / rate
+
+    def progress(self):
+        '''return a progress string'''
+        ret = "Seeded %u/%u tiles (%u cached, %u downloaded, %u failed)" % (
+            self.done(), self.total, self.cached, self.downloaded, self.failed)
+        eta = self.eta()
+        if eta is not None and self.done() < self.total:
+            eta = int(eta)
+            ret += " ETA %u:%02u:%02u" % (eta // 3600, (eta // 60) % 60, eta % 60)
+        return ret
 
-            w = min(width - t.dstx, scaled_tile.shape[1] - t.srcx)
-            h = min(height - t.dsty, scaled_tile.shape[0] - t.srcy)
-            if w > 0 and h > 0:
-                scaled_tile_roi = scaled_tile[t.srcy:t.srcy+h, t.srcx:t.srcx+w]
-                img[t.dsty:t.dsty+h, t.dstx:t.dstx+w] = scaled_tile_roi.copy()
+    def run(self, report=None, report_interval=5.0):
+        '''run the job, calling report with a progress string every
+        report_interval seconds'''
+        self.start_time = time.time()
+        last_report = time.time()
+        tiles = iter(self.tiles)
+        queued = {}
+        while not self.stopped:
+            # keep the download queue topped up
+            while len(queued) < self.max_queued:
+                tile = next(tiles, None)
+                if tile is None:
+                    break
+                if self.mt.tile_cached(tile):
+                    self.cached += 1
+                    continue
+                self.mt.queue_download(tile)
+                queued[tile.key()] = tile
+            if not queued:
+                break
+            time.sleep(0.1)
+            for key in list(queued.keys()):
+                if self.mt.is_pending(key):
+                    continue
+                tile = queued.pop(key)
+                if self.mt.tile_cached(tile):
+                    self.downloaded += 1
+                else:
+                    self.failed += 1
+            if report is not None and time.time() - last_report >= report_interval:
+                last_report = time.time()
+                report(self.progress())
+        if self.stopped:
+            self.mt.cancel_downloads(set(), keys=set(queued.keys()))
+        if report is not None:
+            report(self.progress())
 
-        # return as an RGB image
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        return img
 
 def mp_icon(filename):
     '''load an icon from the data directory'''
@@ -576,14 +1070,49 @@ if __name__ == "__main__":
     parser.add_option("--lat", type='float', default=-35.362938, help="start latitude")
     parser.add_option("--lon", type='float', default=149.165085, help="start longitude")
     parser.add_option("--width", type='float', default=1000.0, help="width in meters")
-    parser.add_option("--service", default="OviHybrid", help="tile service")
+    parser.add_option("--service", default="MicrosoftSat", help="tile service")
     parser.add_option("--zoom", default=None, type='int', help="zoom level")
     parser.add_option("--max-zoom", type='int', default=19, help="maximum tile zoom")
     parser.add_option("--delay", type='float', default=1.0, help="tile download delay")
     parser.add_option("--boundary", default=None, help="region boundary")
     parser.add_option("--debug", action='store_true', default=False, help="show debug info")
+    parser.add_option("--seed", action='store_true', default=False, help="seed the tile cache for offline use")
+    parser.add_option("--bbox", default=None, help="area to seed as lat1,lon1,lat2,lon2")
+    parser.add_option("--min-zoom", type='int', default=1, help="minimum zoom to seed")
+    parser.add_option("--cache", default=None, help="tile cache directory")
+    parser.add_option("--threads", type='int', default=4, help="number of download threads")
     (opts, args) = parser.parse_args()
 
+    if opts.service not in TILE_SERVICES:
+        print("Unknown tile service %s, choose from: %s" % (opts.service, ' '.join(sorted(TILE_SERVICES.keys()))))
+        sys.exit(1)
+
+    if opts.seed:
+        mt = MPTile(cache_path=opts.cache, debug=opts.debug, service=opts.service,
+                    tile_delay=opts.delay, max_zoom=opts.max_zoom,
+                    download_threads=opts.threads)
+        polygon = None
+        if opts.boundary:
+            polygon = mp_util.polygon_load(opts.boundary)
+            (lat1, lon1, dlat, dlon) = mp_util.polygon_bounds(polygon)
+            (lat2, lon2) = (lat1+dlat, lon1+dlon)
+        elif opts.bbox:
+            (lat1, lon1, lat2, lon2) = [float(v) for v in opts.bbox.split(',')]
+        else:
+            print("Need --bbox or --boundary to seed")
+            sys.exit(1)
+        if opts.zoom is not None:
+            zooms = [opts.zoom]
+        else:
+            zooms = range(opts.min_zoom, opts.max_zoom+1)
+        seeder = TileSeeder(mt, mt.area_tiles(lat1, lon1, lat2, lon2, zooms, polygon=polygon))
+        try:
+            seeder.run(report=print)
+        except KeyboardInterrupt:
+            seeder.stop()
+            print(seeder.progress())
+        sys.exit(0)
+
     lat = opts.lat
     lon = opts.lon
     ground_width = opts.width
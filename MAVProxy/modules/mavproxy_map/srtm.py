@@ -19,8 +19,9 @@ import pickle
 import os.path
 import os
 import zipfile
-import array
 import math
+import collections
+import numpy as np
 from MAVProxy.modules.lib import mp_util
 from MAVProxy.modules.lib import multiproc
 import tempfile
@@ -69,7 +70,8 @@ class SRTMDownloader():
                  directory="/SRTM/",
                  cachedir=None,
                  offline=0,
-                 debug=False):
+                 debug=False,
+                 max_tiles=16):
 
         if cachedir is None:
             try:
@@ -95,6 +97,9 @@ class SRTMDownloader():
                 r"([NS])(\d{2})([EW])(\d{3})\.hgt\.zip")
         self.filelist_file = os.path.join(self.cachedir, "filelist_python")
         self.min_filelist_len = 14500
+        # LRU cache of tile objects, keyed by (lat,lon)
+        self.tile_cache = collections.OrderedDict()
+        self.max_tiles = max_tiles
 
     def loadFileList(self):
         """Load a previously created file list or create a new one if none is
@@ -231,6 +236,20 @@ class SRTMDownloader():
         """Get a SRTM tile object. This function can return either an SRTM1 or
             SRTM3 object depending on what is available, however currently it
             only returns SRTM3 objects."""
+        key = (int(lat), int(lon))
+        tile = self.tile_cache.pop(key, None)
+        if tile is not None:
+            self.tile_cache[key] = tile
+            return tile
+        tile = self.loadTile(lat, lon)
+        if tile != 0:
+            self.tile_cache[key] = tile
+            while len(self.tile_cache) > self.max_tiles:
+                self.tile_cache.popitem(last=False)
+        return tile
+
+    def loadTile(self, lat, lon):
+        """Load a SRTM tile object, or return 0 if it is not available yet"""
         global childFileListDownload
         global filelistDownloadActive
         mypid = os.getpid()
@@ -272,8 +291,6 @@ class SRTMDownloader():
         elif mypid in childTileDownload and childTileDownload[mypid].is_alive():
             '''print("Still Getting Tile")'''
             return 0
-        # TODO: Currently we create a new tile object each time.
-        # Caching is required for improved performance.
         try:
             return SRTMTile(os.path.join(self.cachedir, filename), int(lat), int(lon))
         except InvalidTileError:
@@ -309,6 +326,31 @@ class SRTMTile:
         only have to look at a single tile.
         """
     def __init__(self, f, lat, lon):
+        # the tile is unzipped once to a raw big-endian .hgt file next
+        # to the zip, which is then memory mapped
+        hgt = f
+        if hgt.endswith('.zip'):
+            hgt = hgt[:-4]
+        if not os.path.exists(hgt):
+            self.unzip(f, hgt, lat, lon)
+        if os.path.exists(hgt):
+            self.size = int(math.sqrt(os.path.getsize(hgt)/2)) # 2 bytes per sample
+            if self.size not in (1201, 3601) or os.path.getsize(hgt) != 2 * self.size * self.size:
+                raise InvalidTileError(lat, lon)
+            self.data = np.memmap(hgt, dtype='>i2', mode='r')
+        else:
+            # could not write the .hgt file, keep the data in memory
+            data = self.read_zip(f, lat, lon)
+            self.size = int(math.sqrt(len(data)/2))
+            if self.size not in (1201, 3601) or len(data) != 2 * self.size * self.size:
+                raise InvalidTileError(lat, lon)
+            self.data = np.frombuffer(data, dtype='>i2')
+        self.lat = lat
+        self.lon = lon
+
+    @staticmethod
+    def read_zip(f, lat, lon):
+        """Return the raw data from a zipped tile"""
         try:
             zipf = zipfile.ZipFile(f, 'r')
         except Exception:
@@ -317,16 +359,27 @@ class SRTMTile:
         if len(names) != 1:
             raise InvalidTileError(lat, lon)
         data = zipf.read(names[0])
-        self.size = int(math.sqrt(len(data)/2)) # 2 bytes per sample
+        zipf.close()
+        return data
+
+    def unzip(self, f, hgt, lat, lon):
+        """Unzip a tile to a .hgt file"""
+        data = self.read_zip(f, lat, lon)
+        size = int(math.sqrt(len(data)/2))
         # Currently only SRTM1/3 is supported
-        if self.size not in (1201, 3601):
-            raise InvalidTileError(lat, lon)
-        self.data = array.array('h', data)
-        self.data.byteswap()
-        if len(self.data) != self.size * self.size:
+        if size not in (1201, 3601) or len(data) != 2 * size * size:
             raise InvalidTileError(lat, lon)
-        self.lat = lat
-        self.lon = lon
+        tmp = '%s.%u.tmp' % (hgt, os.getpid())
+        try:
+            h = open(tmp, 'wb')
+            h.write(data)
+            h.close()
+            os.rename(tmp, hgt)
+        except (IOError, OSError):
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
 
     @staticmethod
     def _avg(value1, value2, weight):
@@ -368,7 +421,7 @@ class SRTMTile:
         # Same as calcOffset, inlined for performance reasons
         offset = x + self.size * (self.size - y - 1)
         #print(offset)
-        value = self.data[offset]
+        value = int(self.data[offset])
         if value == -32768:
             return -1 # -32768 is a special value for areas with no data
         return value
@@ -403,6 +456,35 @@ class SRTMTile:
         #        value00, value10, value1, value01, value11, value2, value))
         return value
 
+    def getAltitudesFromLatLon(self, lats, lons):
+        """Get the altitudes of arrays of lat/lon points in this tile, with
+            the same interpolation and void handling as
+            getAltitudeFromLatLon, in one vectorized pass.
+        """
+        lats = np.asarray(lats, dtype=float) - self.lat
+        lons = np.asarray(lons, dtype=float) - self.lon
+        outside = (lats < 0.0) | (lats >= 1.0) | (lons < 0.0) | (lons >= 1.0)
+        if np.any(outside):
+            i = np.argmax(outside)
+            raise WrongTileError(self.lat, self.lon, self.lat+lats.flat[i], self.lon+lons.flat[i])
+        x = lons * (self.size - 1)
+        y = lats * (self.size - 1)
+        x_int = x.astype(int)
+        x_frac = x - x_int
+        y_int = y.astype(int)
+        y_frac = y - y_int
+        # same layout as getPixelValue
+        offset = x_int + self.size * (self.size - y_int - 1)
+        value00 = self.data[offset].astype(float)
+        value10 = self.data[offset+1].astype(float)
+        value01 = self.data[offset-self.size].astype(float)
+        value11 = self.data[offset-self.size+1].astype(float)
+        for v in (value00, value10, value01, value11):
+            v[v == -32768] = -1 # -32768 is a special value for areas with no data
+        value1 = value10 * x_frac + value00 * (1 - x_frac)
+        value2 = value11 * x_frac + value01 * (1 - x_frac)
+        return value2 * y_frac + value1 * (1 - y_frac)
+
 class SRTMOceanTile(SRTMTile):
     '''a tile for areas of zero altitude'''
     def __init__(self, lat, lon):
@@ -412,6 +494,9 @@ class SRTMOceanTile(SRTMTile):
     def getAltitudeFromLatLon(self, lat, lon):
         return 0
 
+    def getAltitudesFromLatLon(self, lats, lons):
+        return np.zeros(np.shape(lats))
+
 
 class parseHTMLDirectoryListing(HTMLParser):
 
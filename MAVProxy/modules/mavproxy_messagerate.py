@@ -24,6 +24,7 @@ class messagerate(mp_module.MPModule):
                          self.cmd_messagerate,
                          "messagerate module",
                          ['status', 'reset'])
+        self.add_periodic(self.update_buckets, 1)
 
     def usage(self):
         '''show help on command line options'''
@@ -63,16 +64,13 @@ class messagerate(mp_module.MPModule):
                                       counts[mtype]/float(len(self.buckets)))
         return ret
 
-    def idle_task(self):
-        '''called rapidly by mavproxy'''
-        now = time.time()
-        time_delta = now - self.last_calc
-        if time_delta > 1:
-            self.last_calc = now
-            self.buckets.append(self.counts)
-            self.counts = {}
-            if len(self.buckets) > self.max_buckets:
-                self.buckets = self.buckets[-self.max_buckets:]
+    def update_buckets(self):
+        '''called once a second by the scheduler'''
+        self.last_calc = time.time()
+        self.buckets.append(self.counts)
+        self.counts = {}
+        if len(self.buckets) > self.max_buckets:
+            self.buckets = self.buckets[-self.max_buckets:]
 
     def mavlink_packet(self, m):
         '''handle mavlink packets'''
@@ -63,6 +63,7 @@ class OutputModule(mp_module.MPModule):
             print("Failed to connect to %s" % device)
             return
         self.mpstate.mav_outputs.append(conn)
+        self.mpstate.select_changed()
         try:
             mp_util.child_fd_list_add(conn.port.fileno())
         except Exception:
@@ -86,6 +87,7 @@ class OutputModule(mp_module.MPModule):
         if sysid in self.mpstate.sysid_outputs:
             self.mpstate.sysid_outputs[sysid].close()
         self.mpstate.sysid_outputs[sysid] = conn
+        self.mpstate.select_changed()
 
     def cmd_output_remove(self, args):
         '''remove an output'''
@@ -100,6 +102,7 @@ class OutputModule(mp_module.MPModule):
                     pass
                 conn.close()
                 self.mpstate.mav_outputs.pop(i)
+                self.mpstate.select_changed()
                 return
 
     def idle_task(self):
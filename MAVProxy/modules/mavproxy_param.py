@@ -360,6 +360,8 @@ class ParamModule(mp_module.MPModule):
         super(ParamModule, self).__init__(mpstate, "param", "parameter handling", public = True, multi_vehicle=True)
         self.xml_filepath = kwargs.get("xml-filepath", None)
         self.pstate = {}
+        # every component sends heartbeats, so new systems are found from them
+        self.set_mavlink_types(['PARAM_VALUE', 'HEARTBEAT'])
         self.check_new_target_system()
         self.add_command('param', self.cmd_param, "parameter handling",
                          ["<download|status>",
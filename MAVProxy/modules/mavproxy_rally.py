@@ -14,14 +14,16 @@ if mp_util.has_wxpython:
 class RallyModule(mp_module.MPModule):
     def __init__(self, mpstate):
         super(RallyModule, self).__init__(mpstate, "rally", "rally point control", public = True)
+        self.set_mavlink_types(['COMMAND_ACK'])
         self.rallyloader_by_sysid = {}
         self.add_command('rally', self.cmd_rally, "rally point control", ["<add|clear|land|list|move|remove|>",
                                     "<load|save> (FILENAME)"])
         self.have_list = False
         self.abort_alt = 50
         self.abort_first_send_time = 0
-        self.abort_previous_send_time = 0
         self.abort_ack_received = True
+        self.abort_task = None
+        self.add_periodic(self.periodic_task, 2)
 
         self.menu_added_console = False
         self.menu_added_map = False
@@ -49,8 +51,8 @@ class RallyModule(mp_module.MPModule):
                                                                                  self.settings.target_component)
         return self.rallyloader_by_sysid[self.target_system]
 
-    def idle_task(self):
-        '''called on idle'''
+    def periodic_task(self):
+        '''called twice a second by the scheduler to add the menus'''
         if self.module('console') is not None and not self.menu_added_console:
             self.menu_added_console = True
             self.module('console').add_menu(self.menu)
@@ -58,22 +60,22 @@ class RallyModule(mp_module.MPModule):
             self.menu_added_map = True
             self.module('map').add_menu(self.menu)
 
-        '''handle abort command; it is critical that the AP to receive it'''
-        if self.abort_ack_received is False:
-            #only send abort every second (be insistent, but don't spam)
-            if (time.time() - self.abort_previous_send_time > 1):
-                self.master.mav.command_long_send(self.settings.target_system,
-                    self.settings.target_component,
-                    mavutil.mavlink.MAV_CMD_DO_GO_AROUND,
-                    0, int(self.abort_alt), 0, 0, 0, 0, 0, 0,)
-                self.abort_previous_send_time = time.time()
-
-            #try to get an ACK from the plane:
-            if self.abort_first_send_time == 0:
-                self.abort_first_send_time = time.time()
-            elif time.time() - self.abort_first_send_time > 10: #give up after 10 seconds
-                print("Unable to send abort command!\n")
-                self.abort_ack_received = True
+    def send_abort(self):
+        '''handle abort command; it is critical that the AP to receive it.
+        Called once a second by the scheduler until it is acknowledged
+        (be insistent, but don't spam)'''
+        if self.abort_ack_received is False and time.time() - self.abort_first_send_time > 10:
+            #give up after 10 seconds
+            print("Unable to send abort command!\n")
+            self.abort_ack_received = True
+        if self.abort_ack_received:
+            self.remove_periodic(self.abort_task)
+            self.abort_task = None
+            return
+        self.master.mav.command_long_send(self.settings.target_system,
+            self.settings.target_component,
+            mavutil.mavlink.MAV_CMD_DO_GO_AROUND,
+            0, int(self.abort_alt), 0, 0, 0, 0, 0, 0,)
 
 
     def cmd_rally_add(self, args):
@@ -242,11 +244,14 @@ class RallyModule(mp_module.MPModule):
         elif args[0] == "land":
             if (len(args) >= 2 and args[1] == "abort"):
                 self.abort_ack_received = False
-                self.abort_first_send_time = 0
+                self.abort_first_send_time = time.time()
 
                 self.abort_alt = self.settings.rally_breakalt
                 if (len(args) >= 3):
                     self.abort_alt = int(args[2])
+                if self.abort_task is None:
+                    # the first send is straight away
+                    self.abort_task = self.add_periodic(self.send_abort, 1, first_run=time.time())
 
             else:
                 self.master.mav.command_long_send(self.settings.target_system,
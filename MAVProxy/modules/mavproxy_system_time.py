@@ -17,6 +17,7 @@ class system_time(mp_module.MPModule):
     def __init__(self, mpstate):
         """Initialise module"""
         super(system_time, self).__init__(mpstate, "system_time", "")
+        self.set_mavlink_types(['SYSTEM_TIME', 'TIMESYNC'])
         self.last_sent = 0
         self.last_sent_ts1 = 0
         self.last_sent_timesync = 0
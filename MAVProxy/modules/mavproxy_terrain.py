@@ -2,47 +2,100 @@
   MAVProxy terrain handling module
 """
 
+import collections
+import math
 import time
+import numpy
 
 from MAVProxy.modules.mavproxy_map import mp_elevation
 from MAVProxy.modules.lib import mp_util
 from MAVProxy.modules.lib import mp_module
 from MAVProxy.modules.lib import mp_settings
 
+# terrain grids as used by ArduPilot. Each grid is 7x8 blocks of 4x4
+# points, and grids overlap by one block
+TERRAIN_GRID_MAVLINK_SIZE = 4
+TERRAIN_GRID_BLOCK_SPACING_X = 6*TERRAIN_GRID_MAVLINK_SIZE
+TERRAIN_GRID_BLOCK_SPACING_Y = 7*TERRAIN_GRID_MAVLINK_SIZE
+LOCATION_SCALING_FACTOR = 0.011131884502145034
+
+def longitude_scale(lat):
+    '''ArduPilot longitude scale for a latitude in 1e-7 degrees'''
+    return max(math.cos(math.radians(lat*1.0e-7)), 0.01)
+
+def terrain_grid_origin(lat, lon, grid_spacing):
+    '''return the SW corner, in 1e-7 degrees, of the terrain grid that an
+    ArduPilot vehicle would request for a position. This follows
+    AP_Terrain::calculate_grid_info, but may differ from the vehicle in the
+    last digit because of float rounding'''
+    lat = int(lat*1.0e7)
+    lon = int(lon*1.0e7)
+    # grids start on integer degrees
+    ref_lat = int((lat-9999999 if lat < 0 else lat) / 10000000.0) * 10000000
+    ref_lon = int((lon-9999999 if lon < 0 else lon) / 10000000.0) * 10000000
+    north = (lat - ref_lat) * LOCATION_SCALING_FACTOR
+    east = (lon - ref_lon) * LOCATION_SCALING_FACTOR * longitude_scale((lat + ref_lat)//2)
+    grid_idx_x = int(north / grid_spacing) // TERRAIN_GRID_BLOCK_SPACING_X
+    grid_idx_y = int(east / grid_spacing) // TERRAIN_GRID_BLOCK_SPACING_Y
+    dlat = int(grid_idx_x * TERRAIN_GRID_BLOCK_SPACING_X * grid_spacing / LOCATION_SCALING_FACTOR)
+    dlon = int(grid_idx_y * TERRAIN_GRID_BLOCK_SPACING_Y * grid_spacing / LOCATION_SCALING_FACTOR /
+               longitude_scale(ref_lat + dlat//2))
+    return (ref_lat + dlat, ref_lon + dlon)
+
+
 class TerrainModule(mp_module.MPModule):
     def __init__(self, mpstate):
         super(TerrainModule, self).__init__(mpstate, "terrain", "terrain handling", public=False)
+        self.set_mavlink_types(['TERRAIN_REQUEST', 'TERRAIN_REPORT'])
 
         self.ElevationModel = mp_elevation.ElevationModel()
         self.current_request = None
         self.sent_mask = 0
         self.last_send_time = time.time()
+        # token bucket limiting blocks sent to send_rate per second
+        self.send_credit = 0
+        self.credit_time = time.time()
         self.requests_received = 0
         self.blocks_sent = 0
         self.check_lat = 0
         self.check_lon = 0
+        # computed grids keyed by (lat, lon, grid_spacing), each an array
+        # of 56 blocks of 16 heights
+        self.grid_cache = collections.OrderedDict()
+        self.grid_spacing = 100
+        self.prefetch_queue = []
+        self.wp_change_time = 0
         self.add_command('terrain', self.cmd_terrain, "terrain control",
-                         ["<status|check>",
+                         ["<status|check|prefetch>",
                           'set (TERRAINSETTING)'])
         self.terrain_settings = mp_settings.MPSettings(
-            [ ('debug', int, 0) ]
+            [ ('debug', int, 0),
+              ('send_rate', float, 20),
+              ('cache_grids', int, 500),
+              ('prefetch', bool, True) ]
             )
         self.add_completion_function('(TERRAINSETTING)', self.terrain_settings.completion)
+        self.add_periodic(self.prefetch_task, 2)
 
     def cmd_terrain(self, args):
         '''terrain command parser'''
-        usage = "usage: terrain <set|status|check>"
+        usage = "usage: terrain <set|status|check|prefetch>"
         if len(args) == 0:
             print(usage)
             return
         if args[0] == "status":
-            print("blocks_sent: %u requests_received: %u" % (
+            print("blocks_sent: %u requests_received: %u grids_cached: %u prefetch_pending: %u" % (
                 self.blocks_sent,
-                self.requests_received))
+                self.requests_received,
+                len(self.grid_cache),
+                len(self.prefetch_queue)))
         elif args[0] == "set":
             self.terrain_settings.command(args[1:])
         elif args[0] == "check":
             self.cmd_terrain_check(args[1:])
+        elif args[0] == "prefetch":
+            self.wp_change_time = 0
+            self.prefetch_task()
         else:
             print(usage)
 
@@ -71,7 +124,11 @@ class TerrainModule(mp_module.MPModule):
         if type == 'TERRAIN_REQUEST':
             self.current_request = msg
             self.sent_mask = 0
+            # start the new request with one block to send straight away
+            self.send_credit = 1
+            self.credit_time = time.time()
             self.requests_received += 1
+            self.grid_spacing = msg.grid_spacing
         elif type == 'TERRAIN_REPORT':
             if (msg.lat == self.check_lat and
                 msg.lon == self.check_lon and
@@ -80,65 +137,143 @@ class TerrainModule(mp_module.MPModule):
                 self.check_lat = 0
                 self.check_lon = 0
 
+    def compute_grid(self, lat, lon, grid_spacing):
+        '''compute the heights for a whole grid, with lat/lon in 1e-7
+        degrees, as an array of 56 blocks of 16 heights. Heights that
+        are not available yet are NaN'''
+        lat *= 1.0e-7
+        lon *= 1.0e-7
+        bit_spacing = grid_spacing * 4
+        bits = numpy.arange(56)
+        (blat, blon) = mp_util.gps_offset_array(lat, lon,
+                                                east=bit_spacing * (bits % 8),
+                                                north=bit_spacing * (bits // 8))
+        i = numpy.arange(4*4)
+        (lats, lons) = mp_util.gps_offset_array(blat[:,None], blon[:,None],
+                                                east=grid_spacing * (i % 4),
+                                                north=grid_spacing * (i // 4))
+        return self.ElevationModel.GetElevations(lats, lons)
+
+    def get_grid(self, lat, lon, grid_spacing):
+        '''get the heights for a grid, from the cache if possible'''
+        # our grid origins may be off by a little from the vehicle's
+        for dlat in (0, -1, 1, -2, 2):
+            for dlon in (0, -1, 1, -2, 2):
+                key = (lat+dlat, lon+dlon, grid_spacing)
+                grid = self.grid_cache.pop(key, None)
+                if grid is not None:
+                    self.grid_cache[key] = grid
+                    return grid
+        grid = self.compute_grid(lat, lon, grid_spacing)
+        if not numpy.any(numpy.isnan(grid)):
+            self.cache_grid((lat, lon, grid_spacing), grid)
+        return grid
+
+    def cache_grid(self, key, grid):
+        self.grid_cache[key] = grid
+        while len(self.grid_cache) > max(1, self.terrain_settings.cache_grids):
+            self.grid_cache.popitem(last=False)
+
     def send_terrain_data_bit(self, bit):
         '''send some terrain data'''
-        lat = self.current_request.lat * 1.0e-7
-        lon = self.current_request.lon * 1.0e-7
-        bit_spacing = self.current_request.grid_spacing * 4
-        (lat, lon) = mp_util.gps_offset(lat, lon,
-                                        east=bit_spacing * (bit % 8),
-                                        north=bit_spacing * (bit // 8))
-        data = []
-        for i in range(4*4):
-            y = i % 4
-            x = i // 4
-            (lat2,lon2) = mp_util.gps_offset(lat, lon,
-                                             east=self.current_request.grid_spacing * y,
-                                             north=self.current_request.grid_spacing * x)
-            alt = self.ElevationModel.GetElevation(lat2, lon2)
-            if alt is None:
-                if self.terrain_settings.debug:
-                    print("no alt ", lat2, lon2)
-                return
-            data.append(int(alt))
-        self.master.mav.terrain_data_send(self.current_request.lat,
-                                          self.current_request.lon,
-                                          self.current_request.grid_spacing,
+        req = self.current_request
+        grid = self.get_grid(req.lat, req.lon, req.grid_spacing)
+        alts = grid[bit]
+        if numpy.any(numpy.isnan(alts)):
+            if self.terrain_settings.debug:
+                print("no alt for bit %u" % bit)
+            return False
+        data = [int(alt) for alt in alts]
+        self.master.mav.terrain_data_send(req.lat,
+                                          req.lon,
+                                          req.grid_spacing,
                                           bit,
                                           data)
         self.blocks_sent += 1
         self.last_send_time = time.time()
         self.sent_mask |= 1<<bit
         if self.terrain_settings.debug and bit == 55:
-            lat = self.current_request.lat * 1.0e-7
-            lon = self.current_request.lon * 1.0e-7
+            lat = req.lat * 1.0e-7
+            lon = req.lon * 1.0e-7
             print("--lat=%f --lon=%f %.1f" % (
                 lat, lon, self.ElevationModel.GetElevation(lat, lon)))
             (lat2,lon2) = mp_util.gps_offset(lat, lon,
-                                             east=32*self.current_request.grid_spacing,
-                                             north=28*self.current_request.grid_spacing)
+                                             east=32*req.grid_spacing,
+                                             north=28*req.grid_spacing)
             print("--lat=%f --lon=%f %.1f" % (
                 lat2, lon2, self.ElevationModel.GetElevation(lat2, lon2)))
+        return True
 
-
-    def send_terrain_data(self):
-        '''send some terrain data'''
+    def send_terrain_data(self, max_blocks):
+        '''send up to max_blocks blocks of terrain data, returning the
+        number sent'''
+        sent = 0
         for bit in range(56):
+            if sent >= max_blocks:
+                return sent
             if self.current_request.mask & (1<<bit) and self.sent_mask & (1<<bit) == 0:
-                self.send_terrain_data_bit(bit)
-                return
+                if not self.send_terrain_data_bit(bit):
+                    # wait for the SRTM data
+                    return sent
+                sent += 1
         # no bits to send
         self.current_request = None
         self.sent_mask = 0
+        return sent
+
+    def prefetch_task(self):
+        '''compute the grids along the mission before the vehicle asks
+        for them'''
+        if not self.terrain_settings.prefetch:
+            return
+        try:
+            wploader = self.module('wp').wploader
+        except Exception:
+            return
+        if wploader.last_change != self.wp_change_time:
+            self.wp_change_time = wploader.last_change
+            self.prefetch_queue = self.mission_grids(wploader.polygon(), self.grid_spacing)
+        # a few grids at a time, so we don't hold up the main loop
+        for i in range(min(4, len(self.prefetch_queue))):
+            (lat, lon) = self.prefetch_queue.pop(0)
+            grid = self.get_grid(lat, lon, self.grid_spacing)
+            if numpy.any(numpy.isnan(grid)):
+                # the SRTM data is still downloading, try again later
+                self.prefetch_queue.append((lat, lon))
+
+    def mission_grids(self, path, grid_spacing):
+        '''return the origins of the grids along a mission path'''
+        ret = []
+        step = grid_spacing * 4
+        # polygon points may also carry a colour
+        path = [(p[0], p[1]) for p in path]
+        for i in range(len(path)):
+            (lat1, lon1) = path[i]
+            (lat2, lon2) = path[min(i+1, len(path)-1)]
+            if (lat1 == 0 and lon1 == 0) or (lat2 == 0 and lon2 == 0):
+                continue
+            distance = mp_util.gps_distance(lat1, lon1, lat2, lon2)
+            bearing = mp_util.gps_bearing(lat1, lon1, lat2, lon2)
+            for d in numpy.arange(0, distance+step, step):
+                (lat, lon) = mp_util.gps_newpos(lat1, lon1, bearing, min(d, distance))
+                origin = terrain_grid_origin(lat, lon, grid_spacing)
+                if origin not in ret:
+                    ret.append(origin)
+        return ret
 
     def idle_task(self):
         '''called when idle'''
+        now = time.time()
+        elapsed = now - self.credit_time
+        self.credit_time = now
         if self.current_request is None:
+            self.send_credit = 0
             return
-        if time.time() - self.last_send_time < 0.2:
-            # limit to 5 per second
+        # send at up to send_rate blocks per second
+        self.send_credit = min(self.send_credit + elapsed * self.terrain_settings.send_rate, 56)
+        if self.send_credit < 1:
             return
-        self.send_terrain_data()
+        self.send_credit -= self.send_terrain_data(int(self.send_credit))
 
 def init(mpstate):
     '''initialise module'''
@@ -21,9 +21,12 @@ from pymavlink.mavextra import *
 from MAVProxy.modules.lib.mp_menu import *
 import MAVProxy.modules.lib.mp_util as mp_util
 from pymavlink import mavutil
+from pymavlink import DFReader
 from MAVProxy.modules.lib.mp_settings import MPSettings, MPSetting
 from MAVProxy.modules.lib import wxsettings
 from MAVProxy.modules.lib.graphdefinition import GraphDefinition
+from MAVProxy.modules.lib import mp_colexpr
+from MAVProxy.modules.lib import mp_logcache
 from lxml import objectify
 import pkg_resources
 from builtins import input
@@ -35,6 +38,9 @@ flightmodes = None
 #Global var to hold the GUI menu element
 TopMenu = None
 
+# message types kept while a log loads, for the messages command
+TEXT_TYPES = set(['MSG', 'STATUSTEXT'])
+
 class MEStatus(object):
     '''status object to conform with mavproxy structure for modules'''
     def __init__(self):
@@ -58,10 +64,18 @@ class MEState(object):
               MPSetting('legend', str, 'upper left', 'legend position'),
               MPSetting('legend2', str, 'upper right', 'legend2 position'),
               MPSetting('title', str, None, 'Graph title'),
+              MPSetting('load_refresh', float, 10, 'graph refresh while loading (s)'),
               ]
             )
 
         self.mlog = None
+        self.loader = None
+        self.load_stage = None
+        self.load_progress = 0
+        self.last_refresh = 0
+        self.refresh_count = 0
+        self.columns = None
+        self.save_columns = True
         self.filename = None
         self.command_map = command_map
         self.completions = {
@@ -109,6 +123,128 @@ class MEState(object):
         except EOFError:
             pass
             
+class LogLoader(object):
+    '''load a log in a background thread. Columns of the part of the log
+    read so far can be used while the rest is read.
+
+    The columns are read by another thread with its own reader, so the
+    scanned log can be used for commands as soon as
+    mavutil.mavlink_connection() has indexed it. Telemetry logs are read
+    into columns while they are scanned. Dataflash logs can only be read
+    after a scan, so they get a second reader once the first one is
+    ready'''
+    def __init__(self, filename, save_columns=True):
+        self.filename = filename
+        self.save_columns = save_columns
+        self.builder = mp_logcache.ColumnBuilder(keep_types=TEXT_TYPES)
+        # the complete columns, once the whole log has been read
+        self.columns = None
+        # latest message of each type, once the whole log has been read
+        self.msgs = None
+        # the scanned log, once it is ready for the main thread to use
+        self.mlog = None
+        self.stage = 'Scanning'
+        self.percent = 0
+        self.read_percent = 0
+        self.column_thread = None
+        self.error = None
+        self.stopped = False
+        self.done = False
+        self.reported_columns = False
+        self.t0 = time.time()
+        self.thread = threading.Thread(target=self.run, name='log_loader')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def streamable(self):
+        '''return True if the log can be read without scanning it first'''
+        lname = self.filename.lower()
+        if lname.endswith('.bin') or lname.endswith('.px4log'):
+            return False
+        if lname.endswith('.log') and DFReader.DFReader_is_text_log(self.filename):
+            return False
+        return True
+
+    def progress(self, pct):
+        self.percent = pct
+
+    def stop(self):
+        '''stop reading, when another log is loaded'''
+        self.stopped = True
+
+    def run(self):
+        try:
+            self.load()
+        except Exception as ex:
+            self.error = ex
+        self.done = True
+
+    def open_log(self, progress_callback=None):
+        return mavutil.mavlink_connection(self.filename, notimestamps=False,
+                                          zero_time_base=False,
+                                          progress_callback=progress_callback)
+
+    def start_columns(self, open_reader):
+        '''read the log into columns in another thread, from the reader
+        returned by open_reader'''
+        def read():
+            try:
+                self.read_columns(open_reader())
+            except Exception as ex:
+                self.error = ex
+        self.column_thread = threading.Thread(target=read, name='log_columns')
+        self.column_thread.daemon = True
+        self.column_thread.start()
+
+    def load(self):
+        signature = mp_logcache.log_signature(self.filename)
+        self.columns = mp_logcache.cached_columns(self.filename)
+        built = self.columns is None
+        if built and self.streamable():
+            self.start_columns(lambda: mavutil.mavlogfile(self.filename))
+        self.stage = 'Scanning'
+        self.percent = 0
+        mlog = self.open_log(self.progress)
+        if self.stopped:
+            return
+        mlog.flightmode_list()
+        self.mlog = mlog
+        if built and self.column_thread is None:
+            self.start_columns(self.open_log)
+        if self.column_thread is not None:
+            self.stage = 'Reading'
+            while self.column_thread.is_alive():
+                self.percent = self.read_percent
+                self.column_thread.join(0.1)
+        if self.stopped or self.error is not None:
+            return
+        if built and self.save_columns:
+            mp_logcache.save_columns(self.filename, self.columns, signature)
+
+    def read_columns(self, reader):
+        '''read all messages from reader into columns'''
+        last_flush = time.time()
+        while not self.stopped:
+            m = reader.recv_msg()
+            if m is None:
+                break
+            self.builder.add(m)
+            if self.builder.count % 1000 == 0:
+                self.read_percent = getattr(reader, 'percent', 0)
+                now = time.time()
+                if now - last_flush >= 1:
+                    # make the new messages available to graphs
+                    self.builder.flush()
+                    last_flush = now
+        self.msgs = dict(reader.messages)
+        self.columns = self.builder.finish()
+
+    def partial_columns(self):
+        '''return the columns for the part of the log read so far'''
+        if self.columns is not None:
+            return self.columns
+        return self.builder.columns()
+
 def have_graph(name):
     '''return true if we have a graph of the given name'''
     for g in mestate.graphs:
@@ -147,6 +283,7 @@ def flightmode_menu():
     global flightmodes
     ret = []
     idx = 0
+    mestate.flightmode_selections = []
     for (mode,t1,t2) in flightmodes:
         modestr = "%s %us" % (mode, (t2-t1))
         ret.append(MPMenuCheckbox(modestr, modestr, 'mode-%u' % idx))
@@ -308,6 +445,9 @@ def cmd_graph(args):
     else:
         expression = ' '.join(args)
         mestate.last_graph = GraphDefinition(mestate.settings.title, expression, '', [expression], None)
+    if mestate.loader is not None:
+        mestate.columns = mestate.loader.partial_columns()
+        mestate.console.write("Log is still loading, graph will be refreshed\n")
     grui.append(Graph_UI(mestate))
     grui[-1].display_graph(mestate.last_graph, flightmode_colours())
     global last_xlim
@@ -317,6 +457,8 @@ def cmd_graph(args):
 
 def cmd_map(args):
     '''map command'''
+    if not log_loaded():
+        return
     import mavflightview
     #mestate.mlog.reduce_by_flightmodes(mestate.flightmode_selections)
     #setup and process the map
@@ -326,7 +468,8 @@ def cmd_map(args):
     options.show_flightmode_legend = mestate.settings.show_flightmode
     if len(args) > 0:
         options.types = ','.join(args)
-    [path, wp, fen, used_flightmodes, mav_type] = mavflightview.mavflightview_mav(mestate.mlog, options, mestate.flightmode_selections)
+    [path, wp, fen, used_flightmodes, mav_type] = mavflightview.mavflightview_mav(mestate.mlog, options, mestate.flightmode_selections,
+                                                                                    columns=full_columns())
     child = multiproc.Process(target=mavflightview.mavflightview_show, args=[path, wp, fen, used_flightmodes, mav_type, options])
     child.start()
     mestate.mlog.rewind()
@@ -460,12 +603,8 @@ def cmd_messages(args):
             wildcard = "*" + wildcard + "*"
     else:
         wildcard = '*'
-    mestate.mlog.rewind()
-    types = set(['MSG','STATUSTEXT'])
-    while True:
-        m = mestate.mlog.recv_match(type=types, condition=mestate.settings.condition)
-        if m is None:
-            break
+
+    def show_message(m):
         if m.get_type() == 'MSG':
             mstr = m.Message
         else:
@@ -473,6 +612,52 @@ def cmd_messages(args):
         if fnmatch.fnmatch(mstr.upper(), wildcard.upper()):
             tstr = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(m._timestamp))
             print("%s %s" % (tstr, mstr))
+
+    def show_messages(msgs, masks):
+        # masks give the messages of each type the condition holds at
+        counts = dict.fromkeys(TEXT_TYPES, 0)
+        for m in msgs:
+            if masks is not None:
+                mtype = m.get_type()
+                mask = masks.get(mtype, [])
+                n = counts[mtype]
+                counts[mtype] += 1
+                if n >= len(mask) or not mask[n]:
+                    continue
+            show_message(m)
+
+    condition = mestate.settings.condition
+    loading = mestate.mlog is None and mestate.loader is not None
+    if loading:
+        columns = mestate.loader.partial_columns()
+    else:
+        columns = full_columns()
+    masks = None
+    if condition and columns is not None:
+        # evaluate the condition over whole columns rather than per message
+        masks = mp_colexpr.condition_masks(condition, columns, TEXT_TYPES)
+
+    if loading:
+        # show the messages read so far
+        if condition and masks is None:
+            print("Condition is ignored until the log has loaded")
+        show_messages(mestate.loader.builder.kept[:], masks)
+        print("Log is still loading (%u messages read)" % mestate.loader.builder.count)
+        return
+
+    def log_messages():
+        if masks is None:
+            match_condition = condition
+        else:
+            match_condition = None
+        while True:
+            m = mestate.mlog.recv_match(type=TEXT_TYPES, condition=match_condition)
+            if m is None:
+                return
+            yield m
+
+    mestate.mlog.rewind()
+    show_messages(log_messages(), masks)
     mestate.mlog.rewind()
 
 def cmd_param(args):
@@ -481,6 +666,8 @@ def cmd_param(args):
         wildcard = args[0]
     else:
         wildcard = '*'
+    if not log_loaded():
+        return
     k = sorted(mestate.mlog.params.keys())
     for p in k:
         if fnmatch.fnmatch(str(p).upper(), wildcard.upper()):
@@ -488,6 +675,8 @@ def cmd_param(args):
 
 def cmd_devid(args):
     '''show parameters'''
+    if not log_loaded():
+        return
     params = mestate.mlog.params
     k = sorted(params.keys())
     for p in k:
@@ -511,23 +700,106 @@ def cmd_loadfile(args):
     loadfile(fileargs.strip('"'))
 
 def loadfile(args):
-    '''load a log file (path given by arg)'''
+    '''load a log file (path given by arg). The log is read in the
+    background, see check_loader()'''
     mestate.console.write("Loading %s...\n" % args)
-    t0 = time.time()
-    mlog = mavutil.mavlink_connection(args, notimestamps=False,
-                                      zero_time_base=False,
-                                      progress_callback=progress_bar)
+    if mestate.loader is not None:
+        mestate.loader.stop()
+    global flightmodes
+    flightmodes = []
     mestate.filename = args
-    mestate.mlog = mlog
-    mestate.status.msgs = mlog.messages
-    t1 = time.time()
-    mestate.console.write("\ndone (%u messages in %.1fs)\n" % (mestate.mlog._count, t1-t0))
+    mestate.mlog = None
+    mestate.columns = None
+    mestate.status.msgs = {}
+    mestate.loader = LogLoader(args, mestate.save_columns)
+
+def full_columns():
+    '''return the columns of the whole log, or None if they are still
+    being read'''
+    if mestate.loader is not None:
+        return mestate.loader.columns
+    return mestate.columns
+
+def log_loaded():
+    '''return True if a log has been scanned, otherwise say why not'''
+    if mestate.mlog is not None:
+        return True
+    if mestate.loader is not None:
+        print("Log is still loading (%s %u%%)" % (mestate.loader.stage.lower(), mestate.loader.percent))
+    else:
+        print("No log loaded")
+    return False
 
+def refresh_graphs():
+    '''redraw graphs that were drawn from part of a log'''
+    global grui
+    if not [g for g in grui if g.partial]:
+        return
+    if mestate.loader is not None:
+        mestate.columns = mestate.loader.partial_columns()
+    colourmap = flightmode_colours()
+    new_grui = []
+    for g in grui:
+        if g.partial:
+            g.flightmode_colourmap = colourmap
+            if not g.refresh():
+                # closed by the user
+                continue
+        new_grui.append(g)
+    grui = new_grui
+    mestate.last_refresh = time.time()
+    if mestate.loader is not None:
+        mestate.refresh_count = mestate.loader.builder.flushed_count
+
+def check_loader():
+    '''show the progress of a log loading in the background, and use
+    the data read so far'''
     global flightmodes
-    flightmodes = mlog.flightmode_list()
+    loader = mestate.loader
+    if loader.stage != mestate.load_stage:
+        mestate.load_stage = loader.stage
+        mestate.load_progress = 0
+        mestate.console.write("\n%s " % loader.stage)
+    while mestate.load_progress < int(loader.percent):
+        mestate.load_progress += 1
+        progress_bar(mestate.load_progress)
+
+    if loader.mlog is not None and mestate.mlog is None:
+        # the log has been scanned, so commands can use it while the
+        # columns are still being read
+        mlog = loader.mlog
+        mestate.mlog = mlog
+        mestate.status.msgs = mlog.messages
+        mestate.console.write("\nscanned (%u messages in %.1fs)\n" % (mlog._count, time.time()-loader.t0))
+        flightmodes = mlog.flightmode_list()
+        load_graphs()
+        setup_menus()
+
+    if loader.done:
+        mestate.loader = None
+        if loader.error is not None:
+            mestate.console.writeln("\nFailed to load %s: %s" % (loader.filename, loader.error))
+            if mestate.mlog is None:
+                return
+        mestate.columns = loader.columns
+        mestate.console.write("\ndone (%u messages in %.1fs)\n" % (mestate.mlog._count, time.time()-loader.t0))
+        refresh_graphs()
+        return
 
-    load_graphs()
-    setup_menus()
+    if loader.msgs is not None and not loader.reported_columns:
+        # all columns are ready, but the log is still being scanned
+        loader.reported_columns = True
+        mestate.console.write("\ncolumns ready (%u messages in %.1fs)\n" % (
+            loader.builder.count, time.time()-loader.t0))
+        if mestate.mlog is None:
+            mestate.status.msgs = loader.msgs
+            load_graphs()
+            setup_menus()
+        refresh_graphs()
+    elif (mestate.settings.load_refresh > 0 and
+          time.time() - mestate.last_refresh >= mestate.settings.load_refresh and
+          mestate.refresh_count != loader.builder.flushed_count):
+        refresh_graphs()
 
 def process_stdin(line):
     '''handle commands from user'''
@@ -582,6 +854,9 @@ def main_loop():
             for c in cmds:
                 process_stdin(c)
 
+        if mestate.loader is not None:
+            check_loader()
+
         for i in range(0, len(grui)):
             xlim = grui[i].check_xlim_change()
             if xlim is not None and mestate.settings.sync_xzoom:
@@ -626,6 +901,7 @@ if __name__ == "__main__":
     from argparse import ArgumentParser
     parser = ArgumentParser(description=__doc__)
     parser.add_argument("--version", action='store_true', help="show version")
+    parser.add_argument("--no-cache", action='store_true', help="don't save log columns next to the log")
     parser.add_argument("files", metavar="<FILE>", nargs="?")
     args = parser.parse_args()
 
@@ -642,6 +918,7 @@ if __name__ == "__main__":
         sys.exit(1)
     
     mestate = MEState()
+    mestate.save_columns = not args.no_cache
     setup_file_menu()
 
     mestate.rl = rline.rline("MAV> ", mestate)
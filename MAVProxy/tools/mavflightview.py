@@ -11,11 +11,17 @@ from math import *
 
 from pymavlink import mavutil, mavwp, mavextra
 from MAVProxy.modules.mavproxy_map import mp_slipmap, mp_tile
+from MAVProxy.modules.lib import mp_colexpr
+from MAVProxy.modules.lib import mp_intervals
+from MAVProxy.modules.lib import mp_logcache
 from MAVProxy.modules.lib import mp_util
+from MAVProxy.modules.lib import mp_tlogindex
 from MAVProxy.modules.lib import multiproc
+import copy
 import functools
 
 import cv2
+import numpy
 
 def create_map(title):
     '''create map object'''
@@ -225,19 +231,126 @@ def colour_for_flightmode(mav_type, fmode, instance=0):
     colour = (r,g,b)
     return colour
 
-def mavflightview_mav(mlog, options=None, flightmode_selections=[]):
-    '''create a map for a log file'''
+def log_messages(mlog, types):
+    '''generate the messages of the given types from a log'''
+    while True:
+        try:
+            m = mlog.recv_match(type=types)
+        except Exception:
+            return
+        if m is None:
+            return
+        yield m
+
+# latitude field, longitude field and scale of the position message types
+# that mavflightview_mav() can read from log columns. Other types are
+# taken to have lat and lon in 1e-7 degrees
+column_position_fields = {
+    'GPS'   : ('Lat', 'Lng', 1.0),
+    'GPS2'  : ('Lat', 'Lng', 1.0),
+    'AHR2'  : ('Lat', 'Lng', 1.0),
+    'POS'   : ('Lat', 'Lng', 1.0),
+    'CHEK'  : ('Lat', 'Lng', 1.0),
+    'ORGN'  : ('Lat', 'Lng', 1.0),
+    'SIM'   : ('Lat', 'Lng', 1.0),
+    'AHRS2' : ('lat', 'lng', 1.0e-7),
+    'ANU5'  : ('Alat', 'Alng', 1.0e-7),
+}
+
+def path_from_columns(columns, types, options, flightmode_selections, mav_type):
+    '''extract the flight path from log columns, giving the same points
+    as reading the position messages one at a time in
+    mavflightview_mav(). Returns (path, used_flightmodes), or None if the
+    options need the messages to be read one at a time'''
+    if options.rate != 0 or getattr(options, "colour_source", "flightmode") != "flightmode":
+        return None
+    # points are coloured by the flight mode at their time
+    modes = mp_intervals.flightmode_intervals(getattr(options, '_flightmodes', []))
+    if modes is None:
+        return None
+    masks = None
+    if options.condition is not None:
+        masks = mp_colexpr.condition_masks(options.condition, columns, types)
+        if masks is None:
+            return None
+    mode_ok = numpy.ones(len(modes), dtype=bool)
+    if options.mode is not None:
+        mode_ok = numpy.array([str(mode).lower() == options.mode.lower() for mode in modes.labels])
+    if True in flightmode_selections:
+        n = min(len(modes), len(flightmode_selections))
+        selected = numpy.zeros(len(modes), dtype=bool)
+        selected[:n] = flightmode_selections[:n]
+        mode_ok &= selected
+
+    used_modes = set()
+    # (first message number, type, lat, lng, mode index) for each type
+    found = []
+    for mtype in set(types):
+        if mtype in ['MISSION_ITEM', 'CMD']:
+            continue
+        seq = columns.sequence(mtype)
+        if seq is None:
+            continue
+        if mtype in ['EKF1', 'ANU1', 'NKF1']:
+            # positions are calculated from the EKF origin
+            return None
+        (latname, lngname, scale) = column_position_fields.get(mtype, ('lat', 'lon', 1.0e-7))
+        lat = columns.column(mtype, latname)
+        lng = columns.column(mtype, lngname)
+        if lng is None and mtype in ['GPS', 'GPS2']:
+            lng = columns.column(mtype, 'Lon')
+        if lat is None or lng is None:
+            return None
+        mode_idx = modes.locate(columns.timestamps(mtype))
+        keep = mode_ok[mode_idx]
+        if masks is not None:
+            keep &= masks[mtype]
+        used_modes.update(numpy.unique(mode_idx[keep]).tolist())
+        if mtype in ['GPS', 'GPS2']:
+            status = columns.column(mtype, 'Status')
+            if status is None:
+                status = columns.column(mtype, 'FixType')
+            if status is None:
+                return None
+            keep &= status >= 2
+        if not numpy.any(keep):
+            continue
+        first = seq[keep][0]
+        lat = lat[keep] * scale
+        lng = lng[keep] * scale
+        mode_idx = mode_idx[keep]
+        nonzero = (numpy.abs(lat) > 0.01) | (numpy.abs(lng) > 0.01)
+        found.append((first, mtype, lat[nonzero], lng[nonzero], mode_idx[nonzero]))
+
+    # instances are numbered in the order their types first appear
+    path = [[]]
+    found.sort(key=lambda f: f[0])
+    for instance in range(len(found)):
+        (first, mtype, lat, lng, mode_idx) = found[instance]
+        colours = [colour_for_flightmode(mav_type, mode, instance) for mode in modes.labels]
+        points = list(zip(lat.tolist(), lng.tolist(), [colours[i] for i in mode_idx.tolist()]))
+        if instance == 0:
+            path[0] = points
+        else:
+            path.append(points)
+    used_flightmodes = dict([(modes.labels[i], 1) for i in used_modes])
+    return (path, used_flightmodes)
+
+def mavflightview_mav(mlog, options=None, flightmode_selections=[], index=None, columns=None):
+    '''create a map for a log file. If a tlog index is given then only
+    the needed messages are read from the log. If columns from
+    mp_logcache are given then the path is taken from them where
+    possible'''
     wp = mavwp.MAVWPLoader()
     if options.mission is not None:
         wp.load(options.mission)
     fen = mavwp.MAVFenceLoader()
     if options.fence is not None:
         fen.load(options.fence)
-    all_false = True
-    for s in flightmode_selections:
-        if s:
-            all_false = False
-    idx = 0
+    # flight mode segments to plot, if only some are selected
+    flightmode_index = None
+    if True in flightmode_selections:
+        flightmode_index = mp_intervals.flightmode_intervals(options._flightmodes)
     path = [[]]
     instances = {}
     ekf_counter = 0
@@ -271,14 +384,21 @@ def mavflightview_mav(mlog, options=None, flightmode_selections=[]):
     last_timestamps = {}
     used_flightmodes = {}
 
-    while True:
-        try:
-            m = mlog.recv_match(type=recv_match_types)
-            if m is None:
-                break
-        except Exception:
-            break
+    column_path = None
+    if columns is not None:
+        column_path = path_from_columns(columns, types, options,
+                                        flightmode_selections, getattr(mlog, 'mav_type', None))
+    if column_path is not None:
+        (path, used_flightmodes) = column_path
+        # only the mission needs to be read from the log
+        recv_match_types = ['MISSION_ITEM', 'CMD']
+
+    if index is not None:
+        messages = mp_tlogindex.indexed_messages(mlog, index, recv_match_types)
+    else:
+        messages = log_messages(mlog, recv_match_types)
 
+    for m in messages:
         type = m.get_type()
 
         if type == 'MISSION_ITEM':
@@ -316,73 +436,74 @@ def mavflightview_mav(mlog, options=None, flightmode_selections=[]):
             # may only be present for colour-source expressions to work
             continue
 
-        if not all_false and len(flightmode_selections) > 0 and idx < len(options._flightmodes) and m._timestamp >= options._flightmodes[idx][2]:
-            idx += 1
-        elif (idx < len(flightmode_selections) and flightmode_selections[idx]) or all_false or len(flightmode_selections) == 0:
-            used_flightmodes[mlog.flightmode] = 1
-            if type in ['GPS','GPS2']:
-                status = getattr(m, 'Status', None)
+        if flightmode_index is not None:
+            mode_idx = flightmode_index.locate_one(m._timestamp)
+            if mode_idx >= len(flightmode_selections) or not flightmode_selections[mode_idx]:
+                continue
+        used_flightmodes[mlog.flightmode] = 1
+        if type in ['GPS','GPS2']:
+            status = getattr(m, 'Status', None)
+            if status is None:
+                status = getattr(m, 'FixType', None)
                 if status is None:
-                    status = getattr(m, 'FixType', None)
-                    if status is None:
-                        print("Can't find status on GPS message")
-                        print(m)
-                        break
-                if status < 2:
-                    continue
-                # flash log
-                lat = m.Lat
-                lng = getattr(m, 'Lng', None)
+                    print("Can't find status on GPS message")
+                    print(m)
+                    break
+            if status < 2:
+                continue
+            # flash log
+            lat = m.Lat
+            lng = getattr(m, 'Lng', None)
+            if lng is None:
+                lng = getattr(m, 'Lon', None)
                 if lng is None:
-                    lng = getattr(m, 'Lon', None)
-                    if lng is None:
-                        print("Can't find longitude on GPS message")
-                        print(m)
-                        break
-            elif type in ['EKF1', 'ANU1']:
-                pos = mavextra.ekf1_pos(m)
-                if pos is None:
-                    continue
-                ekf_counter += 1
-                if ekf_counter % options.ekf_sample != 0:
-                    continue
-                (lat, lng) = pos
-            elif type in ['NKF1']:
-                pos = mavextra.ekf1_pos(m)
-                if pos is None:
-                    continue
-                nkf_counter += 1
-                if nkf_counter % options.nkf_sample != 0:
-                    continue
-                (lat, lng) = pos
-            elif type in ['ANU5']:
-                (lat, lng) = (m.Alat*1.0e-7, m.Alng*1.0e-7)
-            elif type in ['AHR2', 'POS', 'CHEK']:
-                (lat, lng) = (m.Lat, m.Lng)
-            elif type == 'AHRS2':
-                (lat, lng) = (m.lat*1.0e-7, m.lng*1.0e-7)
-            elif type == 'ORGN':
-                (lat, lng) = (m.Lat, m.Lng)
-            elif type == 'SIM':
-                (lat, lng) = (m.Lat, m.Lng)
-            else:
-                lat = m.lat * 1.0e-7
-                lng = m.lon * 1.0e-7
-
-            # automatically add new types to instances
-            if type not in instances:
-                instances[type] = len(instances)
-                while len(instances) >= len(path):
-                    path.append([])
-            instance = instances[type]
-
-            if abs(lat)>0.01 or abs(lng)>0.01:
-                colour = colour_for_point(mlog, (lat, lng), instance, options)
-                point = (lat, lng, colour)
-
-                if options.rate == 0 or not type in last_timestamps or m._timestamp - last_timestamps[type] > 1.0/options.rate:
-                    last_timestamps[type] = m._timestamp
-                    path[instance].append(point)
+                    print("Can't find longitude on GPS message")
+                    print(m)
+                    break
+        elif type in ['EKF1', 'ANU1']:
+            pos = mavextra.ekf1_pos(m)
+            if pos is None:
+                continue
+            ekf_counter += 1
+            if ekf_counter % options.ekf_sample != 0:
+                continue
+            (lat, lng) = pos
+        elif type in ['NKF1']:
+            pos = mavextra.ekf1_pos(m)
+            if pos is None:
+                continue
+            nkf_counter += 1
+            if nkf_counter % options.nkf_sample != 0:
+                continue
+            (lat, lng) = pos
+        elif type in ['ANU5']:
+            (lat, lng) = (m.Alat*1.0e-7, m.Alng*1.0e-7)
+        elif type in ['AHR2', 'POS', 'CHEK']:
+            (lat, lng) = (m.Lat, m.Lng)
+        elif type == 'AHRS2':
+            (lat, lng) = (m.lat*1.0e-7, m.lng*1.0e-7)
+        elif type == 'ORGN':
+            (lat, lng) = (m.Lat, m.Lng)
+        elif type == 'SIM':
+            (lat, lng) = (m.Lat, m.Lng)
+        else:
+            lat = m.lat * 1.0e-7
+            lng = m.lon * 1.0e-7
+
+        # automatically add new types to instances
+        if type not in instances:
+            instances[type] = len(instances)
+            while len(instances) >= len(path):
+                path.append([])
+        instance = instances[type]
+
+        if abs(lat)>0.01 or abs(lng)>0.01:
+            colour = colour_for_point(mlog, (lat, lng), instance, options)
+            point = (lat, lng, colour)
+
+            if options.rate == 0 or not type in last_timestamps or m._timestamp - last_timestamps[type] > 1.0/options.rate:
+                last_timestamps[type] = m._timestamp
+                path[instance].append(point)
     if len(path[0]) == 0:
         print("No points to plot")
         return None
@@ -404,8 +525,8 @@ def mavflightview_show(path, wp, fen, used_flightmodes, mav_type, options, title
     path_objs = []
     for i in range(len(path)):
         if len(path[i]) != 0:
-            path_objs.append(mp_slipmap.SlipPolygon('FlightPath[%u]-%s' % (i,title), path[i], layer='FlightPath',
-                                                    linewidth=2, colour=(255,0,180)))
+            path_objs.append(mp_slipmap.SlipPolyline('FlightPath[%u]-%s' % (i,title), path[i], layer='FlightPath',
+                                                     linewidth=2, colour=(255,0,180)))
     plist = wp.polygon_list()
     mission_obj = None
     if len(plist) > 0:
@@ -465,10 +586,35 @@ def mavflightview_show(path, wp, fen, used_flightmodes, mav_type, options, title
         else:
             print("colour-source: min=%f max=%f" % (colour_source_min, colour_source_max))
 
-def mavflightview(filename, options):
+def mavflightview_load(filename, options):
+    '''load the path, mission and fence from a log'''
     print("Loading %s ..." % filename)
-    mlog = mavutil.mavlink_connection(filename)
-    stuff = mavflightview_mav(mlog, options)
+    index = None
+    if filename.endswith('.tlog') and options.condition is None:
+        # conditions may need any message, so can't use the index
+        index = mp_tlogindex.load_index(filename)
+    columns = mp_logcache.cached_columns(filename)
+    if columns is not None:
+        # the path comes from the columns, coloured by flight mode
+        index = None
+        mlog = mavutil.mavlink_connection(filename)
+        # the flight modes are for this log only, and the options may be
+        # shared between logs
+        options = copy.copy(options)
+        options._flightmodes = getattr(options, '_flightmodes', [])
+        if not options._flightmodes and hasattr(mlog, 'flightmode_list'):
+            options._flightmodes = mlog.flightmode_list()
+    elif index is not None:
+        mlog = mavutil.mavlogfile(filename)
+    else:
+        mlog = mavutil.mavlink_connection(filename)
+    return mavflightview_mav(mlog, options, index=index, columns=columns)
+
+def mavflightview(filename, options, stuff=None):
+    '''show a log on a map. stuff is the result of mavflightview_load()
+    if the log has already been loaded'''
+    if stuff is None:
+        stuff = mavflightview_load(filename, options)
     if stuff is None:
         return
     [path, wp, fen, used_flightmodes, mav_type] = stuff
@@ -523,6 +669,7 @@ if __name__ == "__main__":
     parser.add_option("--rate", type='int', default=0, help="maximum message rate to display (0 means all points)")
     parser.add_option("--colour-source", type="str", default="flightmode", help="expression with range 0f..255f used for point colour")
     parser.add_option("--no-flightmode-legend", action="store_false", default=True, dest="show_flightmode_legend", help="hide legend for colour used for flight modes")
+    parser.add_option("--jobs", type='int', default=1, help="number of logs to load in parallel")
 
     (opts, args) = parser.parse_args()
 
@@ -533,5 +680,14 @@ if __name__ == "__main__":
     if opts.multi:
         multi_map = None
 
-    for f in args:
-        mavflightview(f, opts)
+    if opts.jobs > 1 and len(args) > 1:
+        # load the logs in worker processes, then show them in order
+        pool = multiproc.Pool(min(opts.jobs, len(args)))
+        pending = [pool.apply_async(mavflightview_load, (f, opts)) for f in args]
+        pool.close()
+        for i in range(len(args)):
+            mavflightview(args[i], opts, stuff=pending[i].get())
+        pool.join()
+    else:
+        for f in args:
+            mavflightview(f, opts)